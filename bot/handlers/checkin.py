@@ -11,10 +11,11 @@ from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKe
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, CallbackQueryHandler
 import asyncio
 
-from bot.utils.cached_db import DbCache
+from bot.utils.cached_db import DbCache, compact_log_txt
 from bot.scheduler import handle_successful_checkin
 from bot.utils.logger import logger
 from bot.utils.config import TELEGRAM_CHANNEL_ID
+from bot.utils.send_queue import LANE_CHANNEL, LANE_INTERACTIVE, send_message
 
 print('Loaded checkin_db.py')
 
@@ -65,38 +66,23 @@ async def send_checkin_announcement(user_id, username, date, bot):
     if not log_txt_json:
         logger.debug(f"[ANNOUNCE] No log_txt_json for {username} on {date}, skipping announcement.")
         return
-    summary_data = [(h["habit_text"], h["habit_status"]) for h in json.loads(log_txt_json)]
+    # DbCache keeps log_txt_json as ((habit_text, habit_status), ...)
+    summary_data = list(compact_log_txt(log_txt_json))
     print(f'[send_checkin_announcement] summary_data={summary_data}')
     if all(s == "⛔" for _, s in summary_data):
         logger.debug(f"[ANNOUNCE] All habits DND for {username} on {date}, skipping announcement.")
         return
     msg = format_checkin_announcement(username, date, summary_data)
-    await bot.send_message(chat_id=TELEGRAM_CHANNEL_ID, text=msg)
+    await send_message(bot, TELEGRAM_CHANNEL_ID, msg, lane=LANE_CHANNEL)
 
 async def log_and_announce_checkin(user_id, username, habits, responses, date, bot):
     print(f'[log_and_announce_checkin] user_id={user_id}, username={username}, date={date}, habits={habits}, responses={responses}')
     db = DbCache()
-    year_month = date.strftime('%Y%m')
-    habit_dicts = db.get_user_habits_for_month(user_id, year_month)
-    print(f'[log_and_announce_checkin] habit_dicts={habit_dicts}')
-    habit_text_to_id = {h['habit_text']: h['habit_id'] for h in habit_dicts}
-    print(f'[log_and_announce_checkin] habit_text_to_id={habit_text_to_id}')
-    checkins = []
-    for (habit_id, habit_text), status in zip(habits, responses):
-        checkins.append({
-            "for_date": date,
-            "year_month": year_month,
-            "user_id": user_id,
-            "username": username,
-            "habit_id": habit_id,
-            "habit_text": habit_text,
-            "habit_status": status,
-            "marked_by": "manual"
-        })
-    await db.log_checkin_to_db(checkins)
-    print('[log_and_announce_checkin] Called db.log_checkin_to_db')
-    DbCache.refresh_cache()
-    print('[log_and_announce_checkin] Refreshed cache')
+    statuses = [(habit_id, habit_text, status) for (habit_id, habit_text), status in zip(habits, responses)]
+    # One DB call: stores the habit rows and returns the derived core/streak rows,
+    # which submit_checkin_to_db also applies to the cache (no refresh needed)
+    score_rows = await db.submit_checkin_to_db(user_id, username, date, statuses)
+    logger.debug(f"[CHECKIN] {username} {date}: {len(score_rows)} score row(s) stored")
     await send_checkin_announcement(user_id, username, date, bot)
 
 DATE_SELECTION, HABIT_CHECKIN, DUAL_CHECKIN_PROMPT = range(3)
@@ -178,7 +164,7 @@ async def start_habit_checkin(update: Update, context: ContextTypes.DEFAULT_TYPE
         elif update.callback_query is not None:
             await update.callback_query.edit_message_text(message)
         else:
-            await context.bot.send_message(chat_id=user_id, text=message)
+            await send_message(context.bot, user_id, message, lane=LANE_INTERACTIVE)
         return ConversationHandler.END
     date_str = date.strftime("%Y-%m-%d")
     dnd_habits = []
@@ -198,13 +184,13 @@ async def start_habit_checkin(update: Update, context: ContextTypes.DEFAULT_TYPE
             message += f"⛔ {habit}\n"
         print(f'[start_habit_checkin] {message}')
         # Log all ⛔ for this date
-        await log_and_announce_checkin(user_id, username, [h[1] for h in habits], ["⛔"] * len(habits), date, context.bot)
+        await log_and_announce_checkin(user_id, username, habits, ["⛔"] * len(habits), date, context.bot)
         if update.message is not None:
             await update.message.reply_text(message)
         elif update.callback_query is not None:
             await update.callback_query.edit_message_text(message)
         else:
-            await context.bot.send_message(chat_id=user_id, text=message)
+            await send_message(context.bot, user_id, message, lane=LANE_INTERACTIVE)
         if len(dnd_habits) <= 2:
             await asyncio.sleep(5)
         return ConversationHandler.END
@@ -218,7 +204,7 @@ async def start_habit_checkin(update: Update, context: ContextTypes.DEFAULT_TYPE
         elif update.callback_query is not None:
             await update.callback_query.edit_message_text(info_message)
         else:
-            await context.bot.send_message(chat_id=user_id, text=info_message)
+            await send_message(context.bot, user_id, info_message, lane=LANE_INTERACTIVE)
         if len(dnd_habits) <= 2:
             await asyncio.sleep(5)
     # Store both habit_id and habit_text in state
@@ -271,9 +257,11 @@ async def ask_next_habit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif update.callback_query is not None:
         await update.callback_query.edit_message_text(message, reply_markup=keyboard, parse_mode='Markdown')
     else:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=message,
+        await send_message(
+            context.bot,
+            user_id,
+            message,
+            lane=LANE_INTERACTIVE,
             reply_markup=keyboard,
             parse_mode='Markdown'
         )
@@ -314,7 +302,7 @@ async def complete_checkin(query, context, state):
     )
     yesterday_date = datetime.now().date() - timedelta(days=1)
     if state["date"] == yesterday_date:
-        handle_successful_checkin(user_id)
+        handle_successful_checkin(user_id, state["date"])
         logger.info(f"✅ User {user_id} checked in for yesterday, reset reminder count")
     else:
         logger.info(f"✅ User {user_id} checked in for {state['date']}, reminder count unchanged")
@@ -323,9 +311,11 @@ async def complete_checkin(query, context, state):
     logger.story(f"✅ @{state['username']} completed check-in for {state['date']} ({completed_count}/{total_count} habits done)")
     await query.edit_message_text(f"✅ Check-in completed for {state['date'].strftime('%Y-%m-%d')}!")
     try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="",
+        await send_message(
+            context.bot,
+            user_id,
+            "",
+            lane=LANE_INTERACTIVE,
             reply_markup=ReplyKeyboardRemove(selective=False)
         )
     except Exception as e:
@@ -359,9 +349,11 @@ async def handle_dual_checkin_response(update: Update, context: ContextTypes.DEF
     if response == "no":
         await query.edit_message_text("✅ Check-in session completed!")
         try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="",
+            await send_message(
+                context.bot,
+                user_id,
+                "",
+                lane=LANE_INTERACTIVE,
                 reply_markup=ReplyKeyboardRemove(selective=False)
             )
         except Exception as e:
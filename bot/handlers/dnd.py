@@ -50,14 +50,19 @@ async def _apply_pending_dnd_changes(context):
     db = context.user_data.get('db')
     changes = context.user_data.get('pending_dnd_changes', [])
     print('[DND_V2] Applying pending DND changes:', changes)
+    # Cached rows carry ids reserved from the DB sequence, so the cache already
+    # matches the DB after these writes; only a temporary (negative) id needs a reload
+    needs_refresh = False
     for op, data in changes:
         if op == 'add':
             await db.add_dnd_period_to_db(**data)
+            needs_refresh = needs_refresh or not (data.get('dnd_log_id') or 0) > 0
         elif op == 'edit':
             await db.update_dnd_entry_in_db(**data)
         elif op == 'delete':
             await db.delete_dnd_entry_in_db(data['dnd_log_id'])
-    DbCache.refresh_cache()
+    if needs_refresh:
+        DbCache.refresh_cache()
     context.user_data['pending_dnd_changes'] = []
     print('[DND_V2] Pending DND changes after apply:', context.user_data['pending_dnd_changes'])
 
@@ -246,8 +251,9 @@ async def handle_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE
         current_month = datetime.now().strftime("%Y%m")
         for habit_idx in selected_habits:
             habit = habits[habit_idx - 1]
-            db.add_dnd_period_to_cache(current_month, username, user_id, habit["habit_id"], habit["habit_text"], start_date, end_date)
+            dnd_log_id = db.add_dnd_period_to_cache(current_month, username, user_id, habit["habit_id"], habit["habit_text"], start_date, end_date)
             _record_pending(context, 'add', {
+                'dnd_log_id': dnd_log_id,
                 'year_month': current_month,
                 'username': username,
                 'user_id': user_id,
@@ -13,6 +13,7 @@ import re
 from bot.utils.cached_db import DbCache
 from utils.config import TELEGRAM_CHANNEL_ID
 from utils.logger import get_logger
+from bot.utils.send_queue import LANE_CHANNEL, send_message
 
 logger = get_logger("sethabits_db")
 
@@ -31,7 +32,7 @@ def format_habit_announcement(username, habits, yyyymm):
 async def send_habit_announcement(username, habits, yyyymm, bot):
     try:
         msg = format_habit_announcement(username, habits, yyyymm)
-        await bot.send_message(chat_id=TELEGRAM_CHANNEL_ID, text=msg)
+        await send_message(bot, TELEGRAM_CHANNEL_ID, msg, lane=LANE_CHANNEL)
         logger.story(f"📢 Habit announcement sent for @{username} ({len(habits)} habits)")
     except Exception as e:
         logger.error(f"❌ Failed to send habit announcement for {username}: {e}")
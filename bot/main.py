@@ -21,9 +21,10 @@ from handlers.sethabits import set_habits_db_handler
 from handlers.checkin import checkin_db_handler
 from handlers.dnd import dnd_db_v2_handler
 # Use the DB-backed scheduler
-from scheduler import launch_scheduler
+from bot.scheduler import launch_scheduler
 from utils.logger import get_logger
-from utils.cached_db import DbCache
+from bot.utils.cached_db import DbCache
+from bot.utils.send_queue import LANE_BULK, SendQueueRateLimiter, send_message, send_queue
 
 # Suppress PTBUserWarning about per_message settings - must be done before importing telegram
 warnings.filterwarnings("ignore", category=UserWarning, module="telegram.ext._conversationhandler")
@@ -87,15 +88,9 @@ async def error_handler(update, context):
         return
 
     if isinstance(context.error, RetryAfter):
-        logger.error(f"⏳ Rate limited, retry after {context.error.retry_after} seconds")
-        # Inform user about Telegram rate limiting
-        if update and update.effective_message:
-            try:
-                await update.effective_message.reply_text(
-                    "⏳ The bot is being rate limited by Telegram. Please wait a moment and try again."
-                )
-            except Exception as e:
-                logger.error(f"❌ Could not send rate limit message to user: {e}")
+        # Queued sends already pause and retry on RetryAfter (see send_queue);
+        # replying to the user here would only spend more of the flood quota
+        logger.error(f"⏳ Rate limited, retry after {context.error.retry_after} seconds, queue {send_queue.snapshot()}")
         return
 
     # Handle Google Sheets API errors
@@ -146,9 +141,11 @@ async def clear_all_keyboard_states(app, is_startup=True):
                     continue
                 user_id = int(user_id_val)
                 # Send a silent message with ReplyKeyboardRemove to clear any lingering keyboards
-                await app.bot.send_message(
-                    chat_id=user_id,
-                    text="",  # Empty message
+                await send_message(
+                    app.bot,
+                    user_id,
+                    "",  # Empty message
+                    lane=LANE_BULK,
                     reply_markup=ReplyKeyboardRemove(selective=False)
                 )
                 cleared_count += 1
@@ -184,6 +181,7 @@ async def run_bot():
         .read_timeout(30.0)     # 30 seconds read timeout
         .write_timeout(30.0)    # 30 seconds write timeout
         .pool_timeout(30.0)     # 30 seconds pool timeout
+        .rate_limiter(SendQueueRateLimiter())  # replies share the send queue's global limit
         .build()
     )
 
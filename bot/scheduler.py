@@ -1,26 +1,68 @@
 # DB-backed scheduler (scheduler_db.py)
 import os
+import time
+import zlib
 import asyncio
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, NamedTuple
 import pytz
 from telegram import Bot
-from utils.cached_db import DbCache
+# The handlers' cache: check-ins, registrations and new habits show up here without a reload
+from bot.utils.cached_db import DbCache
 from utils.logger import get_logger
 from utils.exceptions import SchedulerError
 
 # Initialize logger
 logger = get_logger("scheduler_db")
 
+from bot.utils.rows import Row
+from bot.utils.log_maintenance import maybe_run_log_maintenance
+from bot.utils.cache_verifier import maybe_verify_cache
+from bot.utils.sheets_export import maybe_export_scores
+from bot.utils.event_queue import scheduler_events
+from bot.utils import clock
+from bot.utils.send_queue import LANE_BULK, LANE_CHANNEL, send_message
+from bot.utils.scheduler_state import scheduler_state
+from bot.utils.scheduler_leases import scheduler_leases
+from bot.utils.scheduler_stats import scheduler_stats
 from bot.utils.config import (
     SCHEDULER_START_HHMM, SCHEDULER_INTERVAL_HHMMSSS, SCHEDULER_RECHECK_MIN,
     SCHEDULER_AUTOMARK_HHMM, TIME_FOR_UPDATE, TELEGRAM_CHANNEL_ID
 )
 
+# Full re-plan of every user (new registrations, changed timezones or habits)
+SCHEDULER_RESYNC_MIN = float(os.getenv("SCHEDULER_RESYNC_MIN", "60"))
+
+# Event keys besides ('user', user_id)
+SUMMARY_EVENT = 'summary'
+RESYNC_EVENT = 'resync'
+MAINTENANCE_EVENT = 'maintenance'
+LEASE_EVENT = 'leases'
+
+# Summaries/auto-marks the scheduler slept through are still done up to this late
+SCHEDULER_CATCHUP_MIN = float(os.getenv("SCHEDULER_CATCHUP_MIN", "180"))
+# Waking up this late means the loop stalled: re-plan everyone (and catch up)
+SCHEDULER_LAG_RESYNC_SEC = float(os.getenv("SCHEDULER_LAG_RESYNC_SEC", "120"))
+
+# Users whose reminders/auto-marks are carried out at the same time
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "16"))
+
+# Minutes after SCHEDULER_START_HHMM over which a timezone's first reminders are spread
+SCHEDULER_JITTER_MIN = float(os.getenv("SCHEDULER_JITTER_MIN", "15"))
+
+# UserAction kinds
+ACTION_AUTOMARK = 'automark'
+ACTION_REMIND = 'remind'
+
 last_checkin_sent = {}
-last_auto_x_sent = {}
-summary_sent_today = None
-reminder_counts = {}
-last_reminder_time = {}
+# Persistent (bot.utils.scheduler_state); read them here, change them through scheduler_state
+last_auto_x_sent = scheduler_state.last_auto_x_sent
+reminder_counts = scheduler_state.reminder_counts
+last_reminder_time = scheduler_state.last_reminder_time
+checked_in = scheduler_state.checked_in
+failed_reminder_at = scheduler_state.failed_reminder_at
+failed_auto_mark_at = scheduler_state.failed_auto_mark_at
 
 def parse_hhmm(hhmm: str):
     return int(hhmm[:2]), int(hhmm[2:])
@@ -28,6 +70,84 @@ def parse_hhmm(hhmm: str):
 def get_yesterday_date(now_local):
     return now_local.date() - timedelta(days=1)
 
+def _minutes(hhmm: str) -> int:
+    hour, minute = parse_hhmm(hhmm)
+    return hour * 60 + minute
+
+# SCHEDULER_* times as minutes after local midnight, parsed once
+START_MINUTES = _minutes(SCHEDULER_START_HHMM)
+AUTOMARK_MINUTES = _minutes(SCHEDULER_AUTOMARK_HHMM)
+SUMMARY_MINUTES = _minutes(TIME_FOR_UPDATE)
+IST = pytz.timezone("Asia/Kolkata")
+# Capped so the third reminder, two rechecks after the first, still comes before the auto-mark
+JITTER_WINDOW_MIN = int(max(min(SCHEDULER_JITTER_MIN, AUTOMARK_MINUTES - START_MINUTES - 2 * SCHEDULER_RECHECK_MIN), 0))
+
+# Where a timezone's local time is in the scheduler's day
+PHASE_BEFORE_START = 'before_start'
+PHASE_REMINDERS = 'reminders'
+PHASE_AUTOMARK = 'automark'
+
+@lru_cache(maxsize=None)
+def get_zone(name: str):
+    try:
+        return pytz.timezone(name)
+    except Exception:
+        return IST
+
+def _local_ts(tz, day, minutes):
+    return tz.localize(datetime(day.year, day.month, day.day, minutes // 60, minutes % 60)).timestamp()
+
+class ZoneTick(NamedTuple):
+    """One timezone's view of a tick, computed once and shared by all its users."""
+    tz: object
+    now_local: datetime
+    yesterday: object
+    yesterday_str: str
+    year_month: str
+    first_of_month: object
+    current_minutes: int
+    phase: str
+    start_ts: float
+    automark_ts: float
+    tomorrow_start_ts: float
+    # Yesterday's auto-mark deadline (the one for the day before yesterday)
+    prev_automark_ts: float
+
+def zone_tick(name: str, now_utc: datetime) -> ZoneTick:
+    """now_utc is timezone-aware."""
+    tz = get_zone(name)
+    now_local = now_utc.astimezone(tz)
+    today = now_local.date()
+    yesterday = get_yesterday_date(now_local)
+    current_minutes = now_local.hour * 60 + now_local.minute
+    if current_minutes >= AUTOMARK_MINUTES:
+        phase = PHASE_AUTOMARK
+    elif current_minutes < START_MINUTES:
+        phase = PHASE_BEFORE_START
+    else:
+        phase = PHASE_REMINDERS
+    return ZoneTick(
+        tz, now_local, yesterday, yesterday.strftime("%Y-%m-%d"), yesterday.strftime("%Y%m"),
+        yesterday.replace(day=1), current_minutes, phase,
+        _local_ts(tz, today, START_MINUTES), _local_ts(tz, today, AUTOMARK_MINUTES),
+        _local_ts(tz, today + timedelta(days=1), START_MINUTES),
+        _local_ts(tz, yesterday, AUTOMARK_MINUTES),
+    )
+
+def reminder_jitter(user_id: int) -> int:
+    """
+    Seconds after the zone's reminder start at which this user's first reminder is due.
+    Derived from user_id alone, so it is the same every day, in every worker and
+    after restarts, and a timezone's users are spread evenly over the window. Whole
+    minutes, so a wave costs at most JITTER_WINDOW_MIN scheduler wake-ups per timezone.
+    """
+    if JITTER_WINDOW_MIN <= 0:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % JITTER_WINDOW_MIN * 60
+
+def user_zone_name(user) -> str:
+    return user.get("timezone") or user.get("Timezone") or "Asia/Kolkata"
+
 def format_reminder_message(username, yesterday_date, reminder_count, auto_mark_minutes_remaining=None):
     day_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
     day_name = day_names[yesterday_date.weekday()]
@@ -39,27 +159,24 @@ def format_reminder_message(username, yesterday_date, reminder_count, auto_mark_
         return base_message
 
 def reset_reminder_count(user_id):
-    if user_id in reminder_counts:
-        del reminder_counts[user_id]
-    if user_id in last_reminder_time:
-        del last_reminder_time[user_id]
+    scheduler_state.reset_user(user_id)
 
-def handle_successful_checkin(user_id):
+def handle_successful_checkin(user_id, for_date=None):
     reset_reminder_count(user_id)
+    if for_date is not None:
+        # The re-plan below must not depend on the cache having seen the check-in yet
+        scheduler_state.record_checkin(user_id, str(for_date))
+    # Re-plan the user now: the check-in cancels today's remaining reminders and auto-mark
+    scheduler_events.push(('user', user_id), clock.now())
     logger.info(f"✅ User {user_id} checked in for yesterday, reset reminder count")
 
 def daily_reset_if_needed():
-    global reminder_counts, last_reminder_time, summary_sent_today
-    now_utc = datetime.utcnow()
-    ist = pytz.timezone("Asia/Kolkata")
-    now_ist = pytz.utc.localize(now_utc).astimezone(ist)
-    if summary_sent_today is not None and summary_sent_today != now_ist.date():
-        reminder_counts.clear()
-        last_reminder_time.clear()
+    now_ist = clock.now_utc().astimezone(IST)
+    if scheduler_state.reset_day is not None and scheduler_state.reset_day != now_ist.date():
+        scheduler_state.start_day(now_ist.date())
         logger.story(f"🌅 New day started - resetting all reminder counts")
-        summary_sent_today = now_ist.date()
-    if summary_sent_today is None:
-        summary_sent_today = now_ist.date()
+    if scheduler_state.reset_day is None:
+        scheduler_state.start_day(now_ist.date())
 
 def format_streak_summary(streak_rows, day_number):
     lines = [f"🐍 Day {day_number} log", ""]
@@ -76,157 +193,489 @@ def format_streak_summary(streak_rows, day_number):
     lines.append("\nLet's do this!")
     return "\n".join(lines)
 
-async def check_and_prompt(bot: Bot):
-    global summary_sent_today
+async def check_and_prompt(bot: Bot, user_ids=None):
+    """
+    Post the daily summary when due and evaluate users for reminders and auto-marks.
+    user_ids limits the pass to those users (the ones whose events came due); None
+    evaluates everyone. Every evaluated user is re-planned in scheduler_events.
+
+    Deciding what each user needs only reads the cache, so it runs for everyone
+    first; the resulting sends and writes then run concurrently, at most
+    SCHEDULER_CONCURRENCY users at a time.
+
+    A full pass also catches up auto-mark deadlines that passed since the last
+    pass (scheduler_state.last_tick_at), e.g. while the bot was restarting; for
+    shards just taken over from a dead worker, since that worker's last pass
+    (scheduler_leases.last_tick_for).
+    """
     daily_reset_if_needed()
-    now_utc = datetime.utcnow()
-    ist = pytz.timezone("Asia/Kolkata")
-    now_ist = pytz.utc.localize(now_utc).astimezone(ist)
-    local_str = now_ist.strftime("%H:%M")
+    now_utc = clock.now_utc()
+    now_ist = now_utc.astimezone(IST)
     try:
         db = DbCache()
         users = db.get_all_users()
     except Exception as e:
         logger.error(f"❌ Error getting users from DB: {e}")
         return
-    summary_hour, summary_min = parse_hhmm(TIME_FOR_UPDATE)
-    if (now_ist.hour, now_ist.minute) == (summary_hour, summary_min):
-        if summary_sent_today != now_ist.date():
-            try:
-                streak_rows = db.get_streak_summary(now_ist.date())
-                summary = format_streak_summary(streak_rows, (now_ist - datetime(now_ist.year, now_ist.month, 1, tzinfo=ist)).days + 1)
-                await bot.send_message(chat_id=TELEGRAM_CHANNEL_ID, text=summary)
-                summary_sent_today = now_ist.date()
-                logger.story(f"📊 Daily summary posted to channel")
-            except Exception as e:
-                logger.error(f"❌ Error sending summary: {e}")
+    # With several scheduler workers only the leader posts the summary (bot/utils/scheduler_leases.py)
+    if scheduler_leases.is_leader:
+        await post_summary_if_due(bot, db, now_ist)
+    if user_ids is not None:
+        users = [u for u in users if int(u.get("user_id") or u.get("UserID") or 0) in user_ids]
+    if scheduler_leases.enabled:
+        # Users of shards this worker doesn't hold are left to their owner (and not re-planned here)
+        users = [u for u in users if scheduler_leases.owns(int(u.get("user_id") or u.get("UserID") or 0))]
+    last_tick = scheduler_state.last_tick_at if user_ids is None else None
+    # Local time, yesterday and phase are worked out once per timezone, not per user
+    zones: Dict[str, ZoneTick] = {}
+    catch_up: Dict[tuple, bool] = {}
+    pending = []
     for user in users:
+        name = user_zone_name(user)
+        zone = zones.get(name)
+        if zone is None:
+            zone = zones[name] = zone_tick(name, now_utc)
+        # A shard just taken over from a dead worker is caught up from that worker's last pass
+        tick = None
+        if user_ids is None:
+            tick = scheduler_leases.last_tick_for(int(user.get("user_id") or user.get("UserID") or 0), last_tick)
+        if (name, tick) not in catch_up:
+            catch_up[(name, tick)] = missed_automark(name, zone, tick)
+        actions = []
         try:
-            # Safely extract user_id and username
-            user_id = user.get("user_id") or user.get("UserID")
-            if user_id is None:
-                logger.error(f"User missing user_id: {user}")
-                continue
-            user_id = int(user_id)
-            username = user.get("username") or user.get("Username") or str(user_id)
-            timezone_str = user.get("timezone") or user.get("Timezone") or "Asia/Kolkata"
-            try:
-                tz = pytz.timezone(timezone_str)
-            except Exception:
-                tz = pytz.timezone("Asia/Kolkata")
-            now_local = pytz.utc.localize(now_utc).astimezone(tz)
-            yesterday_date = get_yesterday_date(now_local)
-            current_year_month = yesterday_date.strftime("%Y%m")
-            first_of_month = datetime.strptime(str(current_year_month) + "01", "%Y%m%d").date()
-            habits = db.get_user_habits_for_date(user_id, first_of_month)
-            if not isinstance(habits, list):
-                logger.error(f"Expected list of dicts for habits, got {type(habits)}: {habits}")
-                continue
-            core_habits = [h for h in habits if isinstance(h, dict) and h.get('habit_type') == 'core']
-            if not core_habits:
-                logger.debug(f"⏭️ Skipping @{username} - no core habits set up for {current_year_month}")
-                continue
-            if db.has_already_checked_in(user_id, yesterday_date.strftime("%Y-%m-%d")):
-                continue
-            current_reminder_count = reminder_counts.get(user_id, 0)
-            fallback_hour, fallback_min = parse_hhmm(SCHEDULER_AUTOMARK_HHMM)
-            fallback_minutes = fallback_hour * 60 + fallback_min
-            current_minutes = now_local.hour * 60 + now_local.minute
-            if current_minutes >= fallback_minutes:
-                last_auto = last_auto_x_sent.get(user_id)
-                if not last_auto or (now_local - last_auto).total_seconds() > 86400:
-                    has_checked_in = db.has_already_checked_in(user_id, yesterday_date.strftime("%Y-%m-%d"))
-                    if not has_checked_in:
-                        last_auto_x_sent[user_id] = now_local
-                        try:
-                            responses = []
-                            dnd_count = 0
-                            failed_count = 0
-                            date_str = yesterday_date.strftime("%Y-%m-%d")
-                            for habit in core_habits:
-                                habit_id = habit.get('habit_id')
-                                if habit_id is None:
-                                    continue
-                                if db.is_date_in_dnd_period(user_id, date_str, int(habit_id)):
-                                    responses.append("⛔")
-                                    dnd_count += 1
-                                else:
-                                    responses.append("❌")
-                                    failed_count += 1
-                            checkins = []
-                            for habit, status in zip(core_habits, responses):
-                                habit_id = habit.get('habit_id')
-                                habit_text = habit.get('habit_text', '')
-                                if habit_id is None:
-                                    continue
-                                checkins.append({
-                                    "for_date": date_str,
-                                    "year_month": current_year_month,
-                                    "user_id": user_id,
-                                    "username": username,
-                                    "habit_id": int(habit_id),
-                                    "habit_text": habit_text,
-                                    "habit_status": status,
-                                    "marked_by": "auto"
-                                })
-                            if checkins:
-                                await db.log_checkin_to_db(checkins)
-                                DbCache.refresh_cache()
-                            if dnd_count > 0 and failed_count > 0:
-                                message = f"⛔ Missed check-in. {failed_count} ❌ logged, {dnd_count} ⛔ (DND). Snake shrank by {failed_count}!"
-                            elif dnd_count > 0 and failed_count == 0:
-                                message = f"⛔ Missed check-in. All {dnd_count} habits were on DND (⛔). No snake impact!"
-                            else:
-                                message = f"⛔ Missed check-in. {failed_count} ❌ logged. Snake shrank by {failed_count}!"
-                            await bot.send_message(chat_id=user_id, text=message)
-                            reset_reminder_count(user_id)
-                            logger.story(f"❌ Auto-marked @{username} for missed check-in ({failed_count} failed, {dnd_count} DND)")
-                        except Exception as e:
-                            logger.error(f"Auto-mark error for {username}: {e}")
-                continue
-            start_hour, start_min = parse_hhmm(SCHEDULER_START_HHMM)
-            start_minutes = start_hour * 60 + start_min
-            if current_minutes < start_minutes:
-                continue
-            if current_reminder_count >= 3:
-                continue
-            last_reminder = last_reminder_time.get(user_id)
-            if last_reminder:
-                time_since_last = (now_local - last_reminder).total_seconds() / 60
-                if time_since_last < SCHEDULER_RECHECK_MIN:
-                    continue
-            if db.has_already_checked_in(user_id, yesterday_date.strftime("%Y-%m-%d")):
-                continue
+            if catch_up[(name, tick)]:
+                action = decide_catch_up(db, user, zone)
+                if action is not None:
+                    actions.append(action)
+            action = decide_user(db, user, zone)
+            if action is not None:
+                actions.append(action)
+        except Exception as e:
+            logger.error(f"User processing error for {user.get('username', 'Unknown')}: {e}")
+        if actions:
+            pending.append((user, zone, actions))
+            continue
+        try:
+            plan_user(db, user, zone)
+        except Exception as e:
+            logger.error(f"Planning error for {user.get('username', 'Unknown')}: {e}")
+    scheduler_state.record_tick(now_utc)
+    if user_ids is None:
+        scheduler_leases.caught_up()
+    if not pending:
+        return
+    # Every auto-mark due this tick is stored in one write before any notice goes out
+    automarks = [action for _, _, actions in pending for action in actions if action.kind == ACTION_AUTOMARK]
+    beaten = set()
+    if automarks:
+        try:
+            beaten = await store_auto_marks(db, automarks)
+        except Exception as e:
+            logger.error(f"Auto-mark error for {len(automarks)} user(s): {e}")
+            for action in automarks:
+                scheduler_state.record_auto_mark_failure(action.user_id, action.zone.now_local)
+            pending = [(user, zone, [a for a in actions if a.kind != ACTION_AUTOMARK]) for user, zone, actions in pending]
+        caught_up = sum(1 for action in automarks if action.marked_at is not None)
+        if caught_up:
+            scheduler_stats.record_caught_up('automark', caught_up)
+    slots = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+    await asyncio.gather(*(run_user(bot, db, user, zone, actions, slots, beaten) for user, zone, actions in pending))
+
+def last_summary_due(now_ist: datetime) -> datetime:
+    """The most recent TIME_FOR_UPDATE (IST) at or before now_ist."""
+    today = now_ist.date()
+    due = IST.localize(datetime(today.year, today.month, today.day, SUMMARY_MINUTES // 60, SUMMARY_MINUTES % 60))
+    return due if due <= now_ist else due - timedelta(days=1)
+
+async def post_summary_if_due(bot: Bot, db, now_ist: datetime):
+    """
+    Post the summary for the latest TIME_FOR_UPDATE unless it already went out. One the
+    scheduler slept through is still posted up to SCHEDULER_CATCHUP_MIN late, after
+    that it is counted as missed. Without a saved summary day (first run with
+    scheduler_state) nothing is caught up: the latest one is taken as posted.
+    """
+    due = last_summary_due(now_ist)
+    if scheduler_state.summary_day == due.date():
+        return
+    if scheduler_state.summary_day is None:
+        # No record of a gap; the previous deployment most likely posted it already
+        scheduler_state.record_summary(due.date())
+        logger.info(f"📊 No saved summary day, taking the {due.date()} summary as posted")
+        return
+    late_sec = (now_ist - due).total_seconds()
+    if late_sec > SCHEDULER_CATCHUP_MIN * 60:
+        if scheduler_stats.record_missed('summary', due.date()):
+            logger.error(f"❌ Daily summary for {due.date()} missed ({late_sec / 60:.0f}min late), not posting")
+        return
+    try:
+        streak_rows = db.get_streak_summary(due.date())
+        summary = format_streak_summary(streak_rows, due.day)
+        await send_message(bot, TELEGRAM_CHANNEL_ID, summary, lane=LANE_CHANNEL)
+        # Saved right away rather than with the tick: a restart must not post it twice
+        scheduler_state.record_summary(due.date())
+        await scheduler_state.flush()
+        if late_sec >= 60:
+            scheduler_stats.record_caught_up('summary')
+            logger.story(f"📊 Daily summary posted to channel ({late_sec / 60:.0f}min late)")
+        else:
+            logger.story(f"📊 Daily summary posted to channel")
+    except Exception as e:
+        logger.error(f"❌ Error sending summary: {e}")
+
+def missed_automark(name: str, zone: ZoneTick, last_tick) -> bool:
+    """
+    Whether the zone's auto-mark deadline for the day before yesterday passed without a
+    pass after it (last_tick is before it), so decide_catch_up has to make up for it.
+    Deadlines older than that can't be made up and are only counted.
+    """
+    if last_tick is None:
+        return False
+    last_tick_ts = last_tick.timestamp()
+    if last_tick_ts < zone.prev_automark_ts - 86400:
+        if scheduler_stats.record_missed('automark', (name, zone.yesterday)):
+            logger.error(f"❌ Scheduler was down since {last_tick}; auto-marks before yesterday in {name} were missed")
+    return last_tick_ts < zone.prev_automark_ts
+
+class UserAction(NamedTuple):
+    """What decide_user found one user needs this tick; carried out by apply_action."""
+    kind: str
+    user_id: int
+    username: str
+    zone: ZoneTick
+    message: str
+    checkins: list = None
+    failed_count: int = 0
+    dnd_count: int = 0
+    reminder_count: int = 0
+    for_date: str = None
+    # Set on catch-up auto-marks: the deadline they make up for
+    marked_at: datetime = None
+
+async def store_auto_marks(db, actions) -> set:
+    """
+    Write the ❌/⛔ rows of every auto-mark action with a single DbCache.auto_mark_to_db
+    call (one upsert, one targeted cache patch), then record the auto-marks that landed
+    in scheduler_state. Returns the (user_id, for_date) of the actions a manual check-in
+    beat, so none of their auto rows were written.
+    """
+    checkins = [c for action in actions for c in action.checkins or ()]
+    landed = await db.auto_mark_to_db(checkins) if checkins else []
+    written = {(row['user_id'], str(row['for_date'])) for row in landed if row['written']}
+    beaten = {(action.user_id, action.for_date) for action in actions
+              if action.checkins and (action.user_id, action.for_date) not in written}
+    # Only once the rows are stored: a failed write must leave the users due for another try
+    for action in actions:
+        if (action.user_id, action.for_date) not in beaten:
+            scheduler_state.record_auto_mark(action.user_id, action.marked_at or action.zone.now_local)
+    return beaten
+
+def core_habits_for(db, user_id: int, username: str, first_of_month):
+    habits = db.get_user_habits_for_date(user_id, first_of_month)
+    if not isinstance(habits, list):
+        logger.error(f"Expected list of dicts for habits, got {type(habits)}: {habits}")
+        return []
+    core_habits = [h for h in habits if isinstance(h, (dict, Row)) and h.get('habit_type') == 'core']
+    if not core_habits:
+        logger.debug(f"⏭️ Skipping @{username} - no core habits set up for {first_of_month.strftime('%Y%m')}")
+    return core_habits
+
+def auto_mark_action(db, user_id: int, username: str, zone: ZoneTick, core_habits, day, marked_at=None) -> UserAction:
+    """Mark every core habit of `day` ❌, or ⛔ where the user is on DND."""
+    responses = []
+    dnd_count = 0
+    failed_count = 0
+    date_str = day.strftime("%Y-%m-%d")
+    for habit in core_habits:
+        habit_id = habit.get('habit_id')
+        if habit_id is None:
+            continue
+        if db.is_date_in_dnd_period(user_id, date_str, int(habit_id)):
+            responses.append("⛔")
+            dnd_count += 1
+        else:
+            responses.append("❌")
+            failed_count += 1
+    checkins = []
+    for habit, status in zip(core_habits, responses):
+        habit_id = habit.get('habit_id')
+        habit_text = habit.get('habit_text', '')
+        if habit_id is None:
+            continue
+        checkins.append({
+            "for_date": date_str,
+            "year_month": day.strftime("%Y%m"),
+            "user_id": user_id,
+            "username": username,
+            "habit_id": int(habit_id),
+            "habit_text": habit_text,
+            "habit_status": status,
+            "marked_by": "auto"
+        })
+    if dnd_count > 0 and failed_count > 0:
+        message = f"⛔ Missed check-in. {failed_count} ❌ logged, {dnd_count} ⛔ (DND). Snake shrank by {failed_count}!"
+    elif dnd_count > 0 and failed_count == 0:
+        message = f"⛔ Missed check-in. All {dnd_count} habits were on DND (⛔). No snake impact!"
+    else:
+        message = f"⛔ Missed check-in. {failed_count} ❌ logged. Snake shrank by {failed_count}!"
+    if marked_at is not None:
+        message = f"{message} ({date_str})"
+    return UserAction(ACTION_AUTOMARK, user_id, username, zone, message, checkins=checkins,
+                      failed_count=failed_count, dnd_count=dnd_count, for_date=date_str, marked_at=marked_at)
+
+def _user_identity(user):
+    # Safely extract user_id and username
+    user_id = user.get("user_id") or user.get("UserID")
+    if user_id is None:
+        logger.error(f"User missing user_id: {user}")
+        return None, None
+    user_id = int(user_id)
+    return user_id, user.get("username") or user.get("Username") or str(user_id)
+
+def retry_at(failed_at: Dict[int, datetime], user_id: int) -> float:
+    """Epoch time before which a failed send/write for this user isn't tried again (0 if none failed)."""
+    failed = failed_at.get(user_id)
+    return failed.timestamp() + SCHEDULER_RECHECK_MIN * 60 if failed else 0.0
+
+def checked_in_yesterday(db, user_id: int, zone: ZoneTick) -> bool:
+    return checked_in.get(user_id) == zone.yesterday_str or db.has_already_checked_in(user_id, zone.yesterday_str)
+
+def decide_user(db, user, zone: ZoneTick):
+    """The UserAction this user needs now, or None. Reads the cache only; nothing is sent or written."""
+    user_id, username = _user_identity(user)
+    if user_id is None:
+        return None
+    now_local = zone.now_local
+    core_habits = core_habits_for(db, user_id, username, zone.first_of_month)
+    if not core_habits:
+        return None
+    if checked_in_yesterday(db, user_id, zone):
+        return None
+    current_reminder_count = reminder_counts.get(user_id, 0)
+    if zone.phase == PHASE_AUTOMARK:
+        last_auto = last_auto_x_sent.get(user_id)
+        if last_auto and (now_local - last_auto).total_seconds() <= 86400:
+            return None
+        if now_local.timestamp() < retry_at(failed_auto_mark_at, user_id):
+            return None
+        return auto_mark_action(db, user_id, username, zone, core_habits, zone.yesterday)
+    if zone.phase == PHASE_BEFORE_START:
+        return None
+    if current_reminder_count >= 3:
+        return None
+    last_reminder = last_reminder_time.get(user_id)
+    if last_reminder is None and now_local.timestamp() < zone.start_ts + reminder_jitter(user_id):
+        return None
+    if last_reminder:
+        time_since_last = (now_local - last_reminder).total_seconds() / 60
+        if time_since_last < SCHEDULER_RECHECK_MIN:
+            return None
+    if now_local.timestamp() < retry_at(failed_reminder_at, user_id):
+        return None
+    reminder_count = current_reminder_count + 1
+    auto_mark_minutes_remaining = AUTOMARK_MINUTES - zone.current_minutes
+    message = format_reminder_message(
+        username, zone.yesterday, reminder_count, 
+        auto_mark_minutes_remaining if reminder_count == 3 else None
+    )
+    return UserAction(ACTION_REMIND, user_id, username, zone, message, reminder_count=reminder_count)
+
+def decide_catch_up(db, user, zone: ZoneTick):
+    """
+    The auto-mark for the day before yesterday when its deadline (yesterday at
+    SCHEDULER_AUTOMARK_HHMM) passed with no scheduler running, or None. Like the
+    regular auto-mark it is idempotent: checked-in days are skipped and the upsert
+    never overwrites a stored row.
+    """
+    user_id, username = _user_identity(user)
+    if user_id is None:
+        return None
+    day = zone.yesterday - timedelta(days=1)
+    core_habits = core_habits_for(db, user_id, username, day.replace(day=1))
+    if not core_habits or db.has_already_checked_in(user_id, day.strftime("%Y-%m-%d")):
+        return None
+    marked_at = datetime.fromtimestamp(zone.prev_automark_ts, zone.tz)
+    return auto_mark_action(db, user_id, username, zone, core_habits, day, marked_at)
+
+async def run_user(bot: Bot, db, user, zone: ZoneTick, actions, slots: asyncio.Semaphore, beaten=frozenset()):
+    """Carry out one user's actions in order and then re-plan them; a failure stays with this user."""
+    async with slots:
+        for action in actions:
             try:
-                reminder_count = current_reminder_count + 1
-                auto_mark_minutes_remaining = fallback_minutes - current_minutes
-                message = format_reminder_message(
-                    username, yesterday_date, reminder_count, 
-                    auto_mark_minutes_remaining if reminder_count == 3 else None
-                )
-                await bot.send_message(chat_id=user_id, text=message)
-                reminder_counts[user_id] = reminder_count
-                last_reminder_time[user_id] = now_local
-                if reminder_count == 1:
-                    logger.story(f"⏰ Sending 1st check-in reminder to @{username} for yesterday ({yesterday_date.strftime('%Y-%m-%d')})")
-                elif reminder_count == 2:
-                    logger.story(f"⏰ 2nd reminder sent to @{username} ({SCHEDULER_RECHECK_MIN}min since last)")
-                elif reminder_count == 3:
-                    logger.story(f"⚠️  Final warning sent to @{username} - auto-mark in {auto_mark_minutes_remaining}min")
+                await apply_action(bot, db, action, (action.user_id, action.for_date) in beaten)
             except Exception as e:
-                logger.error(f"Reminder error for {username}: {e}")
+                logger.error(f"User processing error for {action.username}: {e}")
+    try:
+        plan_user(db, user, zone)
+    except Exception as e:
+        logger.error(f"Planning error for {user.get('username', 'Unknown')}: {e}")
+
+async def apply_action(bot: Bot, db, action: UserAction, beaten: bool = False):
+    """Send/record one UserAction; auto-mark rows were already stored by store_auto_marks."""
+    user_id, username, zone = action.user_id, action.username, action.zone
+    if action.kind == ACTION_AUTOMARK:
+        try:
+            if beaten:
+                # A manual /checkin landed first; it wins and there is nothing to announce
+                reset_reminder_count(user_id)
+                logger.info(f"✅ @{username} checked in before auto-mark, skipped")
+                return
+            await send_message(bot, user_id, action.message, lane=LANE_BULK)
+            reset_reminder_count(user_id)
+            logger.story(f"❌ Auto-marked @{username} for missed check-in ({action.failed_count} failed, {action.dnd_count} DND)")
         except Exception as e:
-            logger.error(f"User processing error for {user.get('username', 'Unknown')}: {e}")
+            logger.error(f"Auto-mark error for {username}: {e}")
+        return
+    try:
+        reminder_count = action.reminder_count
+        await send_message(bot, user_id, action.message, lane=LANE_BULK)
+        scheduler_state.record_reminder(user_id, reminder_count, zone.now_local)
+        if reminder_count == 1:
+            logger.story(f"⏰ Sending 1st check-in reminder to @{username} for yesterday ({zone.yesterday.strftime('%Y-%m-%d')})")
+        elif reminder_count == 2:
+            logger.story(f"⏰ 2nd reminder sent to @{username} ({SCHEDULER_RECHECK_MIN}min since last)")
+        elif reminder_count == 3:
+            logger.story(f"⚠️  Final warning sent to @{username} - auto-mark in {AUTOMARK_MINUTES - zone.current_minutes}min")
+    except Exception as e:
+        scheduler_state.record_reminder_failure(user_id, zone.now_local)
+        logger.error(f"Reminder error for {username}: {e}")
 
-async def scheduler_loop(app):
-    bot = app.bot
-    while True:
+def next_user_due(db, user, zone: ZoneTick) -> float:
+    """
+    Epoch time at which decide_user next has something to do for this user: the
+    start of the reminder window, the next reminder (SCHEDULER_RECHECK_MIN after
+    the last one), the auto-mark, or tomorrow's window once yesterday is settled.
+    Window starts are offset by the user's reminder_jitter; a failed reminder or
+    auto-mark is retried SCHEDULER_RECHECK_MIN after the failure (retry_at).
+    """
+    user_id = int(user.get("user_id") or user.get("UserID"))
+    jitter = reminder_jitter(user_id)
+    habits = db.get_user_habits_for_date(user_id, zone.first_of_month)
+    if not any(isinstance(h, (dict, Row)) and h.get('habit_type') == 'core' for h in habits):
+        return zone.tomorrow_start_ts + jitter
+    if checked_in_yesterday(db, user_id, zone):
+        return zone.tomorrow_start_ts + jitter
+    if zone.phase == PHASE_AUTOMARK:
+        last_auto = last_auto_x_sent.get(user_id)
+        if last_auto and (zone.now_local - last_auto).total_seconds() <= 86400:
+            if last_auto.astimezone(zone.tz).date() == zone.now_local.date():
+                return zone.tomorrow_start_ts + jitter
+            return last_auto.timestamp() + 86400 + 1
+        return max(zone.now_local.timestamp(), retry_at(failed_auto_mark_at, user_id))
+    if zone.phase == PHASE_BEFORE_START:
+        return zone.start_ts + jitter
+    if reminder_counts.get(user_id, 0) >= 3:
+        return zone.automark_ts
+    last_reminder = last_reminder_time.get(user_id)
+    if last_reminder:
+        due = last_reminder.timestamp() + SCHEDULER_RECHECK_MIN * 60
+    else:
+        due = max(zone.now_local.timestamp(), zone.start_ts + jitter)
+    # A failed send waits out the backoff; the auto-mark deadline still wins
+    return min(max(due, retry_at(failed_reminder_at, user_id)), zone.automark_ts)
+
+def plan_user(db, user, zone: ZoneTick):
+    user_id = user.get("user_id") or user.get("UserID")
+    if user_id is None:
+        return
+    user_id = int(user_id)
+    # Never re-plan into the past: an event that didn't act would otherwise spin
+    due = max(next_user_due(db, user, zone), clock.now() + 1)
+    scheduler_events.push(('user', user_id), due)
+
+def next_summary_time(now: float) -> float:
+    """Epoch time of the next TIME_FOR_UPDATE (IST) after `now`."""
+    now_ist = datetime.fromtimestamp(now, IST)
+    due = _local_ts(IST, now_ist.date(), SUMMARY_MINUTES)
+    if due <= now:
+        due = _local_ts(IST, now_ist.date() + timedelta(days=1), SUMMARY_MINUTES)
+    return due
+
+def maintenance_interval_sec() -> int:
+    return int(SCHEDULER_INTERVAL_HHMMSSS[:2]) * 3600 + int(SCHEDULER_INTERVAL_HHMMSSS[2:4]) * 60
+
+async def start_scheduler():
+    """Claim shards, load the state from before the restart and queue the first events."""
+    # Claim shards first, then load the reminder counts, auto-marks and summary day from before the restart
+    await scheduler_leases.heartbeat()
+    await scheduler_state.load()
+    now = clock.now()
+    scheduler_events.push(RESYNC_EVENT, now)
+    scheduler_events.push(MAINTENANCE_EVENT, now)
+    if scheduler_leases.enabled:
+        scheduler_events.push(LEASE_EVENT, now + scheduler_leases.heartbeat_sec)
+
+async def stop_scheduler():
+    # Shutting down: hand the shards over now instead of after the lease runs out
+    await scheduler_state.flush()
+    await scheduler_leases.release()
+
+async def scheduler_tick(bot: Bot, maintenance: bool = True):
+    """
+    Handle the events in scheduler_events that are due at clock.now(): the users whose
+    next reminder/auto-mark time came, the daily summary, the periodic full re-plan and
+    the background maintenance jobs (skipped with maintenance=False). Each handled
+    event queues its successor.
+    """
+    now = clock.now()
+    due_events = scheduler_events.pop_due(now)
+    keys = {key for key, _, _ in due_events}
+    user_ids = {key[1] for key in keys if isinstance(key, tuple) and key[0] == 'user'}
+    resync = RESYNC_EVENT in keys
+    lag = 0.0
+    for _, due, _ in due_events:
+        scheduler_stats.record_lag(now - due)
+        lag = max(lag, now - due)
+    if lag > SCHEDULER_LAG_RESYNC_SEC and not resync:
+        # Stalled: a full pass re-plans everyone and makes up for skipped deadlines
+        logger.error(f"🐢 Scheduler woke up {lag:.0f}s late, re-planning every user")
+        scheduler_stats.record_lag_resync()
+        resync = True
+    if LEASE_EVENT in keys:
+        # Save first so a shard given away here is picked up with its latest state
+        await scheduler_state.flush()
+        if await scheduler_leases.heartbeat(scheduler_state.last_tick_at):
+            # New shards: take over their previous owner's state and plan their users
+            await scheduler_state.load()
+            resync = True
+        scheduler_events.push(LEASE_EVENT, now + scheduler_leases.heartbeat_sec)
+    if resync or user_ids or SUMMARY_EVENT in keys:
+        started = time.perf_counter()
+        if resync and scheduler_leases.enabled:
+            # Check-ins handled by another process never reach this worker's cache
+            DbCache.refresh_cache()
         try:
-            await check_and_prompt(bot)
+            await check_and_prompt(bot, None if resync else user_ids)
         except Exception as e:
             logger.error(f"❌ Error in scheduler loop: {e}")
-        sleep_sec = int(SCHEDULER_INTERVAL_HHMMSSS[:2]) * 3600 + int(SCHEDULER_INTERVAL_HHMMSSS[2:4]) * 60
-        await asyncio.sleep(sleep_sec)
+        scheduler_stats.record_tick((time.perf_counter() - started) * 1000)
+        # Everything the tick changed goes out in one write
+        await scheduler_state.flush()
+    if resync:
+        scheduler_events.push(RESYNC_EVENT, now + SCHEDULER_RESYNC_MIN * 60)
+    if resync or SUMMARY_EVENT in keys:
+        scheduler_events.push(SUMMARY_EVENT, next_summary_time(now))
+    if MAINTENANCE_EVENT in keys:
+        if maintenance:
+            # Every process verifies its own DbCache; the shared DB jobs run once, on the leader
+            await maybe_verify_cache()
+            if scheduler_leases.is_leader:
+                await maybe_run_log_maintenance()
+                await maybe_export_scores()
+        scheduler_events.push(MAINTENANCE_EVENT, now + maintenance_interval_sec())
+
+async def scheduler_loop(app):
+    """
+    Sleep until the earliest event in scheduler_events is due, then handle only what
+    is due (scheduler_tick). bot/scheduler_sim.py drives scheduler_tick the same way
+    on a virtual clock.
+    """
+    await start_scheduler()
+    try:
+        while True:
+            await scheduler_tick(app.bot)
+            await scheduler_events.wait()
+    finally:
+        await stop_scheduler()
 
 def launch_scheduler(app):
     asyncio.create_task(scheduler_loop(app)) 
\ No newline at end of file
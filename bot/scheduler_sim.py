@@ -0,0 +1,303 @@
+"""
+Replay the scheduler on a virtual clock.
+
+Seeds N synthetic users (spread over SUPPORTED_TIMEZONES) into the embedded
+SQLite backend, installs a VirtualClock (bot/utils/clock.py) and a FakeBot,
+and then drives scheduler_tick exactly like scheduler_loop does, except that
+instead of sleeping it jumps the clock to the next due event. Users check in
+for yesterday at random local times (some before, some during and some after
+the reminder window) through the same DbCache and handle_successful_checkin
+calls as bot/handlers/checkin.py, so reminders, auto-marks, catch-ups and summaries all
+happen; a day of scheduling takes seconds.
+
+Reported: messages by kind and the busiest virtual minute, reminders and
+auto-marks sent to a user who had already checked in for that day, DB calls (writes
+and reads by method), DbCache.refresh_cache calls, and the CPU time of every
+tick. Messages are delivered straight to the FakeBot, i.e. without the rate
+limits of bot/utils/send_queue.py, and the maintenance jobs are not run.
+
+    DB_BACKEND=sqlite python -m bot.scheduler_sim --users 10000 --days 1
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import nest_asyncio
+
+# bot/scheduler.py imports utils.* the way run_bot.py sets the path up
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bot import scheduler
+from bot.utils import clock, send_queue as send_queue_module
+from bot.utils.cached_db import DbCache
+from bot.utils.db import DB_BACKEND, get_db_client
+from bot.utils.event_queue import scheduler_events
+from bot.utils.exceptions import SchedulerError
+from bot.utils.local_db import LocalDBClient, seed_synthetic_data
+from bot.utils.scheduler_stats import scheduler_stats
+
+# DB client methods counted as writes; every other coroutine method is a read
+WRITE_PREFIXES = ('add_', 'submit_', 'save_', 'update_', 'delete_', 'upsert_', 'correct_',
+                  'heartbeat_', 'release_', 'reserve_', 'import_', 'apply_')
+
+MESSAGE_KINDS = ('reminder', 'last_reminder', 'auto_mark', 'summary', 'other')
+# Kinds that must stop once the user has checked in for the day they are about
+CHECKIN_KINDS = ('reminder', 'last_reminder', 'auto_mark')
+
+# DbCache loads itself with run_until_complete, as in bot/main.py
+nest_asyncio.apply()
+
+
+class FakeBot:
+    """Stands in for telegram.Bot: counts what would have been sent, per kind and per virtual minute."""
+
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+        self.sent = Counter()
+        self.per_minute = Counter()
+        self.after_checkin = Counter()
+        # user_id -> (timezone, day) of the user's last simulated check-in
+        self.checked_in: Dict[int, tuple] = {}
+
+    async def send_message(self, chat_id, text=None, **kwargs):
+        kind = self.kind(chat_id, text or '')
+        self.sent[kind] += 1
+        self.per_minute[int(clock.now() // 60)] += 1
+        if kind in CHECKIN_KINDS and chat_id in self.checked_in:
+            tz, day = self.checked_in[chat_id]
+            if clock.now_utc().astimezone(tz).date() - timedelta(days=1) == day:
+                self.after_checkin[kind] += 1
+
+    def kind(self, chat_id, text: str) -> str:
+        if chat_id == self.channel_id:
+            return 'summary'
+        if text.startswith('**LAST REMINDER**'):
+            return 'last_reminder'
+        if text.startswith('⏰'):
+            return 'reminder'
+        if text.startswith('⛔ Missed check-in'):
+            return 'auto_mark'
+        return 'other'
+
+
+class DirectSendQueue:
+    """send_queue replacement that hands every message to the bot right away."""
+
+    async def send(self, bot, chat_id, lane: int = send_queue_module.LANE_BULK, **kwargs):
+        return await bot.send_message(chat_id=chat_id, **kwargs)
+
+
+class _Patches:
+    """Counting wrappers around the DB client and DbCache.refresh_cache, undone by restore()."""
+
+    def __init__(self):
+        self.db_calls = Counter()
+        self.refreshes = 0
+        self._undo = []
+        # Calls a counted method makes to others (submit_checkin -> add_checkins) aren't counted again
+        self._depth = 0
+
+    def install(self):
+        for name, method in list(vars(LocalDBClient).items()):
+            if name.startswith('_') or name in ('connect', 'close') or not asyncio.iscoroutinefunction(method):
+                continue
+            setattr(LocalDBClient, name, self._counted(name, method))
+            self._undo.append((LocalDBClient, name, method))
+        refresh = vars(DbCache)['refresh_cache']
+
+        def counted_refresh(cls):
+            self.refreshes += 1
+            return refresh.__func__(cls)
+        DbCache.refresh_cache = classmethod(counted_refresh)
+        self._undo.append((DbCache, 'refresh_cache', refresh))
+        self._undo.append((send_queue_module, 'send_queue', send_queue_module.send_queue))
+        send_queue_module.send_queue = DirectSendQueue()
+
+    def _counted(self, name, method):
+        async def wrapper(*args, **kwargs):
+            if not self._depth:
+                self.db_calls[name] += 1
+            self._depth += 1
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+        return wrapper
+
+    def restore(self):
+        for owner, name, original in reversed(self._undo):
+            setattr(owner, name, original)
+        self._undo.clear()
+
+
+def _checkin_plan(users: List[Dict[str, Any]], start_ts: float, end_ts: float, rate: float, rng: random.Random) -> list:
+    """(epoch, user_id, username) of every simulated /checkin, as a heap."""
+    plan = []
+    first = datetime.fromtimestamp(start_ts, timezone.utc).date() - timedelta(days=1)
+    last = datetime.fromtimestamp(end_ts, timezone.utc).date() + timedelta(days=1)
+    latest = min(scheduler.AUTOMARK_MINUTES + 120, 24 * 60 - 1)
+    for user in users:
+        tz = scheduler.get_zone(scheduler.user_zone_name(user))
+        day = first
+        while day <= last:
+            if rng.random() < rate:
+                ts = scheduler._local_ts(tz, day, rng.randint(0, latest))
+                if start_ts <= ts < end_ts:
+                    plan.append((ts, user['user_id'], user['username']))
+            day += timedelta(days=1)
+    heapq.heapify(plan)
+    return plan
+
+
+async def _checkin(bot: FakeBot, user_id: int, username: str, counts: Counter):
+    """What /checkin does for yesterday (bot/handlers/checkin.py), with random statuses."""
+    db = DbCache()
+    tz = scheduler.get_zone(scheduler.user_zone_name(db.get_user_by_id(user_id)))
+    yesterday = clock.now_utc().astimezone(tz).date() - timedelta(days=1)
+    if db.has_already_checked_in(user_id, yesterday.strftime("%Y-%m-%d")):
+        counts['checkins_too_late'] += 1
+        return
+    core_habits = scheduler.core_habits_for(db, user_id, username, yesterday.replace(day=1))
+    statuses = [(h['habit_id'], h['habit_text'], random.choice(('✅', '✅', '✅', '❌'))) for h in core_habits]
+    if not statuses:
+        return
+    await db.submit_checkin_to_db(user_id, username, yesterday, statuses)
+    scheduler.handle_successful_checkin(user_id, yesterday)
+    bot.checked_in[user_id] = (tz, yesterday)
+    counts['checkins'] += 1
+
+
+async def _seed(users: int, start: date, days: int, history_days: int, seed: int) -> List[Dict[str, Any]]:
+    client = get_db_client()
+    await client.connect()
+    # History ends the day before yesterday, so the first replayed day starts with nobody checked in
+    history_start = start - timedelta(days=history_days + 1)
+    user_ids = await seed_synthetic_data(client, users, history_days, start=history_start, seed=seed)
+    # Core habits for the months the replay reaches beyond the seeded history
+    seeded = {(history_start + timedelta(days=d)).strftime('%Y%m') for d in range(history_days)}
+    months = sorted({(start + timedelta(days=d)).strftime('%Y%m') for d in range(-1, days + 1)} - seeded)
+    if months:
+        await client.add_habits([
+            {'user_id': user_id, 'username': f"user{i}", 'year_month': ym,
+             'habit_text': f"Habit {h + 1} ✅", 'habit_type': 'core'}
+            for i, user_id in enumerate(user_ids) for ym in months for h in range(3)
+        ])
+    return [{'user_id': u['user_id'], 'username': u['username'], 'timezone': u['timezone']}
+            for u in await client.get_all_users()]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+async def simulate(users: int = 1000, days: int = 1, checkin_rate: float = 0.7, start: Optional[date] = None,
+                   history_days: int = 3, seed: int = 0) -> Dict[str, Any]:
+    """Replay `days` days from midnight UTC of `start` (default today) for `users` synthetic users."""
+    if DB_BACKEND != 'sqlite':
+        raise SchedulerError("The scheduler simulator needs DB_BACKEND=sqlite")
+    start = start or datetime.now(timezone.utc).date()
+    rng = random.Random(seed)
+    random.seed(seed)
+    seeded_at = time.perf_counter()
+    population = await _seed(users, start, days, history_days, seed)
+    seed_sec = time.perf_counter() - seeded_at
+    start_ts = datetime(start.year, start.month, start.day, tzinfo=timezone.utc).timestamp()
+    end_ts = start_ts + days * 86400
+    checkins = _checkin_plan(population, start_ts, end_ts, checkin_rate, rng)
+    planned_checkins = len(checkins)
+
+    bot = FakeBot(scheduler.TELEGRAM_CHANNEL_ID)
+    counts = Counter()
+    tick_cpu_ms: List[float] = []
+    patches = _Patches()
+    previous_clock = clock.set_clock(clock.VirtualClock(start_ts))
+    scheduler_events.clear()
+    scheduler_stats.reset()
+    DbCache.refresh_cache()
+    patches.install()
+    started = time.perf_counter()
+    try:
+        await scheduler.start_scheduler()
+        while True:
+            due = scheduler_events.next_due()
+            upcoming = [ts for ts in (due, checkins[0][0] if checkins else None) if ts is not None]
+            if not upcoming or min(upcoming) >= end_ts:
+                break
+            clock.get_clock().set(min(upcoming))
+            while checkins and checkins[0][0] <= clock.now():
+                _, user_id, username = heapq.heappop(checkins)
+                await _checkin(bot, user_id, username, counts)
+            due = scheduler_events.next_due()
+            if due is not None and due <= clock.now():
+                cpu = time.process_time()
+                await scheduler.scheduler_tick(bot, maintenance=False)
+                tick_cpu_ms.append((time.process_time() - cpu) * 1000)
+        await scheduler.stop_scheduler()
+    finally:
+        patches.restore()
+        clock.set_clock(previous_clock)
+    wall_sec = time.perf_counter() - started
+
+    db_writes = {name: n for name, n in patches.db_calls.items() if name.startswith(WRITE_PREFIXES)}
+    db_reads = {name: n for name, n in patches.db_calls.items() if not name.startswith(WRITE_PREFIXES)}
+    return {
+        'users': users,
+        'days': days,
+        'start': start.isoformat(),
+        'seed_sec': round(seed_sec, 3),
+        'wall_sec': round(wall_sec, 3),
+        'checkins': {'planned': planned_checkins, 'submitted': counts['checkins'],
+                     'after_auto_mark': counts['checkins_too_late']},
+        'messages': {kind: bot.sent[kind] for kind in MESSAGE_KINDS},
+        'messages_total': sum(bot.sent.values()),
+        'peak_messages_per_min': max(bot.per_minute.values(), default=0),
+        'sent_after_checkin': {kind: bot.after_checkin[kind] for kind in CHECKIN_KINDS},
+        'db_writes': sum(db_writes.values()),
+        'db_write_calls': dict(sorted(db_writes.items())),
+        'db_read_calls': dict(sorted(db_reads.items())),
+        'cache_refreshes': patches.refreshes,
+        'ticks': {
+            'count': len(tick_cpu_ms),
+            'cpu_ms_total': round(sum(tick_cpu_ms), 3),
+            'cpu_ms_avg': round(sum(tick_cpu_ms) / len(tick_cpu_ms), 3) if tick_cpu_ms else 0.0,
+            'cpu_ms_p50': round(_percentile(tick_cpu_ms, 50), 3),
+            'cpu_ms_p95': round(_percentile(tick_cpu_ms, 95), 3),
+            'cpu_ms_max': round(max(tick_cpu_ms, default=0.0), 3),
+        },
+        'scheduler_stats': scheduler_stats.snapshot(),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay the scheduler on a virtual clock for synthetic users")
+    parser.add_argument('--users', type=int, default=1000, help="synthetic users (spread over every supported timezone)")
+    parser.add_argument('--days', type=int, default=1, help="days to replay, e.g. 30 for a month")
+    parser.add_argument('--checkin-rate', type=float, default=0.7, help="chance a user checks in for a given day")
+    parser.add_argument('--start', help="first replayed day (UTC), YYYY-MM-DD; default today")
+    parser.add_argument('--history-days', type=int, default=3, help="days of check-ins seeded before the replay")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="keep the per-user scheduler log lines")
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        # Thousands of per-user info lines would dominate the timings
+        logging.disable(logging.INFO)
+    result = asyncio.run(simulate(args.users, args.days, args.checkin_rate,
+                                  date.fromisoformat(args.start) if args.start else None,
+                                  args.history_days, args.seed))
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
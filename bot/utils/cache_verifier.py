@@ -0,0 +1,149 @@
+"""
+Background check that DbCache still matches the database.
+
+DbCache is patched locally (DND edits/deletes, cache-assigned ids, check-ins),
+so it can drift from Postgres without anyone noticing. verify_cache() splits
+every cached table into CACHE_VERIFY_BUCKETS buckets by user_id and compares
+a cheap checksum per bucket (row count + sum of per-row key-column hashes,
+see DBClient.table_checksums / row_checksum) between the cache and the DB.
+
+A bucket that differs is only a suspect on the first run: the cache is often
+patched a moment before the matching DB write lands. If it still differs on
+the next run, just that bucket's rows are reloaded from the DB. Counters are
+kept in `drift_stats` for dashboards and logged after every run.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from bot.utils.cached_db import DbCache, compact_log_txt
+from bot.utils.db import CHECKSUM_COLUMNS, get_db_client, row_checksum
+from bot.utils.logger import get_logger
+
+logger = get_logger("cache_verifier")
+
+# Number of user_id buckets per table; more buckets means smaller reloads
+CACHE_VERIFY_BUCKETS = int(os.getenv("CACHE_VERIFY_BUCKETS", "64"))
+# Minutes between verification runs from the scheduler loop (0 disables)
+CACHE_VERIFY_INTERVAL_MIN = float(os.getenv("CACHE_VERIFY_INTERVAL_MIN", "30"))
+
+
+class DriftStats:
+    """Thread-safe counters of verification runs and the drift they found."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.runs = 0
+            self.last_run_at = None
+            self.last_run_ms = 0.0
+            self.tables: Dict[str, Dict[str, int]] = {}
+
+    def record(self, table: str, suspect: int, refreshed: int, rows: int):
+        with self._lock:
+            stat = self.tables.setdefault(table, {'suspect_buckets': 0, 'refreshed_buckets': 0, 'refreshed_rows': 0})
+            stat['suspect_buckets'] += suspect
+            stat['refreshed_buckets'] += refreshed
+            stat['refreshed_rows'] += rows
+
+    def record_run(self, elapsed_ms: float):
+        with self._lock:
+            self.runs += 1
+            self.last_run_at = time.time()
+            self.last_run_ms = round(elapsed_ms, 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'last_run_at': self.last_run_at,
+                'last_run_ms': self.last_run_ms,
+                'tables': {t: dict(s) for t, s in self.tables.items()},
+            }
+
+
+drift_stats = DriftStats()
+
+# (table, bucket) pairs that differed on the previous run
+_suspects: Set[Tuple[str, int]] = set()
+_last_run_at: Optional[float] = None
+
+
+def cache_checksums(rows, table: str, buckets: int) -> Dict[int, Tuple[int, int]]:
+    """The cache-side twin of DBClient.table_checksums for a list of cached rows."""
+    columns = CHECKSUM_COLUMNS[table]
+    sums: Dict[int, Tuple[int, int]] = {}
+    for row in rows:
+        bucket = row['user_id'] % buckets
+        n, h = sums.get(bucket, (0, 0))
+        sums[bucket] = (n + 1, h + row_checksum(row, columns))
+    return sums
+
+
+def _replace_buckets(cache: DbCache, table: str, buckets: int, selected: Set[int], fresh: list):
+    if table == 'daily_score_log':
+        for row in fresh:
+            if 'log_txt_json' in row:
+                row['log_txt_json'] = compact_log_txt(row['log_txt_json'])
+    with cache._lock:
+        kept = [row for row in getattr(cache, table) if row['user_id'] % buckets not in selected]
+        setattr(cache, table, kept + fresh)
+
+
+async def verify_cache(cache: Optional[DbCache] = None, db_client=None, buckets: int = CACHE_VERIFY_BUCKETS) -> Dict[str, Any]:
+    """
+    Compare every cached table with the DB bucket by bucket and reload the buckets
+    that differed on this and the previous run. Returns per-table results.
+    """
+    cache = cache or DbCache()
+    own_client = db_client is None
+    db_client = db_client or get_db_client()
+    await db_client.connect()
+    start = time.perf_counter()
+    results = {}
+    try:
+        for table in CHECKSUM_COLUMNS:
+            since = cache._log_since
+            with cache._lock:
+                rows = list(getattr(cache, table))
+            # Hashing can take a moment on big caches; keep the event loop free meanwhile
+            local = await asyncio.to_thread(cache_checksums, rows, table, buckets)
+            remote = await db_client.table_checksums(table, buckets, since)
+            differing = {b for b in set(local) | set(remote) if local.get(b) != remote.get(b)}
+            confirmed = {b for b in differing if (table, b) in _suspects}
+            for b in range(buckets):
+                _suspects.discard((table, b))
+            _suspects.update((table, b) for b in differing - confirmed)
+            refreshed_rows = 0
+            if confirmed:
+                fresh = await db_client.fetch_buckets(table, buckets, sorted(confirmed), since)
+                _replace_buckets(cache, table, buckets, confirmed, fresh)
+                refreshed_rows = len(fresh)
+                logger.info(f"🔄 Cache drift in {table}: reloaded {len(confirmed)} bucket(s), {refreshed_rows} row(s)")
+            drift_stats.record(table, len(differing), len(confirmed), refreshed_rows)
+            results[table] = {'differing': sorted(differing), 'refreshed': sorted(confirmed), 'rows': refreshed_rows}
+    finally:
+        drift_stats.record_run((time.perf_counter() - start) * 1000)
+        if own_client:
+            await db_client.close()
+    logger.debug(f"[cache_verifier] {results}")
+    return results
+
+
+async def maybe_verify_cache():
+    """Run verify_cache every CACHE_VERIFY_INTERVAL_MIN minutes; errors are logged, not raised."""
+    global _last_run_at
+    if CACHE_VERIFY_INTERVAL_MIN <= 0:
+        return
+    if _last_run_at is not None and time.monotonic() - _last_run_at < CACHE_VERIFY_INTERVAL_MIN * 60:
+        return
+    _last_run_at = time.monotonic()
+    try:
+        await verify_cache()
+    except Exception as e:
+        logger.error(f"❌ Cache verification failed: {e}")
@@ -1,17 +1,60 @@
 import os
+import json
 from datetime import datetime, timedelta, date
 from typing import Optional, List, Dict, Any
 import threading
-from bot.utils.db import DBClient  # <-- Add this import
+from collections import deque
+from bot.utils.db import as_date, get_db_client
+from bot.utils.logger import get_logger
 import asyncio
 
+logger = get_logger("cached_db")
+
+# Ids reserved from a table's DB sequence per block; refilled once a block is half used (see _next_id)
+DB_ID_BLOCK_SIZE = int(os.getenv("DB_ID_BLOCK_SIZE", "20"))
+# Tables whose new cached rows take an id from a reserved block
+ID_TABLES = ('habits', 'core_habit_log', 'dnd_log')
+# Months of core_habit_log/daily_score_log loaded into the cache (current month included, and
+# always the last two days, so every timezone's yesterday is cached on the 1st);
+# 0 loads everything. Older months stay queryable through DBClient and monthly_score_summary.
+DB_CACHE_LOG_MONTHS = int(os.getenv("DB_CACHE_LOG_MONTHS", "0"))
+
 class DbCacheError(Exception):
     pass
 
+def compact_log_txt(log_txt_json) -> tuple:
+    """
+    Reduce a daily_score_log.log_txt_json value to ((habit_text, habit_status), ...).
+    Accepts the decoded list from the DB codec, raw JSON text, or an already compact tuple.
+    """
+    if not log_txt_json:
+        return ()
+    if isinstance(log_txt_json, str):
+        log_txt_json = json.loads(log_txt_json)
+    return tuple(
+        (h["habit_text"], h["habit_status"]) if isinstance(h, dict) else tuple(h)
+        for h in log_txt_json
+    )
+
 class DbCache:
     _instance = None
     _initialized = False
     _lock = threading.RLock()
+    # Reserved-but-unused sequence ids per table; class-level so they survive refresh_cache
+    _id_blocks: Dict[str, deque] = {}
+    # table -> running background refill, so a table is only topped up once at a time
+    _id_refills: Dict[str, asyncio.Task] = {}
+    _temp_id = 0
+    # Connected client shared by the async *_to_db writes; class-level so its pool survives refresh_cache
+    _db_client = None
+
+    @classmethod
+    async def _client(cls):
+        """The long-lived DB client, connected on first use (a client per call left a pool open each time)."""
+        if cls._db_client is None:
+            cls._db_client = get_db_client()
+        await cls._db_client.connect()
+        return cls._db_client
 
     @classmethod
     def refresh_cache(cls):
@@ -33,56 +76,108 @@ class DbCache:
     def __init__(self):
         if self.__class__._initialized:
             return
-        # In-memory cache for each table
-        self.users = []  # List[dict]
-        self.habits = []  # List[dict]
-        self.core_habit_log = []  # List[dict]
-        self.dnd_log = []  # List[dict]
-        self.daily_score_log = []  # List[dict]
+        # In-memory cache for each table. Rows loaded from the DB are slotted
+        # Row objects (bot.utils.rows); rows added locally are plain dicts.
+        # Both support row['field'], row.get() and item assignment.
+        self.users = []  # List[Row | dict]
+        self.habits = []  # List[Row | dict]
+        self.core_habit_log = []  # List[Row | dict]
+        self.dnd_log = []  # List[Row | dict]
+        self.daily_score_log = []  # List[Row | dict]
+        # (user_id, 'YYYYMM') -> streak on the month's last day, see get_streak_checkpoint
+        self._streak_checkpoints: Dict[tuple, Optional[int]] = {}
+        self._log_since: Optional[date] = None
         self._load_all()
         self.__class__._initialized = True
 
     def _load_all(self):
         # Load all tables from the database into the cache
-        db_client = DBClient()
+        db_client = get_db_client()
         loop = asyncio.get_event_loop()
         # Connect to DB
         loop.run_until_complete(db_client.connect())
-        # Fetch all users
-        self.users = loop.run_until_complete(db_client.get_all_users())
-        # Fetch all habits
-        query = 'SELECT * FROM habits'
-        async def fetch_all_habits():
-            
-            async with db_client._pool.acquire() as conn:
-                rows = await conn.fetch(query)
-                return [dict(r) for r in rows]
-        self.habits = loop.run_until_complete(fetch_all_habits())
-        # Fetch all core habit logs
-        query = 'SELECT * FROM core_habit_log'
-        async def fetch_all_core_habit_log():
-            async with db_client._pool.acquire() as conn:
-                rows = await conn.fetch(query)
-                return [dict(r) for r in rows]
-        self.core_habit_log = loop.run_until_complete(fetch_all_core_habit_log())
-        # Fetch all dnd logs
-        query = 'SELECT * FROM dnd_log'
-        async def fetch_all_dnd_log():
-            async with db_client._pool.acquire() as conn:
-                rows = await conn.fetch(query)
-                print("Ye mila hai",rows)
-                return [dict(r) for r in rows]
-        self.dnd_log = loop.run_until_complete(fetch_all_dnd_log())
-        # Fetch all daily score logs
-        query = 'SELECT * FROM daily_score_log'
-        async def fetch_all_daily_score_log():
-            async with db_client._pool.acquire() as conn:
-                rows = await conn.fetch(query)
-                return [dict(r) for r in rows]
-        self.daily_score_log = loop.run_until_complete(fetch_all_daily_score_log())
+        # Stream every table through a server-side cursor so rows are copied
+        # once, straight into the cache, instead of fetch() + a dict() copy
+        async def fetch_table(table, since=None):
+            return [row async for row in db_client.iter_table(table, since=since)]
+        # Log tables are partitioned by month, so a window only reads the recent partitions
+        since = None
+        if DB_CACHE_LOG_MONTHS > 0:
+            today = datetime.now().date()
+            index = today.year * 12 + today.month - DB_CACHE_LOG_MONTHS
+            # Early in a month the scheduler and /checkin still need last month's final days
+            since = min(date(index // 12, index % 12 + 1, 1), today - timedelta(days=2))
+        self._log_since = since
+        self.users = loop.run_until_complete(fetch_table('users'))
+        self.habits = loop.run_until_complete(fetch_table('habits'))
+        self.core_habit_log = loop.run_until_complete(fetch_table('core_habit_log', since))
+        self.dnd_log = loop.run_until_complete(fetch_table('dnd_log'))
+        self.daily_score_log = loop.run_until_complete(fetch_table('daily_score_log', since))
+        # Keep check-in summaries parsed and compact so announcements/stats don't re-parse
+        for row in self.daily_score_log:
+            if 'log_txt_json' in row:
+                row['log_txt_json'] = compact_log_txt(row['log_txt_json'])
+        # Fill the id blocks while connected, so _next_id has ids without a DB call
+        for table in ID_TABLES:
+            if len(self._id_blocks.get(table, ())) <= DB_ID_BLOCK_SIZE // 2:
+                try:
+                    ids = loop.run_until_complete(db_client.reserve_ids(table, DB_ID_BLOCK_SIZE))
+                    with self._lock:
+                        self._id_blocks.setdefault(table, deque()).extend(ids)
+                except Exception as e:
+                    logger.error(f"❌ Could not reserve {table} ids: {e}")
         # Optionally close DB connection
         loop.run_until_complete(db_client.close())
 
+    # IDS
+    def _next_id(self, table: str) -> int:
+        """
+        Hand out a real id for a row created in the cache. Ids come from blocks of
+        DB_ID_BLOCK_SIZE drawn from the table's sequence, so the same id can be sent
+        with the later DB insert and the cached row stays valid without a reload.
+        Blocks are filled by _load_all and topped up in the background once half
+        used (_refill_ids), so this never waits on the DB. If a block still runs
+        dry a negative temporary id is returned; such ids are never sent to the DB
+        (see _db_id) and go away on the next refresh.
+        """
+        with self._lock:
+            block = self._id_blocks.setdefault(table, deque())
+            if len(block) <= DB_ID_BLOCK_SIZE // 2:
+                self._schedule_refill(table)
+            if block:
+                return block.popleft()
+            DbCache._temp_id -= 1
+            temp_id = DbCache._temp_id
+        logger.error(f"❌ No reserved {table} ids left, using temporary id {temp_id}")
+        return temp_id
+
+    @classmethod
+    def _schedule_refill(cls, table: str):
+        if table in cls._id_refills:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No event loop running (scripts, tests); the next refresh fills the block
+        cls._id_refills[table] = loop.create_task(cls._refill_ids(table))
+
+    @classmethod
+    async def _refill_ids(cls, table: str):
+        try:
+            db_client = await cls._client()
+            ids = await db_client.reserve_ids(table, DB_ID_BLOCK_SIZE)
+            with cls._lock:
+                cls._id_blocks.setdefault(table, deque()).extend(ids)
+        except Exception as e:
+            logger.error(f"❌ Could not reserve {table} ids: {e}")
+        finally:
+            cls._id_refills.pop(table, None)
+
+    @staticmethod
+    def _db_id(value: Optional[int]) -> Optional[int]:
+        # Temporary (negative) ids are cache-only; let the sequence assign the real one
+        return value if value is not None and value > 0 else None
+
     # USERS
     def add_user(self, user_id: int, username: str, nickname: str, user_moji: str, dob: str, timezone: str, email: str, user_status: str = 'active'):
         user = {
@@ -102,10 +197,8 @@ class DbCache:
 
     async def add_user_to_db(self, user_id: int, username: str, nickname: str, user_moji: str, dob: str, timezone: str, email: str, user_status: str = 'active'):
         """Insert a new user directly into the database using DBClient."""
-        db_client = DBClient()
-        await db_client.connect()
+        db_client = await self._client()
         await db_client.add_user(user_id, username, nickname, user_moji, dob, timezone, email, user_status)
-        # await db_client.close()  # Only if you want to close after every op
 
     def update_user(self, user_id: int, nickname: str, user_moji: str, dob: str, timezone: str, email: str):
         for user in self.users:
@@ -132,9 +225,10 @@ class DbCache:
     def add_habit_to_cache(self, user_id: int, username: str, year_month: str, habit_text: str, habit_type: str):
         """
         Add a habit to the in-memory cache only (does not persist to DB).
+        Returns the habit_id reserved for it; pass it to add_habit_to_db.
         """
         habit = {
-            'habit_id': len(self.habits) + 1,
+            'habit_id': self._next_id('habits'),
             'user_id': user_id,
             'username': username,
             'year_month': year_month,
@@ -143,15 +237,15 @@ class DbCache:
             'created_at': datetime.now()
         }
         self.habits.append(habit)
+        return habit['habit_id']
 
-    async def add_habit_to_db(self, user_id: int, username: str, year_month: str, habit_text: str, habit_type: str):
+    async def add_habit_to_db(self, user_id: int, username: str, year_month: str, habit_text: str, habit_type: str, habit_id: Optional[int] = None):
         """
         Add a habit directly to the database using DBClient.
+        habit_id is the id returned by add_habit_to_cache, if the habit is already cached.
         """
-        from bot.utils.db import DBClient
-        db_client = DBClient()
-        await db_client.connect()
-        await db_client.add_habit(user_id, username, year_month, habit_text, habit_type)
+        db_client = await self._client()
+        await db_client.add_habit(user_id, username, year_month, habit_text, habit_type, self._db_id(habit_id))
        
     
     def get_user_habits_for_month(self, user_id: int, year_month: str) -> List[dict]:
@@ -165,9 +259,7 @@ class DbCache:
         """
         Batch insert multiple habits directly to the database using DBClient.
         """
-        from bot.utils.db import DBClient
-        db_client = DBClient()
-        await db_client.connect()
+        db_client = await self._client()
         habits = [
             {
                 'user_id': user_id,
@@ -196,9 +288,10 @@ class DbCache:
     def log_checkin_to_cache(self, for_date: str, year_month: str, user_id: int, username: str, habit_id: int, habit_text: str, habit_status: str, marked_by: str):
         """
         Add a check-in entry to the in-memory cache only (does not persist to DB).
+        Returns the core_log_id reserved for it; send it as the check-in's core_log_id to log_checkin_to_db.
         """
         entry = {
-            'core_log_id': len(self.core_habit_log) + 1,
+            'core_log_id': self._next_id('core_habit_log'),
             'for_date': for_date,
             'year_month': year_month,
             'user_id': user_id,
@@ -210,16 +303,143 @@ class DbCache:
             'created_at': datetime.now()
         }
         self.core_habit_log.append(entry)
+        return entry['core_log_id']
 
-    async def log_checkin_to_db(self, checkins: list):
+    async def log_checkin_to_db(self, checkins: list) -> List[dict]:
         """
-        Batch insert m  tiple check-in entries directly to the database using DBClient.
+        Batch upsert multiple check-in entries directly to the database using DBClient.
         Each check-in dict should contain: for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by
+        and optionally the core_log_id returned by log_checkin_to_cache.
+        Returns the rows that are stored afterwards; `written` is False where an earlier check-in won (manual beats auto).
+        """
+        db_client = await self._client()
+        checkins = [
+            {**c, 'core_log_id': self._db_id(c['core_log_id'])} if 'core_log_id' in c else c
+            for c in checkins
+        ]
+        return await db_client.add_checkins(checkins)
+
+    async def submit_checkin_to_db(self, user_id: int, username: str, for_date, statuses: list, marked_by: str = 'manual') -> List[dict]:
+        """
+        Submit a whole check-in (statuses: [(habit_id, habit_text, habit_status), ...]) with one
+        DBClient.submit_checkin call and apply the result to the cache, so no refresh_cache is needed.
+        The cache gets the core_habit_log rows the DB actually stored, ids included.
+        Returns the daily_score_log core/streak rows for for_date and later days.
+        """
+        for_date = as_date(for_date)
+        db_client = await self._client()
+        landed, score_rows = await db_client.submit_checkin(user_id, username, for_date, statuses, marked_by)
+        with self._lock:
+            self._patch_checkins(landed)
+            self._replace_scores_from(user_id, for_date, score_rows)
+        return score_rows
+
+    def _patch_checkins(self, landed: list):
+        """Make the cached core_habit_log rows for these keys the ones stored in the DB (rows as from add_checkins)."""
+        landed = [row for row in landed if self.caches_log_date(row['for_date'])]
+        if not landed:
+            return
+        with self._lock:
+            keys = {(row['user_id'], row['habit_id'], str(as_date(row['for_date']))) for row in landed}
+            self.core_habit_log = [
+                row for row in self.core_habit_log
+                if (row['user_id'], row['habit_id'], str(row['for_date'])) not in keys
+            ]
+            for row in landed:
+                entry = {k: v for k, v in row.items() if k != 'written'}
+                entry['for_date'] = as_date(entry['for_date'])
+                self.core_habit_log.append(entry)
+
+    async def auto_mark_to_db(self, checkins: list) -> List[dict]:
+        """
+        Store the scheduler's auto-marks for any number of users with one add_checkins call,
+        then patch the cache with the rows that landed and those users' re-derived scores
+        (one get_daily_scores_since_many call), so no refresh_cache is needed.
+        Returns the stored rows like log_checkin_to_db; `written` is False where a manual check-in won.
+        """
+        db_client = await self._client()
+        landed = await db_client.add_checkins(checkins)
+        since: Dict[int, date] = {}
+        for row in landed:
+            for_date = as_date(row['for_date'])
+            if row['written'] and self.caches_log_date(for_date):
+                since[row['user_id']] = min(since.get(row['user_id'], for_date), for_date)
+        score_rows = await db_client.get_daily_scores_since_many(since) if since else []
+        by_user: Dict[int, list] = {}
+        for row in score_rows:
+            by_user.setdefault(row['user_id'], []).append(row)
+        with self._lock:
+            # Rows a manual check-in kept are patched in too, in case the cache hadn't seen it yet
+            self._patch_checkins(landed)
+            for user_id, for_date in since.items():
+                self._replace_scores_from(user_id, for_date, by_user.get(user_id, []))
+        return landed
+
+    def _replace_scores_from(self, user_id: int, for_date: date, score_rows: list):
+        """Swap in a user's daily_score_log rows from for_date on and drop the streak checkpoints they invalidate."""
+        with self._lock:
+            self.daily_score_log = [
+                row for row in self.daily_score_log
+                if not (row['user_id'] == user_id and as_date(row['for_date']) >= for_date
+                        and row['score_type'] in ('core', 'streak'))
+            ]
+            for row in score_rows:
+                if 'log_txt_json' in row:
+                    row['log_txt_json'] = compact_log_txt(row['log_txt_json'])
+                self.daily_score_log.append(row)
+            year_month = for_date.strftime('%Y%m')
+            for key in [k for k in self._streak_checkpoints if k[0] == user_id and k[1] >= year_month]:
+                del self._streak_checkpoints[key]
+
+    # STREAK CHECKPOINTS
+    def caches_log_date(self, for_date) -> bool:
+        """Whether core_habit_log/daily_score_log rows for for_date are in the cache (see DB_CACHE_LOG_MONTHS)."""
+        return self._log_since is None or as_date(for_date) >= self._log_since
+
+    def get_streak_checkpoint(self, user_id: int, year_month: str) -> Optional[int]:
+        """
+        The user's streak on the last day of year_month (None if that day has no check-in).
+        Seeds bot.utils.recompute.correct_checkin; filled from the cached streak rows on
+        first use and replaced by the values a correction recomputes.
+        """
+        key = (user_id, year_month)
+        with self._lock:
+            if key not in self._streak_checkpoints:
+                month_start = datetime.strptime(year_month + '01', '%Y%m%d').date()
+                month_end = (month_start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+                score = None
+                for row in self.daily_score_log:
+                    if row['user_id'] == user_id and row['score_type'] == 'streak' and as_date(row['for_date']) == month_end:
+                        score = row['score']
+                        break
+                self._streak_checkpoints[key] = score
+            return self._streak_checkpoints[key]
+
+    def apply_checkin_correction(self, user_id: int, for_date, checkin_rows: list, score_rows: list, checkpoints: Dict[str, Optional[int]]):
+        """
+        Patch the cache after bot.utils.recompute.correct_checkin: the corrected core_habit_log
+        rows, the user's daily_score_log rows from for_date on and the recomputed month checkpoints.
+        """
+        for_date = as_date(for_date)
+        with self._lock:
+            corrected = {(row['habit_id'], as_date(row['for_date'])): row for row in checkin_rows}
+            self.core_habit_log = [
+                row for row in self.core_habit_log
+                if not (row['user_id'] == user_id and (row['habit_id'], as_date(row['for_date'])) in corrected)
+            ]
+            self.core_habit_log.extend(corrected.values())
+            self._replace_scores_from(user_id, for_date, score_rows)
+            for year_month, streak in checkpoints.items():
+                self._streak_checkpoints[(user_id, year_month)] = streak
+
+    async def correct_checkin_in_db(self, user_id: int, username: str, for_date, statuses: list) -> Dict[str, Any]:
+        """
+        Admin correction of a past check-in (statuses: [(habit_id, habit_text, habit_status), ...]).
+        Rewrites core_habit_log for that day and recomputes the user's scores from that month
+        forward; only those rows are patched in the cache.
         """
-        from bot.utils.db import DBClient
-        db_client = DBClient()
-        await db_client.connect()
-        await db_client.add_checkins(checkins)
+        from bot.utils.recompute import correct_checkin
+        return await correct_checkin(user_id, username, for_date, statuses, cache=self)
 
     # DND
     def add_dnd_period_to_cache(self, year_month: str, username: str, user_id: int, habit_id: int, habit_text: str, start_date: str, end_date: str):
@@ -228,7 +448,7 @@ class DbCache:
         Returns the dnd_log_id of the new entry.
         """
         entry = {
-            'dnd_log_id': len(self.dnd_log) + 1,
+            'dnd_log_id': self._next_id('dnd_log'),
             'year_month': year_month,
             'username': username,
             'user_id': user_id,
@@ -241,16 +461,15 @@ class DbCache:
         self.dnd_log.append(entry)
         return entry['dnd_log_id']
 
-    async def add_dnd_period_to_db(self, year_month: str, username: str, user_id: int, habit_id: int, habit_text: str, start_date: str, end_date: str):
+    async def add_dnd_period_to_db(self, year_month: str, username: str, user_id: int, habit_id: int, habit_text: str, start_date: str, end_date: str, dnd_log_id: Optional[int] = None):
         """
         Add a DND period directly to the database using DBClient.
+        dnd_log_id is the id returned by add_dnd_period_to_cache, if the period is already cached.
         """
-        from bot.utils.db import DBClient
-        db_client = DBClient()
-        await db_client.connect()
+        db_client = await self._client()
         start_dt = datetime.strptime(start_date, "%Y-%m-%d").date()
         end_dt = datetime.strptime(end_date, "%Y-%m-%d").date()
-        dnd_log_id = await db_client.add_dnd_period(year_month, username, user_id, habit_id, habit_text, start_dt, end_dt)
+        dnd_log_id = await db_client.add_dnd_period(year_month, username, user_id, habit_id, habit_text, start_dt, end_dt, self._db_id(dnd_log_id))
         return dnd_log_id
 
     def get_dnd_entries_for_user(self, user_id: int) -> List[dict]:
@@ -307,11 +526,8 @@ class DbCache:
         """
         Delete a DND entry directly from the database using DBClient.
         """
-        from bot.utils.db import DBClient
-        db_client = DBClient()
-        await db_client.connect()
+        db_client = await self._client()
         result = await db_client.delete_dnd_entry(dnd_log_id)
-        # await db_client.close()
         return result
 
     # Utility: update DND entry
@@ -334,11 +550,8 @@ class DbCache:
         """
         Update a DND entry directly in the database using DBClient.
         """
-        from bot.utils.db import DBClient
-        db_client = DBClient()
-        await db_client.connect()
+        db_client = await self._client()
         result = await db_client.update_dnd_entry(dnd_log_id, new_habit_text, new_start_date, new_end_date)
-        # await db_client.close()
         return result
 
     # Utility: get all check-ins for a user
@@ -0,0 +1,56 @@
+"""
+The scheduler's notion of "now".
+
+bot/scheduler.py and bot/utils/event_queue.py read the time through now() and
+now_utc() here instead of time.time()/datetime.utcnow(), so a VirtualClock can
+be swapped in with set_clock() and a whole day of reminders, auto-marks and
+summaries replayed in seconds (see bot/scheduler_sim.py).
+"""
+import time
+from datetime import datetime, timezone
+
+
+class SystemClock:
+    def time(self) -> float:
+        return time.time()
+
+    def now_utc(self) -> datetime:
+        return datetime.fromtimestamp(self.time(), timezone.utc)
+
+
+class VirtualClock(SystemClock):
+    """A clock that only moves when told to."""
+
+    def __init__(self, start: float):
+        self.now = float(start)
+
+    def time(self) -> float:
+        return self.now
+
+    def set(self, ts: float):
+        self.now = max(self.now, float(ts))
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+_clock = SystemClock()
+
+
+def set_clock(clock) -> SystemClock:
+    """Install `clock` and return the one it replaces."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def get_clock():
+    return _clock
+
+
+def now() -> float:
+    return _clock.time()
+
+
+def now_utc() -> datetime:
+    return _clock.now_utc()
@@ -1,28 +1,318 @@
 import os
+import re
+import hashlib
+import json
+import time
 import asyncpg
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, date
-from typing import Optional, List, Dict, Any, Tuple
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+from bot.utils.db_stats import query_stats, TimedConnection
+from bot.utils.logger import get_logger
+from bot.utils.rows import Row, row_type, to_row, to_rows
+
+logger = get_logger("db")
 
 # Load environment variables
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional hot standby used for bulk/analytical reads (cache loads, summaries, exports)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Replica reads fall back to the primary when replay lag exceeds this many seconds
+DB_REPLICA_MAX_LAG_SEC = float(os.getenv("DB_REPLICA_MAX_LAG_SEC", "5"))
+# How long a lag measurement is trusted before the replica is asked again
+DB_REPLICA_LAG_CHECK_SEC = float(os.getenv("DB_REPLICA_LAG_CHECK_SEC", "10"))
+# Rows pulled per round trip by the server-side cursor helpers (iter_*)
+DB_CURSOR_PREFETCH = int(os.getenv("DB_CURSOR_PREFETCH", "500"))
+
+# "postgres" (DBClient) or "sqlite" (embedded LocalDBClient, see local_db.py)
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres").lower()
+
+# Serial id column per table, for ids reserved ahead of the insert (reserve_ids)
+ID_COLUMNS = {'habits': 'habit_id', 'core_habit_log': 'core_log_id', 'dnd_log': 'dnd_log_id'}
+
+# Tables that can be streamed whole with iter_table()
+STREAMABLE_TABLES = ('users', 'habits', 'core_habit_log', 'dnd_log', 'daily_score_log')
+
+# Columns hashed per row by table_checksums()/row_checksum() to detect cache drift
+CHECKSUM_COLUMNS = {
+    'users': ('user_id', 'username', 'timezone', 'user_status'),
+    'habits': ('habit_id', 'user_id', 'year_month', 'habit_text', 'habit_type'),
+    'core_habit_log': ('core_log_id', 'user_id', 'habit_id', 'for_date', 'habit_status', 'marked_by'),
+    'dnd_log': ('dnd_log_id', 'user_id', 'habit_id', 'start_date', 'end_date'),
+    'daily_score_log': ('score_log_id', 'user_id', 'for_date', 'score_type', 'score'),
+}
+
+def row_checksum(row, columns) -> int:
+    """
+    Python twin of the per-row hash in DBClient.table_checksums: the first 60 bits of
+    md5(concat_ws('|', columns...)). Like concat_ws, NULL columns are skipped.
+    """
+    text = '|'.join(str(row[c]) for c in columns if row[c] is not None)
+    return int(hashlib.md5(text.encode()).hexdigest()[:15], 16)
+
+# Natural key per table that bulk imports (import_rows) skip already-stored rows on
+IMPORT_KEYS = {
+    'users': ('user_id',),
+    'habits': ('user_id', 'year_month', 'habit_text'),
+    'core_habit_log': ('user_id', 'habit_id', 'for_date'),
+    'dnd_log': ('user_id', 'habit_id', 'start_date', 'end_date'),
+}
+
+# Log tables partitioned by month on for_date (schemas/sql/003_monthly_log_partitions.sql)
+PARTITIONED_LOG_TABLES = ('core_habit_log', 'daily_score_log')
 
 class DBError(Exception):
     pass
 
+def as_date(value) -> date:
+    """Accept a date, datetime or 'YYYY-MM-DD' string and return a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), "%Y-%m-%d").date()
+
+# Upsert of core_habit_log rows passed as parallel arrays (see _checkin_columns).
+# A manual check-in replaces an auto-marked row; any other conflict keeps the
+# stored row. Returns the stored row for every input key with a `written` flag.
+UPSERT_CHECKINS_QUERY = '''
+WITH input AS (
+    SELECT * FROM unnest($1::date[], $2::text[], $3::int8[], $4::text[], $5::int8[], $6::text[], $7::text[], $8::text[], $9::int8[])
+        AS t(for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by, core_log_id)
+), upserted AS (
+    INSERT INTO core_habit_log (core_log_id, for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by)
+    SELECT COALESCE(core_log_id, nextval(pg_get_serial_sequence('core_habit_log', 'core_log_id'))),
+           for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by
+    FROM input
+    ON CONFLICT (user_id, habit_id, for_date) DO UPDATE
+    SET habit_text=EXCLUDED.habit_text, habit_status=EXCLUDED.habit_status, marked_by=EXCLUDED.marked_by
+    WHERE core_habit_log.marked_by <> 'manual' AND EXCLUDED.marked_by = 'manual'
+    RETURNING *
+)
+SELECT upserted.*, TRUE AS written FROM upserted
+UNION ALL
+SELECT c.*, FALSE AS written FROM core_habit_log c
+JOIN input i ON c.user_id = i.user_id AND c.habit_id = i.habit_id AND c.for_date = i.for_date
+WHERE NOT EXISTS (SELECT 1 FROM upserted u WHERE u.core_log_id = c.core_log_id)
+'''
+
+def _checkin_columns(checkins: list) -> list:
+    """Turn check-in dicts into the parallel arrays UPSERT_CHECKINS_QUERY expects."""
+    columns = zip(*[
+        (
+            as_date(c['for_date']),
+            c['year_month'],
+            c['user_id'],
+            c['username'],
+            c['habit_id'],
+            c['habit_text'],
+            c['habit_status'],
+            c['marked_by'],
+            c.get('core_log_id')
+        )
+        for c in checkins
+    ])
+    return [list(col) for col in columns]
+
+def _month_bounds(year_month: str) -> Tuple[date, date]:
+    """[first day, first day of next month) for 'YYYYMM'."""
+    if not re.fullmatch(r'\d{6}', str(year_month)):
+        raise DBError(f"Invalid year_month {year_month!r}, expected YYYYMM")
+    start = date(int(year_month[:4]), int(year_month[4:]), 1)
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+def _quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+# A user's core/streak rows from a day on, as returned by submit_checkin()
+DAILY_SCORES_SINCE_QUERY = '''
+SELECT * FROM daily_score_log
+WHERE user_id=$1 AND for_date >= $2 AND score_type IN ('core', 'streak')
+ORDER BY for_date, score_type
+'''
+
+# DAILY_SCORES_SINCE_QUERY for many (user_id, for_date) pairs at once
+DAILY_SCORES_SINCE_MANY_QUERY = '''
+SELECT d.* FROM daily_score_log d
+JOIN unnest($1::int8[], $2::date[]) AS t(user_id, for_date)
+  ON d.user_id = t.user_id AND d.for_date >= t.for_date
+WHERE d.score_type IN ('core', 'streak')
+ORDER BY d.user_id, d.for_date, d.score_type
+'''
+
+# Whether the submit_checkin() SQL function (schemas/sql/002_submit_checkin.sql)
+# is installed; flipped off the first time the server says it is missing
+_submit_checkin_fn = True
+
+# 0 when the standby has replayed everything it received, otherwise the age of
+# the last replayed transaction. NULL (not in recovery) is treated as no lag.
+REPLICA_LAG_QUERY = '''
+SELECT COALESCE(
+    CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+         ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END, 0) AS lag
+'''
+
+try:
+    import orjson
+
+    def _json_dumps(value) -> str:
+        return orjson.dumps(value).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    # Fallback: stdlib json if orjson is not installed
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+async def _init_connection(conn):
+    """Decode json/jsonb columns (e.g. daily_score_log.log_txt_json) into Python objects on arrival."""
+    for pg_type in ('json', 'jsonb'):
+        await conn.set_type_codec(pg_type, encoder=_json_dumps, decoder=_json_loads, schema='pg_catalog')
+
+# monotonic time of the last write made by any DBClient in this process
+_last_write_at = 0.0
+
+def _note_write():
+    """Remember that the primary just changed, so reads stay on it until the replica catches up."""
+    global _last_write_at
+    _last_write_at = time.monotonic()
+
 class DBClient:
-    def __init__(self):
+    def __init__(self, replica_dsn: Optional[str] = None, max_replica_lag: Optional[float] = None):
         self._pool = None
+        self._replica_pool = None
+        self._replica_dsn = replica_dsn or DATABASE_REPLICA_URL
+        self._max_replica_lag = DB_REPLICA_MAX_LAG_SEC if max_replica_lag is None else max_replica_lag
+        self._replica_lag = None
+        self._replica_lag_checked_at = 0.0
+        self._replica_failed_at = None
 
     async def connect(self):
+        # The replica pool is only opened by the first bulk read (_read_pool), so
+        # clients that only write never hold replica connections
         if not self._pool:
-            self._pool = await asyncpg.create_pool(DATABASE_URL)
+            self._pool = await asyncpg.create_pool(DATABASE_URL, init=_init_connection)
 
     async def close(self):
         if self._pool:
             await self._pool.close()
             self._pool = None
+        if self._replica_pool:
+            await self._replica_pool.close()
+            self._replica_pool = None
+
+    async def _read_pool(self):
+        """
+        Pool for bulk/analytical reads: the replica while its replay lag is under
+        the threshold, otherwise the primary. Writes and read-after-write lookups
+        always use self._pool directly, and so does everything for a short window
+        after a write (e.g. the cache reload that follows a check-in).
+        """
+        if not self._replica_dsn:
+            return self._pool
+        now = time.monotonic()
+        if now - _last_write_at < self._max_replica_lag:
+            return self._pool
+        if not self._replica_pool:
+            if self._replica_failed_at is not None and now - self._replica_failed_at < DB_REPLICA_LAG_CHECK_SEC:
+                return self._pool
+            try:
+                self._replica_pool = await asyncpg.create_pool(self._replica_dsn, init=_init_connection)
+                self._replica_failed_at = None
+            except Exception as e:
+                # Replica is an optimisation only, keep serving everything from the primary
+                logger.error(f"❌ Could not connect to read replica, using primary: {e}")
+                self._replica_failed_at = now
+                return self._pool
+        if self._replica_lag is None or now - self._replica_lag_checked_at > DB_REPLICA_LAG_CHECK_SEC:
+            try:
+                async with self._replica_pool.acquire() as conn:
+                    self._replica_lag = float(await conn.fetchval(REPLICA_LAG_QUERY))
+            except Exception as e:
+                logger.error(f"❌ Replica lag check failed, using primary: {e}")
+                self._replica_lag = float('inf')
+            self._replica_lag_checked_at = now
+        if self._replica_lag > self._max_replica_lag:
+            return self._pool
+        return self._replica_pool
+
+    @asynccontextmanager
+    async def _acquire(self, name: str, pool=None, readonly: bool = False):
+        """
+        Acquire a connection whose statements are recorded in query_stats under
+        `name`, together with the time spent waiting for the pool. Pass
+        readonly=True only for methods that never write: their slow statements
+        may be re-run under EXPLAIN ANALYZE (DB_EXPLAIN_SLOW).
+        """
+        pool = pool or self._pool
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            query_stats.record_acquire(name, (time.perf_counter() - start) * 1000)
+            yield TimedConnection(conn, name, readonly=readonly)
+
+    @staticmethod
+    def get_query_stats() -> Dict[str, Any]:
+        """Snapshot of per-query latency histograms, row counts, pool waits and the slow-query log."""
+        return query_stats.snapshot()
+
+    # STREAMING READS
+    async def iter_query(self, query: str, *args, prefetch: Optional[int] = None, name: str = 'iter_query', table: Optional[str] = None) -> AsyncIterator[Any]:
+        """
+        Stream rows of a SELECT through a server-side cursor, one dict at a time.
+        Only `prefetch` rows are held in memory at once, so callers can start
+        processing before the last row arrives. Runs on the read replica when
+        one is configured. Only time spent waiting on the cursor is recorded
+        under `name`, not the time the caller spends on each row. Rows come back
+        as `table`'s row type when a table is given, plain dicts otherwise.
+        """
+        async with self._acquire(name, await self._read_pool(), readonly=True) as conn:
+            rows = 0
+            busy = 0.0
+            failed = False
+            try:
+                # Postgres cursors only live inside a transaction
+                async with conn.transaction():
+                    cursor = conn.cursor(query, *args, prefetch=prefetch or DB_CURSOR_PREFETCH).__aiter__()
+                    cls = None
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            r = await cursor.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            busy += time.perf_counter() - start
+                        rows += 1
+                        if table is None:
+                            yield dict(r)
+                        else:
+                            if cls is None:
+                                cls = row_type(table, r.keys())
+                            yield cls(*r.values())
+            except Exception:
+                failed = True
+                raise
+            finally:
+                query_stats.record(name, busy * 1000, rows, error=failed)
+
+    async def iter_table(self, table: str, prefetch: Optional[int] = None, since: Optional[date] = None) -> AsyncIterator[Row]:
+        """
+        Stream every row of one of the cached tables (see STREAMABLE_TABLES).
+        For the monthly-partitioned log tables, `since` limits the scan to
+        for_date >= since, so older partitions are pruned.
+        """
+        if table not in STREAMABLE_TABLES:
+            raise DBError(f"Table {table!r} cannot be streamed")
+        if since is not None and table in PARTITIONED_LOG_TABLES:
+            query, args = f'SELECT * FROM {table} WHERE for_date >= $1', (as_date(since),)
+        else:
+            query, args = f'SELECT * FROM {table}', ()
+        async for row in self.iter_query(query, *args, prefetch=prefetch, name=f'iter_table:{table}', table=table):
+            yield row
 
     # USERS
     async def add_user(self, user_id: int, username: str, nickname: str, user_moji: str, dob: str, timezone: str, email: str, user_status: str = 'active'):
@@ -32,8 +322,9 @@ class DBClient:
         VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
         ON CONFLICT (user_id) DO NOTHING;
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('add_user') as conn:
             await conn.execute(query, user_id, username, nickname, user_moji, dob, timezone, email, user_status)
+            _note_write()
 
     async def update_user(self, user_id: int, nickname: str, user_moji: str, dob: str, timezone: str, email: str):
         """Update user fields by user_id."""
@@ -41,39 +332,47 @@ class DBClient:
         UPDATE users SET nickname=$2, user_moji=$3, dob=$4, timezone=$5, email=$6, last_born_on=NOW()
         WHERE user_id=$1
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('update_user') as conn:
             await conn.execute(query, user_id, nickname, user_moji, dob, timezone, email)
+            _note_write()
 
-    async def get_user_by_id(self, user_id: int) -> Optional[dict]:
+    async def get_user_by_id(self, user_id: int) -> Optional[Row]:
         query = 'SELECT * FROM users WHERE user_id=$1'
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_user_by_id', readonly=True) as conn:
             row = await conn.fetchrow(query, user_id)
-            return dict(row) if row else None
+            return to_row('users', row) if row else None
 
-    async def get_all_users(self) -> List[dict]:
+    async def get_all_users(self) -> List[Row]:
         query = 'SELECT * FROM users'
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_all_users', await self._read_pool(), readonly=True) as conn:
             rows = await conn.fetch(query)
-            return [dict(r) for r in rows]
+            return to_rows('users', rows)
+
+    async def iter_all_users(self, prefetch: Optional[int] = None) -> AsyncIterator[Row]:
+        """Streaming variant of get_all_users."""
+        async for row in self.iter_query('SELECT * FROM users', prefetch=prefetch, name='iter_all_users', table='users'):
+            yield row
 
     # HABITS
-    async def add_habit(self, user_id: int, username: str, year_month: str, habit_text: str, habit_type: str):
+    async def add_habit(self, user_id: int, username: str, year_month: str, habit_text: str, habit_type: str, habit_id: Optional[int] = None):
         query = '''
-        INSERT INTO habits (user_id, username, year_month, habit_text, habit_type)
-        VALUES ($1, $2, $3, $4, $5)
+        INSERT INTO habits (habit_id, user_id, username, year_month, habit_text, habit_type)
+        VALUES (COALESCE($6::int8, nextval(pg_get_serial_sequence('habits', 'habit_id'))), $1, $2, $3, $4, $5)
         '''
-        async with self._pool.acquire() as conn:
-            await conn.execute(query, user_id, username, year_month, habit_text, habit_type)
+        async with self._acquire('add_habit') as conn:
+            await conn.execute(query, user_id, username, year_month, habit_text, habit_type, habit_id)
+            _note_write()
 
     async def add_habits(self, habits: list):
         """
         Batch insert multiple habits. Each habit is a dict with keys: user_id, username, year_month, habit_text, habit_type
+        and optionally habit_id (an id from reserve_ids); without it the sequence assigns one.
         """
         if not habits:
             return
         query = '''
-        INSERT INTO habits (user_id, username, year_month, habit_text, habit_type)
-        VALUES ($1, $2, $3, $4, $5)
+        INSERT INTO habits (habit_id, user_id, username, year_month, habit_text, habit_type)
+        VALUES (COALESCE($6::int8, nextval(pg_get_serial_sequence('habits', 'habit_id'))), $1, $2, $3, $4, $5)
         '''
         values = [
             (
@@ -81,89 +380,91 @@ class DBClient:
                 habit['username'],
                 habit['year_month'],
                 habit['habit_text'],
-                habit['habit_type']
+                habit['habit_type'],
+                habit.get('habit_id')
             )
             for habit in habits
         ]
-        async with self._pool.acquire() as conn:
+        async with self._acquire('add_habits') as conn:
             await conn.executemany(query, values)
+            _note_write()
 
-    async def get_user_habits_for_month(self, user_id: int, year_month: str) -> List[dict]:
+    async def get_user_habits_for_month(self, user_id: int, year_month: str) -> List[Row]:
         query = '''
         SELECT * FROM habits WHERE user_id=$1 AND year_month=$2
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_user_habits_for_month', readonly=True) as conn:
             rows = await conn.fetch(query, user_id, year_month)
-            return [dict(r) for r in rows]
+            return to_rows('habits', rows)
 
     async def has_existing_core_habits(self, user_id: int, year_month: str) -> bool:
         query = '''
         SELECT 1 FROM habits WHERE user_id=$1 AND year_month=$2 AND habit_type='core' LIMIT 1
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('has_existing_core_habits', readonly=True) as conn:
             row = await conn.fetchrow(query, user_id, year_month)
             return bool(row)
 
     # CHECK-INS (core_habit_log)
-    async def log_checkin(self, for_date: str, year_month: str, user_id: int, username: str, habit_id: int, habit_text: str, habit_status: str, marked_by: str):
-        query = '''
-        INSERT INTO core_habit_log (for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-        '''
-        async with self._pool.acquire() as conn:
-            await conn.execute(query, for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by)
+    async def log_checkin(self, for_date: str, year_month: str, user_id: int, username: str, habit_id: int, habit_text: str, habit_status: str, marked_by: str) -> List[Row]:
+        """Single check-in; same upsert and precedence rules as add_checkins."""
+        return await self.add_checkins([{
+            'for_date': for_date, 'year_month': year_month, 'user_id': user_id, 'username': username,
+            'habit_id': habit_id, 'habit_text': habit_text, 'habit_status': habit_status, 'marked_by': marked_by,
+        }])
 
    #has_already_checked_in is true if in daily score log scoretype is core and a row is present for the userid for that date
     async def has_already_checked_in(self, user_id: int, for_date: str) -> bool:
         query = '''
         SELECT 1 FROM daily_score_log WHERE user_id=$1 AND for_date=$2 AND score_type='core' LIMIT 1
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('has_already_checked_in', readonly=True) as conn:
             row = await conn.fetchrow(query, user_id, for_date)
             return bool(row)
 
-    async def get_user_checkin_summary(self, user_id: int, for_date: str) -> List[dict]:
+    async def get_user_checkin_summary(self, user_id: int, for_date: str) -> List[Row]:
         query = '''
          SELECT * FROM daily_score_log WHERE user_id=$1 AND for_date=$2 AND score_type='core' LIMIT 1
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_user_checkin_summary', readonly=True) as conn:
             rows = await conn.fetch(query, user_id, for_date)
-            return [dict(r) for r in rows]
+            return to_rows('daily_score_log', rows)
 
     # DND
-    async def add_dnd_period(self, year_month: str, username: str, user_id: int, habit_id: int, habit_text: str, start_date: str, end_date: str):
+    async def add_dnd_period(self, year_month: str, username: str, user_id: int, habit_id: int, habit_text: str, start_date: str, end_date: str, dnd_log_id: Optional[int] = None):
         query = '''
-            INSERT INTO dnd_log (year_month, username, user_id, habit_id, habit_text, start_date, end_date)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            INSERT INTO dnd_log (dnd_log_id, year_month, username, user_id, habit_id, habit_text, start_date, end_date)
+            VALUES (COALESCE($8::int8, nextval(pg_get_serial_sequence('dnd_log', 'dnd_log_id'))), $1, $2, $3, $4, $5, $6, $7)
             RETURNING dnd_log_id
         '''
-        async with self._pool.acquire() as conn:
-            row = await conn.fetchrow(query, year_month, username, user_id, habit_id, habit_text, start_date, end_date)
+        async with self._acquire('add_dnd_period') as conn:
+            row = await conn.fetchrow(query, year_month, username, user_id, habit_id, habit_text, start_date, end_date, dnd_log_id)
+            _note_write()
         return row['dnd_log_id'] if row else None
 
-    async def get_dnd_entries_for_user(self, user_id: int) -> List[dict]:
+    async def get_dnd_entries_for_user(self, user_id: int) -> List[Row]:
         query = 'SELECT * FROM dnd_log WHERE user_id=$1'
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_dnd_entries_for_user', readonly=True) as conn:
             rows = await conn.fetch(query, user_id)
-            return [dict(row) for row in rows]
+            return to_rows('dnd_log', rows)
 
     async def is_date_in_dnd_period(self, user_id: int, check_date: str, habit_id: int) -> bool:
         query = '''
         SELECT 1 FROM dnd_log WHERE user_id=$1 AND habit_id=$2 AND start_date <= $3 AND end_date >= $3 LIMIT 1
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('is_date_in_dnd_period', readonly=True) as conn:
             row = await conn.fetchrow(query, user_id, habit_id, check_date)
             return bool(row)
 
     # DAILY SCORE LOG
-    async def get_streak_summary(self, for_date: date) -> List[dict]:
+    async def get_streak_summary(self, for_date: date) -> List[Row]:
         """Get all streak summary rows for a given date (expects a datetime.date object)."""
         query = '''
         SELECT * FROM daily_score_log WHERE for_date=$1 AND score_type='streak'
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_streak_summary', await self._read_pool(), readonly=True) as conn:
             rows = await conn.fetch(query, for_date)
-            return [dict(r) for r in rows]
+            return to_rows('daily_score_log', rows)
 
    #  async def log_streak_row(self, for_date: str, user_id: int, username: str, log_txt_json: dict, score: int, score_type: str):
    #      query = '''
@@ -179,7 +480,7 @@ class DBClient:
         query = '''
         SELECT habit_text FROM habits WHERE user_id=$1 AND year_month=$2
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_user_habits_for_date', readonly=True) as conn:
             rows = await conn.fetch(query, user_id, year_month)
             return [r['habit_text'] for r in rows]
 
@@ -187,11 +488,13 @@ class DBClient:
     async def check_rest_day_eligibility(self, user_id: int, habit_id: int, check_date: str) -> bool:
         query = '''
         SELECT habit_status FROM core_habit_log
-        WHERE user_id=$1 AND habit_id=$2 AND for_date < $3
+        WHERE user_id=$1 AND habit_id=$2 AND for_date < $3 AND for_date >= $4
         ORDER BY for_date DESC LIMIT 6
         '''
-        async with self._pool.acquire() as conn:
-            rows = await conn.fetch(query, user_id, habit_id, check_date)
+        # Habits are per month, so the month start bounds the scan to one partition
+        check_date = as_date(check_date)
+        async with self._acquire('check_rest_day_eligibility', readonly=True) as conn:
+            rows = await conn.fetch(query, user_id, habit_id, check_date, check_date.replace(day=1))
             return all(r['habit_status'] == '✅' for r in rows) if rows else True
 
     # Utility: get habit timestamp (created_at) for a user's habit in a month
@@ -199,15 +502,16 @@ class DBClient:
         query = '''
         SELECT created_at FROM habits WHERE user_id=$1 AND year_month=$2 ORDER BY created_at DESC LIMIT 1
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_habit_timestamp', readonly=True) as conn:
             row = await conn.fetchrow(query, user_id, year_month)
             return row['created_at'].isoformat() if row else None
 
     # Utility: delete DND entry
     async def delete_dnd_entry(self, dnd_log_id: int) -> bool:
         query = 'DELETE FROM dnd_log WHERE dnd_log_id=$1'
-        async with self._pool.acquire() as conn:
+        async with self._acquire('delete_dnd_entry') as conn:
             result = await conn.execute(query, dnd_log_id)
+            _note_write()
             return result[-1] == '1'
 
     # Utility: update DND entry
@@ -232,51 +536,472 @@ class DBClient:
             return False
         set_clause = ', '.join(set_clauses)
         query = f'UPDATE dnd_log SET {set_clause} WHERE dnd_log_id=$1'
-        async with self._pool.acquire() as conn:
+        async with self._acquire('update_dnd_entry') as conn:
             result = await conn.execute(query, dnd_log_id, *params)
+            _note_write()
             return result[-1] == '1'
 
     # Utility: get all check-ins for a user
-    async def get_all_checkins_for_user(self, user_id: int) -> List[dict]:
+    async def get_all_checkins_for_user(self, user_id: int) -> List[Row]:
         query = '''SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='core'
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_all_checkins_for_user', await self._read_pool(), readonly=True) as conn:
             rows = await conn.fetch(query, user_id)
-            return [dict(r) for r in rows]
+            return to_rows('daily_score_log', rows)
+
+    async def iter_all_checkins_for_user(self, user_id: int, prefetch: Optional[int] = None) -> AsyncIterator[Row]:
+        """Streaming variant of get_all_checkins_for_user."""
+        query = '''SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='core'
+        '''
+        async for row in self.iter_query(query, user_id, prefetch=prefetch, name='iter_all_checkins_for_user', table='daily_score_log'):
+            yield row
 
     # Utility: get all daily scores for a user
-    async def get_all_daily_scores_for_user(self, user_id: int) -> List[dict]:
+    async def get_all_daily_scores_for_user(self, user_id: int) -> List[Row]:
         query = '''SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='streak'
         '''
-        async with self._pool.acquire() as conn:
+        async with self._acquire('get_all_daily_scores_for_user', await self._read_pool(), readonly=True) as conn:
             rows = await conn.fetch(query, user_id)
-            return [dict(r) for r in rows]
+            return to_rows('daily_score_log', rows)
+
+    async def iter_all_daily_scores_for_user(self, user_id: int, prefetch: Optional[int] = None) -> AsyncIterator[Row]:
+        """Streaming variant of get_all_daily_scores_for_user."""
+        query = '''SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='streak'
+        '''
+        async for row in self.iter_query(query, user_id, prefetch=prefetch, name='iter_all_daily_scores_for_user', table='daily_score_log'):
+            yield row
 
-    async def add_checkins(self, checkins: list):
+    async def add_checkins(self, checkins: list) -> List[Row]:
         """
-        Batch insert multiple check-ins. Each check-in is a dict with keys: for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by
+        Upsert multiple check-ins in one round trip. Each check-in is a dict with keys: for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by
+        and optionally core_log_id (an id from reserve_ids).
+        Rows are keyed on (user_id, habit_id, for_date) (see schemas/sql/001_core_habit_log_unique.sql).
+        A manual check-in replaces an existing auto-marked row; any other conflict keeps the row already stored.
+        Returns the core_habit_log rows that are now stored for every input key, with `written`
+        set to True where this call inserted/replaced the row and False where an existing row won.
         """
         if not checkins:
-            return
+            return []
+        async with self._acquire('add_checkins') as conn:
+            rows = await conn.fetch(UPSERT_CHECKINS_QUERY, *_checkin_columns(checkins))
+            if any(r['written'] for r in rows):
+                _note_write()
+            return to_rows('core_habit_log', rows)
+
+    async def submit_checkin(self, user_id: int, username: str, for_date, statuses: list, marked_by: str = 'manual') -> Tuple[List[Row], List[Row]]:
+        """
+        Record a user's whole check-in for one day in one round trip. statuses is a list of
+        (habit_id, habit_text, habit_status) tuples, optionally with a fourth core_log_id
+        (an id from reserve_ids); without one the sequence assigns it.
+        Returns (landed, score_rows): the core_habit_log rows now stored for every habit,
+        with `written` like add_checkins, and the core and streak rows for for_date and
+        every later day of the user.
+        Runs the submit_checkin() SQL function (schemas/sql/002_submit_checkin.sql); where
+        it isn't installed, the upsert and the read share one transaction instead.
+        """
+        global _submit_checkin_fn
+        for_date = as_date(for_date)
+        habit_ids = [s[0] for s in statuses]
+        habit_texts = [s[1] for s in statuses]
+        habit_statuses = [s[2] for s in statuses]
+        core_log_ids = [s[3] if len(s) > 3 else None for s in statuses]
+        async with self._acquire('submit_checkin') as conn:
+            if _submit_checkin_fn:
+                try:
+                    rows = await conn.fetch(
+                        'SELECT * FROM submit_checkin($1, $2, $3, $4, $5, $6, $7, $8)',
+                        user_id, username, for_date, habit_ids, habit_texts, habit_statuses, marked_by, core_log_ids)
+                    _note_write()
+                    landed = to_rows('core_habit_log', [
+                        {**dict(r['checkin_row']), 'written': r['written']} for r in rows if r['checkin_row'] is not None
+                    ])
+                    return landed, to_rows('daily_score_log', [r['score_row'] for r in rows if r['score_row'] is not None])
+                except asyncpg.exceptions.UndefinedFunctionError:
+                    logger.info("submit_checkin() function not installed, using a transaction instead")
+                    _submit_checkin_fn = False
+            checkins = [
+                {
+                    'for_date': for_date, 'year_month': for_date.strftime('%Y%m'), 'user_id': user_id,
+                    'username': username, 'habit_id': habit_id, 'habit_text': habit_text,
+                    'habit_status': habit_status, 'marked_by': marked_by, 'core_log_id': core_log_id,
+                }
+                for habit_id, habit_text, habit_status, core_log_id in zip(habit_ids, habit_texts, habit_statuses, core_log_ids)
+            ]
+            async with conn.transaction():
+                landed = await conn.fetch(UPSERT_CHECKINS_QUERY, *_checkin_columns(checkins))
+                rows = await conn.fetch(DAILY_SCORES_SINCE_QUERY, user_id, for_date)
+            _note_write()
+            return to_rows('core_habit_log', landed), to_rows('daily_score_log', rows)
+
+    async def get_daily_scores_since(self, user_id: int, for_date) -> List[Row]:
+        """A user's core and streak rows for for_date and every later day (read-after-write: primary)."""
+        async with self._acquire('get_daily_scores_since', readonly=True) as conn:
+            rows = await conn.fetch(DAILY_SCORES_SINCE_QUERY, user_id, as_date(for_date))
+            return to_rows('daily_score_log', rows)
+
+    async def get_daily_scores_since_many(self, since: Dict[int, Any]) -> List[Row]:
+        """get_daily_scores_since for every {user_id: for_date} in one round trip (read-after-write: primary)."""
+        if not since:
+            return []
+        user_ids = list(since)
+        async with self._acquire('get_daily_scores_since_many', readonly=True) as conn:
+            rows = await conn.fetch(DAILY_SCORES_SINCE_MANY_QUERY, user_ids, [as_date(since[u]) for u in user_ids])
+            return to_rows('daily_score_log', rows)
+
+    async def overwrite_checkins(self, checkins: list) -> List[Row]:
+        """
+        Correct past check-ins: like add_checkins, but an existing row for the same
+        (user_id, habit_id, for_date) is always replaced, whoever marked it.
+        Returns the stored core_habit_log rows.
+        """
+        if not checkins:
+            return []
         query = '''
-        INSERT INTO core_habit_log (for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+        INSERT INTO core_habit_log (core_log_id, for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by)
+        SELECT COALESCE(core_log_id, nextval(pg_get_serial_sequence('core_habit_log', 'core_log_id'))),
+               for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by
+        FROM unnest($1::date[], $2::text[], $3::int8[], $4::text[], $5::int8[], $6::text[], $7::text[], $8::text[], $9::int8[])
+            AS t(for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by, core_log_id)
+        ON CONFLICT (user_id, habit_id, for_date) DO UPDATE
+        SET habit_text=EXCLUDED.habit_text, habit_status=EXCLUDED.habit_status, marked_by=EXCLUDED.marked_by
+        RETURNING *
         '''
-        values = [
-            (
-                c['for_date'],
-                c['year_month'],
-                c['user_id'],
-                c['username'],
-                c['habit_id'],
-                c['habit_text'],
-                c['habit_status'],
-                c['marked_by']
-            )
-            for c in checkins
-        ]
-        async with self._pool.acquire() as conn:
-            await conn.executemany(query, values)
+        async with self._acquire('overwrite_checkins') as conn:
+            rows = await conn.fetch(query, *_checkin_columns(checkins))
+            _note_write()
+            return to_rows('core_habit_log', rows)
+
+    async def apply_score_diff(self, updates: list, inserts: list, deletes: list):
+        """
+        Bulk-apply a recomputed daily_score_log diff (see bot/utils/recompute.py) in one transaction.
+        updates: [(score_log_id, score)], inserts: [(user_id, username, for_date, score_type, score, log_txt_json text)],
+        deletes: [score_log_id].
+        """
+        async with self._acquire('apply_score_diff') as conn:
+            async with conn.transaction():
+                if updates:
+                    ids, scores = zip(*updates)
+                    await conn.execute('''
+                        UPDATE daily_score_log d SET score = u.score
+                        FROM unnest($1::int8[], $2::int8[]) AS u(score_log_id, score)
+                        WHERE d.score_log_id = u.score_log_id
+                    ''', list(ids), list(scores))
+                if inserts:
+                    user_ids, usernames, for_dates, score_types, scores, log_txts = (list(col) for col in zip(*inserts))
+                    await conn.execute('''
+                        INSERT INTO daily_score_log (user_id, username, for_date, score_type, score, log_txt_json)
+                        SELECT user_id, username, for_date, score_type, score, log_txt::json
+                        FROM unnest($1::int8[], $2::text[], $3::date[], $4::text[], $5::int8[], $6::text[])
+                            AS t(user_id, username, for_date, score_type, score, log_txt)
+                    ''', user_ids, usernames, [as_date(d) for d in for_dates], score_types, scores, log_txts)
+                if deletes:
+                    await conn.execute('DELETE FROM daily_score_log WHERE score_log_id = ANY($1::int8[])', list(deletes))
+            _note_write()
+
+    # PARTITIONS, ROLLUPS AND ARCHIVAL (schemas/sql/003_monthly_log_partitions.sql)
+    async def ensure_log_partitions(self, from_date, months: int) -> List[str]:
+        """Create any missing monthly partitions of the log tables for `months` months from from_date."""
+        async with self._acquire('ensure_log_partitions') as conn:
+            rows = await conn.fetch('SELECT ensure_log_partitions($1, $2) AS name', as_date(from_date), months)
+            return [r['name'] for r in rows]
+
+    async def list_log_partitions(self) -> List[Dict[str, Any]]:
+        """Attached monthly partitions of the log tables: [{'table', 'partition', 'year_month'}]."""
+        query = '''
+        SELECT parent.relname AS parent, child.relname AS child
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = ANY($1::text[])
+        '''
+        async with self._acquire('list_log_partitions', readonly=True) as conn:
+            rows = await conn.fetch(query, list(PARTITIONED_LOG_TABLES))
+        partitions = []
+        for r in rows:
+            m = re.fullmatch(r'.*_y(\d{4})m(\d{2})', r['child'])
+            if m:
+                partitions.append({'table': r['parent'], 'partition': r['child'], 'year_month': m.group(1) + m.group(2)})
+        return sorted(partitions, key=lambda p: (p['year_month'], p['table']))
+
+    async def rollup_month(self, year_month: str) -> int:
+        """
+        (Re)build monthly_score_summary for one month from its core_habit_log and
+        daily_score_log rows. The for_date bounds keep both scans on the month's
+        partitions. Returns the number of users summarised.
+        """
+        start, end = _month_bounds(year_month)
+        query = '''
+        WITH habits AS (
+            SELECT user_id, max(username) AS username,
+                   count(DISTINCT for_date) AS days_checked_in,
+                   count(*) FILTER (WHERE habit_status = '✅') AS done_count,
+                   count(*) FILTER (WHERE habit_status = '❌') AS missed_count,
+                   count(*) FILTER (WHERE habit_status = '⏭️') AS rest_count,
+                   count(*) FILTER (WHERE habit_status = '⛔') AS dnd_count
+            FROM core_habit_log WHERE for_date >= $2 AND for_date < $3
+            GROUP BY user_id
+        ), scores AS (
+            SELECT user_id,
+                   count(*) FILTER (WHERE score_type = 'core' AND score > 0) AS clean_days,
+                   COALESCE(sum(score) FILTER (WHERE score_type = 'core'), 0) AS core_total,
+                   (array_agg(score ORDER BY for_date DESC) FILTER (WHERE score_type = 'streak'))[1] AS streak_end,
+                   max(score) FILTER (WHERE score_type = 'streak') AS streak_max
+            FROM daily_score_log WHERE for_date >= $2 AND for_date < $3
+            GROUP BY user_id
+        )
+        INSERT INTO monthly_score_summary (user_id, year_month, username, days_checked_in, clean_days, done_count,
+                                           missed_count, rest_count, dnd_count, core_total, streak_end, streak_max, rolled_up_at)
+        SELECT h.user_id, $1, h.username, h.days_checked_in, COALESCE(s.clean_days, 0), h.done_count,
+               h.missed_count, h.rest_count, h.dnd_count, COALESCE(s.core_total, 0), s.streak_end, s.streak_max, now()
+        FROM habits h LEFT JOIN scores s USING (user_id)
+        ON CONFLICT (user_id, year_month) DO UPDATE
+        SET username=EXCLUDED.username, days_checked_in=EXCLUDED.days_checked_in, clean_days=EXCLUDED.clean_days,
+            done_count=EXCLUDED.done_count, missed_count=EXCLUDED.missed_count, rest_count=EXCLUDED.rest_count,
+            dnd_count=EXCLUDED.dnd_count, core_total=EXCLUDED.core_total, streak_end=EXCLUDED.streak_end,
+            streak_max=EXCLUDED.streak_max, rolled_up_at=EXCLUDED.rolled_up_at
+        '''
+        async with self._acquire('rollup_month') as conn:
+            status = await conn.execute(query, year_month, start, end)
+            _note_write()
+        return int(status.rsplit(' ', 1)[-1])
+
+    async def get_rolled_up_months(self) -> List[str]:
+        async with self._acquire('get_rolled_up_months', readonly=True) as conn:
+            rows = await conn.fetch('SELECT DISTINCT year_month FROM monthly_score_summary ORDER BY year_month')
+            return [r['year_month'] for r in rows]
+
+    async def get_monthly_summaries(self, user_id: int) -> List[Row]:
+        """A user's monthly_score_summary rows, oldest first."""
+        async with self._acquire('get_monthly_summaries', await self._read_pool(), readonly=True) as conn:
+            rows = await conn.fetch('SELECT * FROM monthly_score_summary WHERE user_id=$1 ORDER BY year_month', user_id)
+            return to_rows('monthly_score_summary', rows)
+
+    async def detach_log_month(self, year_month: str, archive_schema: Optional[str] = None) -> List[str]:
+        """
+        Detach the month's log partitions, leaving them as standalone tables
+        (moved into archive_schema when given). Roll the month up first: its raw
+        rows are no longer visible through core_habit_log/daily_score_log.
+        Returns the detached partition names.
+        """
+        _month_bounds(year_month)  # validates year_month before it is used in identifiers
+        detached = []
+        async with self._acquire('detach_log_month') as conn:
+            async with conn.transaction():
+                if archive_schema:
+                    await conn.execute(f'CREATE SCHEMA IF NOT EXISTS {_quote_ident(archive_schema)}')
+                for table in PARTITIONED_LOG_TABLES:
+                    part = f'{table}_y{year_month[:4]}m{year_month[4:]}'
+                    exists = await conn.fetchval('SELECT to_regclass($1) IS NOT NULL', part)
+                    if not exists:
+                        continue
+                    await conn.execute(f'ALTER TABLE {table} DETACH PARTITION {part}')
+                    if archive_schema:
+                        await conn.execute(f'ALTER TABLE {part} SET SCHEMA {_quote_ident(archive_schema)}')
+                    detached.append(part)
+            _note_write()
+        return detached
+
+    # CACHE VERIFICATION (bot/utils/cache_verifier.py)
+    async def table_checksums(self, table: str, buckets: int, since: Optional[date] = None) -> Dict[int, Tuple[int, int]]:
+        """
+        {bucket: (row count, sum of row hashes)} for `table` with rows bucketed by
+        user_id % buckets. `since` limits the partitioned log tables as in iter_table.
+        """
+        if table not in CHECKSUM_COLUMNS:
+            raise DBError(f"Table {table!r} has no checksum columns")
+        columns = ', '.join(CHECKSUM_COLUMNS[table])
+        where, args = '', [buckets]
+        if since is not None and table in PARTITIONED_LOG_TABLES:
+            where, args = 'WHERE for_date >= $2', [buckets, as_date(since)]
+        query = f'''
+        SELECT user_id % $1 AS bucket, count(*) AS n,
+               COALESCE(sum(('x' || substr(md5(concat_ws('|', {columns})), 1, 15))::bit(60)::bigint), 0) AS h
+        FROM {table} {where}
+        GROUP BY 1
+        '''
+        async with self._acquire('table_checksums', await self._read_pool(), readonly=True) as conn:
+            rows = await conn.fetch(query, *args)
+            return {r['bucket']: (r['n'], int(r['h'])) for r in rows}
+
+    async def fetch_buckets(self, table: str, buckets: int, selected: List[int], since: Optional[date] = None) -> List[Row]:
+        """Rows of `table` whose user_id % buckets is in `selected` (read-after-write: primary)."""
+        if table not in CHECKSUM_COLUMNS:
+            raise DBError(f"Table {table!r} has no checksum columns")
+        query = f'SELECT * FROM {table} WHERE user_id % $1 = ANY($2::int8[])'
+        args = [buckets, list(selected)]
+        if since is not None and table in PARTITIONED_LOG_TABLES:
+            query += ' AND for_date >= $3'
+            args.append(as_date(since))
+        async with self._acquire('fetch_buckets', readonly=True) as conn:
+            rows = await conn.fetch(query, *args)
+            return to_rows(table, rows)
+
+    # BULK IMPORT (bot/utils/sheets_import.py)
+    async def import_rows(self, table: str, columns: List[str], records: list) -> int:
+        """
+        Bulk-load records (tuples in `columns` order) into one of the IMPORT_KEYS tables.
+        The batch is COPY'd into a temporary staging table, then every row whose
+        IMPORT_KEYS key isn't stored yet is inserted, all in one transaction, so
+        re-running a batch inserts nothing. Check-ins are inserted in for_date order
+        for the score triggers. Returns the number of rows inserted.
+        """
+        if table not in IMPORT_KEYS:
+            raise DBError(f"Table {table!r} cannot be imported")
+        if not records:
+            return 0
+        key = IMPORT_KEYS[table]
+        cols = ', '.join(columns)
+        keys = ', '.join(key)
+        match = ' AND '.join(f't.{k} = s.{k}' for k in key)
+        order = 'for_date' if table == 'core_habit_log' else keys
+        query = f'''
+        INSERT INTO {table} ({cols})
+        SELECT {cols} FROM (
+            SELECT DISTINCT ON ({keys}) * FROM import_stage s
+            WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})
+            ORDER BY {keys}
+        ) s
+        ORDER BY {order}
+        '''
+        id_column = ID_COLUMNS.get(table)
+        async with self._acquire('import_rows') as conn:
+            async with conn.transaction():
+                await conn.execute(f'CREATE TEMP TABLE import_stage ON COMMIT DROP AS SELECT {cols} FROM {table} WITH NO DATA')
+                await conn.copy_records_to_table('import_stage', records=records, columns=list(columns))
+                status = await conn.execute(query)
+                if id_column in columns:
+                    # Explicit ids skip the sequence; move it past them (never backwards,
+                    # ids handed out by reserve_ids may not be inserted yet)
+                    await conn.execute(f'''
+                        SELECT setval(s::regclass, GREATEST((SELECT max({id_column}) FROM {table}), nextval(s::regclass)))
+                        FROM pg_get_serial_sequence($1, $2) AS s
+                    ''', table, id_column)
+            inserted = int(status.split()[-1])
+            if inserted:
+                _note_write()
+            return inserted
+
+    # ID RESERVATION
+    async def reserve_ids(self, table: str, count: int) -> List[int]:
+        """
+        Draw `count` ids from the table's sequence in one round trip. Rows created
+        in DbCache with these ids can later be inserted with the same id, so the
+        cache and the DB agree without a reload.
+        """
+        if table not in ID_COLUMNS:
+            raise DBError(f"Table {table!r} has no reservable id")
+        query = 'SELECT nextval(pg_get_serial_sequence($1, $2)) AS id FROM generate_series(1, $3)'
+        async with self._acquire('reserve_ids') as conn:
+            rows = await conn.fetch(query, table, ID_COLUMNS[table], count)
+            return [r['id'] for r in rows]
+
+    # SCHEDULER STATE (schemas/sql/004_scheduler_state.sql)
+    async def load_scheduler_state(self, since: datetime) -> Tuple[List[Row], Dict[str, str]]:
+        """The scheduler_user_state rows updated at or after `since`, and all scheduler_flags as {name: value}."""
+        async with self._acquire('load_scheduler_state', readonly=True) as conn:
+            rows = await conn.fetch('SELECT * FROM scheduler_user_state WHERE updated_at >= $1', since)
+            flags = await conn.fetch('SELECT name, value FROM scheduler_flags')
+            return to_rows('scheduler_user_state', rows), {r['name']: r['value'] for r in flags}
+
+    async def save_scheduler_state(self, users: list, flags: Dict[str, Optional[str]], prune_before: Optional[datetime] = None):
+        """
+        Upsert scheduler state in one transaction. users is a list of
+        (user_id, reminder_count, last_reminder_at, last_auto_at) tuples; rows last
+        updated before prune_before are deleted.
+        """
+        async with self._acquire('save_scheduler_state') as conn:
+            async with conn.transaction():
+                if users:
+                    user_ids, counts, reminded, auto = (list(c) for c in zip(*users))
+                    await conn.execute('''
+                    INSERT INTO scheduler_user_state (user_id, reminder_count, last_reminder_at, last_auto_at, updated_at)
+                    SELECT user_id, reminder_count, last_reminder_at, last_auto_at, now()
+                    FROM unnest($1::int8[], $2::int[], $3::timestamptz[], $4::timestamptz[])
+                        AS t(user_id, reminder_count, last_reminder_at, last_auto_at)
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET reminder_count = EXCLUDED.reminder_count, last_reminder_at = EXCLUDED.last_reminder_at,
+                        last_auto_at = EXCLUDED.last_auto_at, updated_at = EXCLUDED.updated_at
+                    ''', user_ids, counts, reminded, auto)
+                if flags:
+                    await conn.execute('''
+                    INSERT INTO scheduler_flags (name, value, updated_at)
+                    SELECT name, value, now() FROM unnest($1::text[], $2::text[]) AS t(name, value)
+                    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+                    ''', list(flags), list(flags.values()))
+                if prune_before is not None:
+                    await conn.execute('DELETE FROM scheduler_user_state WHERE updated_at < $1', prune_before)
+
+    # SCHEDULER LEASES (schemas/sql/005_scheduler_leases.sql, 006_scheduler_lease_ticks.sql)
+    async def heartbeat_scheduler_leases(self, worker_id: str, shards: int, lease_sec: float,
+                                         last_tick: Optional[datetime] = None) -> Tuple[List[int], bool, Dict[int, Optional[datetime]]]:
+        """
+        Record this worker as alive, renew its leases (stamping last_tick on them),
+        give back shards above its fair share ceil(shards / live workers) and claim
+        free or expired ones up to it, and try for the leader lease (shard -1).
+        Returns (owned shards, is leader, {claimed shard: last tick its previous owner stamped}).
+        """
+        async with self._acquire('heartbeat_scheduler_leases') as conn:
+            async with conn.transaction():
+                await conn.execute('''
+                INSERT INTO scheduler_workers (worker_id, heartbeat_at) VALUES ($1, now())
+                ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = now()
+                ''', worker_id)
+                await conn.execute(
+                    "DELETE FROM scheduler_workers WHERE heartbeat_at < now() - make_interval(secs => $1::float8 * 10)", lease_sec)
+                live = await conn.fetchval(
+                    "SELECT count(*) FROM scheduler_workers WHERE heartbeat_at >= now() - make_interval(secs => $1)", lease_sec)
+                fair = -(-shards // max(live, 1))
+                held = sorted(r['shard'] for r in await conn.fetch('''
+                UPDATE scheduler_leases SET expires_at = now() + make_interval(secs => $2),
+                    last_tick_at = COALESCE($4, last_tick_at)
+                WHERE owner = $1 AND shard >= 0 AND shard < $3
+                RETURNING shard
+                ''', worker_id, lease_sec, shards, last_tick))
+                if len(held) > fair:
+                    await conn.execute('DELETE FROM scheduler_leases WHERE owner = $1 AND shard = ANY($2::int[])',
+                                       worker_id, held[fair:])
+                    held = held[:fair]
+                claimed = {}
+                if len(held) < fair:
+                    # An expired row keeps its last_tick_at: the dead owner's last pass
+                    rows = await conn.fetch('''
+                    INSERT INTO scheduler_leases (shard, owner, expires_at)
+                    SELECT s, $1, now() + make_interval(secs => $2)
+                    FROM generate_series(0, $3 - 1) s
+                    WHERE NOT EXISTS (SELECT 1 FROM scheduler_leases l WHERE l.shard = s AND l.expires_at >= now())
+                    ORDER BY s LIMIT $4
+                    ON CONFLICT (shard) DO UPDATE SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+                    WHERE scheduler_leases.expires_at < now()
+                    RETURNING shard, last_tick_at
+                    ''', worker_id, lease_sec, shards, fair - len(held))
+                    claimed = {r['shard']: r['last_tick_at'] for r in rows}
+                    held = sorted(held + list(claimed))
+                leader = await conn.fetchval('''
+                INSERT INTO scheduler_leases (shard, owner, expires_at) VALUES (-1, $1, now() + make_interval(secs => $2))
+                ON CONFLICT (shard) DO UPDATE SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+                WHERE scheduler_leases.owner = $1 OR scheduler_leases.expires_at < now()
+                RETURNING shard
+                ''', worker_id, lease_sec)
+                return held, leader is not None, claimed
+
+    async def release_scheduler_leases(self, worker_id: str):
+        """Give up every lease of this worker (clean shutdown), so others take over without waiting for expiry."""
+        async with self._acquire('release_scheduler_leases') as conn:
+            async with conn.transaction():
+                await conn.execute('DELETE FROM scheduler_leases WHERE owner = $1', worker_id)
+                await conn.execute('DELETE FROM scheduler_workers WHERE worker_id = $1', worker_id)
+
+def get_db_client():
+    """
+    Return a client for the configured DB_BACKEND. Both backends expose the
+    same coroutine methods, so callers never need to know which one they got.
+    """
+    if DB_BACKEND == 'sqlite':
+        from bot.utils.local_db import LocalDBClient
+        return LocalDBClient()
+    if DB_BACKEND != 'postgres':
+        raise DBError(f"Unknown DB_BACKEND {DB_BACKEND!r}")
+    return DBClient()
 
 # Usage example (in your bot):
 # db = DBClient()
@@ -0,0 +1,212 @@
+"""
+Per-query latency statistics for DBClient.
+
+Every DBClient method acquires its connection through DBClient._acquire(name),
+which hands back a TimedConnection. The wrapper times each statement, counts
+the rows it returned or touched and records everything under the stable query
+name (the DBClient method name) in the process-wide `query_stats` collector.
+Statements slower than DB_SLOW_QUERY_MS land in a bounded slow-query log with
+their parameters redacted, optionally with the EXPLAIN ANALYZE plan attached
+(only for connections the caller acquired as read-only).
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Statements slower than this (milliseconds) are written to the slow-query log
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# Attach EXPLAIN ANALYZE output to slow read-only queries ("1" to enable; costs a second run)
+DB_EXPLAIN_SLOW = os.getenv("DB_EXPLAIN_SLOW", "0") == "1"
+# Number of slow-query entries kept in memory
+DB_SLOW_QUERY_LOG_SIZE = int(os.getenv("DB_SLOW_QUERY_LOG_SIZE", "100"))
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def redact_params(args) -> List[str]:
+    """Replace query parameters with their type (and length for strings/bytes)."""
+    redacted = []
+    for arg in args:
+        if isinstance(arg, (str, bytes)):
+            redacted.append(f"<{type(arg).__name__}:{len(arg)}>")
+        elif isinstance(arg, (list, tuple)):
+            redacted.append(f"<{type(arg).__name__}:{len(arg)} items>")
+        else:
+            redacted.append(f"<{type(arg).__name__}>")
+    return redacted
+
+
+def _status_row_count(status) -> int:
+    # "INSERT 0 3", "UPDATE 1", "DELETE 0" -> trailing number
+    if isinstance(status, str):
+        last = status.rsplit(" ", 1)[-1]
+        if last.isdigit():
+            return int(last)
+    return 0
+
+
+class _QueryStat:
+    __slots__ = ("calls", "errors", "rows", "total_ms", "max_ms", "buckets",
+                 "acquires", "acquire_total_ms", "acquire_max_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.acquires = 0
+        self.acquire_total_ms = 0.0
+        self.acquire_max_ms = 0.0
+
+
+class QueryStats:
+    """Thread-safe collector of per-query-name latency, row count and pool wait stats."""
+
+    def __init__(self, slow_ms: float = DB_SLOW_QUERY_MS, slow_log_size: int = DB_SLOW_QUERY_LOG_SIZE):
+        self.slow_ms = slow_ms
+        self._stats: Dict[str, _QueryStat] = {}
+        self._slow_log = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> _QueryStat:
+        stat = self._stats.get(name)
+        if stat is None:
+            stat = self._stats[name] = _QueryStat()
+        return stat
+
+    def record_acquire(self, name: str, wait_ms: float):
+        with self._lock:
+            stat = self._get(name)
+            stat.acquires += 1
+            stat.acquire_total_ms += wait_ms
+            stat.acquire_max_ms = max(stat.acquire_max_ms, wait_ms)
+
+    def record(self, name: str, elapsed_ms: float, rows: int = 0, error: bool = False):
+        with self._lock:
+            stat = self._get(name)
+            stat.calls += 1
+            stat.rows += rows
+            stat.total_ms += elapsed_ms
+            stat.max_ms = max(stat.max_ms, elapsed_ms)
+            if error:
+                stat.errors += 1
+            idx = len(LATENCY_BUCKETS_MS)
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    idx = i
+                    break
+            stat.buckets[idx] += 1
+
+    def record_slow(self, name: str, query: str, args, elapsed_ms: float, rows: int, plan: Optional[str] = None):
+        entry = {
+            "name": name,
+            "elapsed_ms": round(elapsed_ms, 3),
+            "rows": rows,
+            "query": " ".join(query.split()),
+            "params": redact_params(args),
+            "at": time.time(),
+        }
+        if plan is not None:
+            entry["plan"] = plan
+        with self._lock:
+            self._slow_log.append(entry)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Structured copy of all stats, safe to serialise for dashboards."""
+        with self._lock:
+            queries = {}
+            for name, stat in self._stats.items():
+                histogram = {f"le_{bound}ms": count for bound, count in zip(LATENCY_BUCKETS_MS, stat.buckets)}
+                histogram["gt_%dms" % LATENCY_BUCKETS_MS[-1]] = stat.buckets[-1]
+                queries[name] = {
+                    "calls": stat.calls,
+                    "errors": stat.errors,
+                    "rows": stat.rows,
+                    "total_ms": round(stat.total_ms, 3),
+                    "avg_ms": round(stat.total_ms / stat.calls, 3) if stat.calls else 0.0,
+                    "max_ms": round(stat.max_ms, 3),
+                    "histogram": histogram,
+                    "acquires": stat.acquires,
+                    "acquire_avg_ms": round(stat.acquire_total_ms / stat.acquires, 3) if stat.acquires else 0.0,
+                    "acquire_max_ms": round(stat.acquire_max_ms, 3),
+                }
+            return {
+                "slow_query_ms": self.slow_ms,
+                "queries": queries,
+                "slow_queries": list(self._slow_log),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow_log.clear()
+
+
+# Process-wide collector; DBClient instances are short-lived, so stats live here
+query_stats = QueryStats()
+
+
+class TimedConnection:
+    """
+    Thin wrapper around an asyncpg connection that records every statement under
+    a fixed query name. Anything not timed here is passed through untouched.
+    readonly marks connections whose statements may safely be run again by
+    EXPLAIN ANALYZE.
+    """
+
+    def __init__(self, conn, name: str, stats: QueryStats = query_stats, readonly: bool = False):
+        self._conn = conn
+        self._name = name
+        self._stats = stats
+        self._readonly = readonly
+
+    def __getattr__(self, item):
+        return getattr(self._conn, item)
+
+    async def _timed(self, method, query: str, args, rows_of):
+        start = time.perf_counter()
+        try:
+            result = await method(query, *args)
+        except Exception:
+            self._stats.record(self._name, (time.perf_counter() - start) * 1000, error=True)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        rows = rows_of(result)
+        self._stats.record(self._name, elapsed_ms, rows)
+        if elapsed_ms >= self._stats.slow_ms:
+            await self._log_slow(query, args, elapsed_ms, rows)
+        return result
+
+    async def _log_slow(self, query: str, args, elapsed_ms: float, rows: int):
+        plan = None
+        # EXPLAIN ANALYZE really executes the statement again. A SELECT can still write
+        # (SELECT submit_checkin(...), nextval, setval), so only the caller can vouch for it
+        if DB_EXPLAIN_SLOW and self._readonly:
+            try:
+                plan_rows = await self._conn.fetch("EXPLAIN ANALYZE " + query, *args)
+                plan = "\n".join(r[0] for r in plan_rows)
+            except Exception as e:
+                plan = f"EXPLAIN failed: {e}"
+        self._stats.record_slow(self._name, query, args, elapsed_ms, rows, plan)
+
+    async def execute(self, query: str, *args):
+        return await self._timed(self._conn.execute, query, args, _status_row_count)
+
+    async def executemany(self, query: str, args):
+        # executemany returns None; the number of parameter tuples is the row count
+        return await self._timed(lambda q, a: self._conn.executemany(q, a), query, (args,),
+                                 lambda _: len(args))
+
+    async def fetch(self, query: str, *args):
+        return await self._timed(self._conn.fetch, query, args, len)
+
+    async def fetchrow(self, query: str, *args):
+        return await self._timed(self._conn.fetchrow, query, args, lambda r: 1 if r is not None else 0)
+
+    async def fetchval(self, query: str, *args):
+        return await self._timed(self._conn.fetchval, query, args, lambda v: 1 if v is not None else 0)
@@ -0,0 +1,109 @@
+"""
+Min-heap of timed events for the scheduler loop (bot/scheduler.py).
+
+Every event has a key (e.g. ('user', 123) or 'summary') and a due time in
+epoch seconds. A key has at most one live event: pushing it again replaces
+the old one, which stays in the heap and is skipped when it surfaces (lazy
+deletion), so rescheduling and cancelling are O(log n) / O(1) and a tick only
+touches the events that are due.
+
+The loop sleeps in wait() until the earliest event is due; pushing an event
+earlier than that (e.g. a check-in from a handler) wakes it up.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from bot.utils import clock
+
+
+class EventQueue:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Hashable, Any]] = []
+        # key -> sequence number of its live heap entry
+        self._live: Dict[Hashable, int] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._live
+
+    def push(self, key: Hashable, due: float, data: Any = None):
+        """Schedule key at `due`, replacing any event already queued for it."""
+        with self._lock:
+            seq = next(self._seq)
+            heapq.heappush(self._heap, (due, seq, key, data))
+            self._live[key] = seq
+            earliest = self._heap[0][1] == seq
+        if earliest:
+            self._wake()
+
+    def cancel(self, key: Hashable):
+        with self._lock:
+            self._live.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+            self._live.clear()
+
+    def _drop_stale(self):
+        while self._heap and self._live.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Tuple[Hashable, float, Any]]:
+        """Remove and return (key, due, data) of every event due at `now`, earliest first."""
+        due = []
+        with self._lock:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                when, _, key, data = heapq.heappop(self._heap)
+                del self._live[key]
+                due.append((key, when, data))
+        return due
+
+    def _wake(self):
+        if self._wakeup is None or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            # Pushed from another thread
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def wait(self, max_sleep: Optional[float] = None):
+        """Sleep until the next event is due (at most max_sleep seconds) or an earlier one is pushed."""
+        self._loop = asyncio.get_running_loop()
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.clear()
+        due = self.next_due()
+        timeout = None if due is None else max(due - clock.now(), 0)
+        if max_sleep is not None:
+            timeout = max_sleep if timeout is None else min(timeout, max_sleep)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+# The scheduler's queue; handlers push into it (e.g. handle_successful_checkin)
+scheduler_events = EventQueue()
@@ -0,0 +1,694 @@
+"""
+Embedded SQLite backend implementing the DBClient interface.
+
+LocalDBClient exposes the same coroutine methods as DBClient, so DbCache, the
+handlers and the scheduler run unchanged against it. It also derives
+daily_score_log rows on every check-in write, the same way the production
+Postgres triggers do (see bot/utils/scoring.py). Select it with
+DB_BACKEND=sqlite and point LOCAL_DB_PATH at a file, or leave the default
+':memory:' for a throwaway database shared by every client in the process.
+"""
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from bot.utils.db import (CHECKSUM_COLUMNS, DBError, DAILY_SCORES_SINCE_QUERY, DB_CURSOR_PREFETCH, ID_COLUMNS, IMPORT_KEYS, PARTITIONED_LOG_TABLES,
+                          STREAMABLE_TABLES, _month_bounds, as_date, row_checksum)
+from bot.utils.db_stats import query_stats
+from bot.utils.rows import Row, row_type
+from bot.utils import scoring
+
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", ":memory:")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    nickname TEXT,
+    user_moji TEXT,
+    dob DATE,
+    timezone TEXT,
+    email TEXT,
+    user_status TEXT DEFAULT 'active',
+    last_born_on DATE,
+    last_died_on DATE,
+    created_at TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS habits (
+    habit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    year_month TEXT NOT NULL,
+    habit_text TEXT NOT NULL,
+    habit_type TEXT NOT NULL,
+    created_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS habits_user_month ON habits (user_id, year_month);
+CREATE TABLE IF NOT EXISTS core_habit_log (
+    core_log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    for_date DATE NOT NULL,
+    year_month TEXT,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    habit_id INTEGER,
+    habit_text TEXT,
+    habit_status TEXT,
+    marked_by TEXT,
+    created_at TIMESTAMP,
+    UNIQUE (user_id, habit_id, for_date)
+);
+CREATE INDEX IF NOT EXISTS core_habit_log_user_date ON core_habit_log (user_id, for_date);
+CREATE TABLE IF NOT EXISTS dnd_log (
+    dnd_log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    year_month TEXT,
+    username TEXT,
+    user_id INTEGER NOT NULL,
+    habit_id INTEGER,
+    habit_text TEXT,
+    start_date DATE,
+    end_date DATE,
+    created_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS dnd_log_user ON dnd_log (user_id);
+CREATE TABLE IF NOT EXISTS daily_score_log (
+    score_log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    for_date DATE NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    log_txt_json TEXT,
+    score INTEGER,
+    score_type TEXT NOT NULL,
+    created_at TIMESTAMP,
+    UNIQUE (user_id, for_date, score_type)
+);
+CREATE INDEX IF NOT EXISTS daily_score_log_date ON daily_score_log (for_date, score_type);
+CREATE TABLE IF NOT EXISTS monthly_score_summary (
+    user_id INTEGER NOT NULL,
+    year_month TEXT NOT NULL,
+    username TEXT,
+    days_checked_in INTEGER NOT NULL DEFAULT 0,
+    clean_days INTEGER NOT NULL DEFAULT 0,
+    done_count INTEGER NOT NULL DEFAULT 0,
+    missed_count INTEGER NOT NULL DEFAULT 0,
+    rest_count INTEGER NOT NULL DEFAULT 0,
+    dnd_count INTEGER NOT NULL DEFAULT 0,
+    core_total INTEGER NOT NULL DEFAULT 0,
+    streak_end INTEGER,
+    streak_max INTEGER,
+    rolled_up_at TIMESTAMP,
+    PRIMARY KEY (user_id, year_month)
+);
+CREATE TABLE IF NOT EXISTS scheduler_user_state (
+    user_id INTEGER PRIMARY KEY,
+    reminder_count INTEGER NOT NULL DEFAULT 0,
+    last_reminder_at TIMESTAMP,
+    last_auto_at TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduler_user_state_updated ON scheduler_user_state (updated_at);
+CREATE TABLE IF NOT EXISTS scheduler_flags (
+    name TEXT PRIMARY KEY,
+    value TEXT,
+    updated_at TIMESTAMP NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scheduler_workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at TIMESTAMP NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+    shard INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    last_tick_at TIMESTAMP
+);
+'''
+
+# Store dates as ISO text and read them back as date/datetime, like asyncpg does
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("DATE", lambda b: datetime.fromisoformat(b.decode()).date())
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+
+_connections: Dict[str, sqlite3.Connection] = {}
+_connections_lock = threading.Lock()
+
+
+def _shared_connection(path: str) -> sqlite3.Connection:
+    # One connection per path, so every short-lived client sees the same data
+    with _connections_lock:
+        conn = _connections.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.executescript(SCHEMA)
+            conn.commit()
+            _connections[path] = conn
+        return conn
+
+
+def _pg_to_sqlite(query: str) -> str:
+    # $1, $2 ... -> ?1, ?2 ... so Postgres-style statements run unchanged
+    return re.sub(r'\$(\d+)', r'?\1', query)
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    return value.astimezone(timezone.utc) if value is not None else None
+
+
+def _to_row(table: Optional[str], r: sqlite3.Row):
+    values = tuple(r)
+    if table == 'daily_score_log' and 'log_txt_json' in r.keys():
+        idx = r.keys().index('log_txt_json')
+        if isinstance(values[idx], str):
+            values = values[:idx] + (json.loads(values[idx]),) + values[idx + 1:]
+    if table is None:
+        return dict(zip(r.keys(), values))
+    return row_type(table, r.keys())(*values)
+
+
+class LocalDBClient:
+    """SQLite-backed drop-in for DBClient (see module docstring)."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path or LOCAL_DB_PATH
+        self._conn = None
+
+    async def connect(self):
+        if not self._conn:
+            self._conn = _shared_connection(self._path)
+
+    async def close(self):
+        # The connection is shared per path (and holds the data for ':memory:'), keep it open
+        self._conn = None
+
+    @staticmethod
+    def get_query_stats() -> Dict[str, Any]:
+        return query_stats.snapshot()
+
+    def _fetch(self, table: Optional[str], query: str, *args) -> list:
+        return [_to_row(table, r) for r in self._conn.execute(_pg_to_sqlite(query), args).fetchall()]
+
+    def _fetchrow(self, table: Optional[str], query: str, *args):
+        r = self._conn.execute(_pg_to_sqlite(query), args).fetchone()
+        return _to_row(table, r) if r is not None else None
+
+    # STREAMING READS
+    async def iter_query(self, query: str, *args, prefetch: Optional[int] = None, name: str = 'iter_query', table: Optional[str] = None) -> AsyncIterator[Any]:
+        cursor = self._conn.execute(_pg_to_sqlite(query), args)
+        while True:
+            batch = cursor.fetchmany(prefetch or DB_CURSOR_PREFETCH)
+            if not batch:
+                break
+            for r in batch:
+                yield _to_row(table, r)
+
+    async def iter_table(self, table: str, prefetch: Optional[int] = None, since: Optional[date] = None) -> AsyncIterator[Row]:
+        if table not in STREAMABLE_TABLES:
+            raise DBError(f"Table {table!r} cannot be streamed")
+        if since is not None and table in PARTITIONED_LOG_TABLES:
+            query, args = f'SELECT * FROM {table} WHERE for_date >= $1', (as_date(since),)
+        else:
+            query, args = f'SELECT * FROM {table}', ()
+        async for row in self.iter_query(query, *args, prefetch=prefetch, table=table):
+            yield row
+
+    # USERS
+    async def add_user(self, user_id: int, username: str, nickname: str, user_moji: str, dob: str, timezone: str, email: str, user_status: str = 'active'):
+        now = datetime.now()
+        self._conn.execute('''
+            INSERT OR IGNORE INTO users (user_id, username, nickname, user_moji, dob, timezone, email, user_status, last_born_on, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, username, nickname, user_moji, as_date(dob) if dob else None, timezone, email, user_status, now.date(), now))
+        self._conn.commit()
+
+    async def update_user(self, user_id: int, nickname: str, user_moji: str, dob: str, timezone: str, email: str):
+        self._conn.execute('''
+            UPDATE users SET nickname=?, user_moji=?, dob=?, timezone=?, email=?, last_born_on=? WHERE user_id=?
+        ''', (nickname, user_moji, as_date(dob) if dob else None, timezone, email, datetime.now().date(), user_id))
+        self._conn.commit()
+
+    async def get_user_by_id(self, user_id: int) -> Optional[Row]:
+        return self._fetchrow('users', 'SELECT * FROM users WHERE user_id=$1', user_id)
+
+    async def get_all_users(self) -> List[Row]:
+        return self._fetch('users', 'SELECT * FROM users')
+
+    async def iter_all_users(self, prefetch: Optional[int] = None) -> AsyncIterator[Row]:
+        async for row in self.iter_table('users', prefetch=prefetch):
+            yield row
+
+    # HABITS
+    async def add_habit(self, user_id: int, username: str, year_month: str, habit_text: str, habit_type: str, habit_id: Optional[int] = None):
+        await self.add_habits([{
+            'user_id': user_id, 'username': username, 'year_month': year_month,
+            'habit_text': habit_text, 'habit_type': habit_type, 'habit_id': habit_id,
+        }])
+
+    async def add_habits(self, habits: list):
+        if not habits:
+            return
+        now = datetime.now()
+        self._conn.executemany('''
+            INSERT INTO habits (habit_id, user_id, username, year_month, habit_text, habit_type, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(h.get('habit_id'), h['user_id'], h['username'], h['year_month'], h['habit_text'], h['habit_type'], now) for h in habits])
+        self._conn.commit()
+
+    async def get_user_habits_for_month(self, user_id: int, year_month: str) -> List[Row]:
+        return self._fetch('habits', 'SELECT * FROM habits WHERE user_id=$1 AND year_month=$2', user_id, year_month)
+
+    async def has_existing_core_habits(self, user_id: int, year_month: str) -> bool:
+        return self._fetchrow(None, "SELECT 1 AS found FROM habits WHERE user_id=$1 AND year_month=$2 AND habit_type='core' LIMIT 1", user_id, year_month) is not None
+
+    # CHECK-INS (core_habit_log)
+    async def log_checkin(self, for_date: str, year_month: str, user_id: int, username: str, habit_id: int, habit_text: str, habit_status: str, marked_by: str) -> List[Row]:
+        return await self.add_checkins([{
+            'for_date': for_date, 'year_month': year_month, 'user_id': user_id, 'username': username,
+            'habit_id': habit_id, 'habit_text': habit_text, 'habit_status': habit_status, 'marked_by': marked_by,
+        }])
+
+    async def add_checkins(self, checkins: list) -> List[Row]:
+        """Upsert with the same precedence and return shape as DBClient.add_checkins."""
+        if not checkins:
+            return []
+        now = datetime.now()
+        landed = []
+        touched = {}
+        for c in checkins:
+            for_date = as_date(c['for_date'])
+            key = (c['user_id'], c['habit_id'], for_date)
+            existing = self._conn.execute(
+                'SELECT * FROM core_habit_log WHERE user_id=? AND habit_id=? AND for_date=?', key).fetchone()
+            if existing is None:
+                self._conn.execute('''
+                    INSERT INTO core_habit_log (core_log_id, for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (c.get('core_log_id'), for_date, c['year_month'], c['user_id'], c['username'], c['habit_id'],
+                      c['habit_text'], c['habit_status'], c['marked_by'], now))
+                written = True
+            elif existing['marked_by'] != 'manual' and c['marked_by'] == 'manual':
+                self._conn.execute('''
+                    UPDATE core_habit_log SET habit_text=?, habit_status=?, marked_by=? WHERE core_log_id=?
+                ''', (c['habit_text'], c['habit_status'], c['marked_by'], existing['core_log_id']))
+                written = True
+            else:
+                written = False
+            row = self._conn.execute(
+                'SELECT *, ? AS written FROM core_habit_log WHERE user_id=? AND habit_id=? AND for_date=?',
+                (written, *key)).fetchone()
+            row = _to_row('core_habit_log', row)
+            row['written'] = bool(row['written'])
+            landed.append(row)
+            if written:
+                touched[(c['user_id'], for_date)] = c['username']
+        # Stand-in for the production trigger: derive daily_score_log per touched user/day
+        for (user_id, for_date), username in sorted(touched.items(), key=lambda kv: kv[0][1]):
+            self._derive_daily_scores(user_id, username, for_date)
+        self._conn.commit()
+        return landed
+
+    async def submit_checkin(self, user_id: int, username: str, for_date, statuses: list, marked_by: str = 'manual') -> Tuple[List[Row], List[Row]]:
+        """Same contract as DBClient.submit_checkin."""
+        for_date = as_date(for_date)
+        landed = await self.add_checkins([
+            {
+                'for_date': for_date, 'year_month': for_date.strftime('%Y%m'), 'user_id': user_id,
+                'username': username, 'habit_id': s[0], 'habit_text': s[1], 'habit_status': s[2],
+                'marked_by': marked_by, 'core_log_id': s[3] if len(s) > 3 else None,
+            }
+            for s in statuses
+        ])
+        return landed, await self.get_daily_scores_since(user_id, for_date)
+
+    async def get_daily_scores_since(self, user_id: int, for_date) -> List[Row]:
+        return self._fetch('daily_score_log', DAILY_SCORES_SINCE_QUERY, user_id, as_date(for_date))
+
+    async def get_daily_scores_since_many(self, since: Dict[int, Any]) -> List[Row]:
+        """Same contract as DBClient.get_daily_scores_since_many."""
+        rows = []
+        for user_id in sorted(since):
+            rows.extend(self._fetch('daily_score_log', DAILY_SCORES_SINCE_QUERY, user_id, as_date(since[user_id])))
+        return rows
+
+    async def overwrite_checkins(self, checkins: list) -> List[Row]:
+        """Same contract as DBClient.overwrite_checkins."""
+        now = datetime.now()
+        rows = []
+        touched = {}
+        for c in checkins:
+            for_date = as_date(c['for_date'])
+            key = (c['user_id'], c['habit_id'], for_date)
+            self._conn.execute('''
+                INSERT INTO core_habit_log (core_log_id, for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, habit_id, for_date)
+                DO UPDATE SET habit_text=excluded.habit_text, habit_status=excluded.habit_status, marked_by=excluded.marked_by
+            ''', (c.get('core_log_id'), for_date, c['year_month'], c['user_id'], c['username'], c['habit_id'],
+                  c['habit_text'], c['habit_status'], c['marked_by'], now))
+            rows.append(self._fetchrow('core_habit_log', 'SELECT * FROM core_habit_log WHERE user_id=$1 AND habit_id=$2 AND for_date=$3', *key))
+            touched[(c['user_id'], for_date)] = c['username']
+        # Stand-in for the production trigger, which only re-derives the edited day
+        for (user_id, for_date), username in touched.items():
+            self._derive_daily_scores(user_id, username, for_date)
+        self._conn.commit()
+        return rows
+
+    def _derive_daily_scores(self, user_id: int, username: str, for_date: date):
+        entries = self._conn.execute('''
+            SELECT habit_text, habit_status FROM core_habit_log
+            WHERE user_id=? AND for_date=? ORDER BY core_log_id
+        ''', (user_id, for_date)).fetchall()
+        day_score = scoring.core_score(e['habit_status'] for e in entries)
+        prev = self._conn.execute('''
+            SELECT score FROM daily_score_log WHERE user_id=? AND for_date=? AND score_type='streak'
+        ''', (user_id, for_date - timedelta(days=1))).fetchone()
+        streak = scoring.streak_score(prev['score'] if prev else None, day_score)
+        log_json = json.dumps(scoring.log_txt((e['habit_text'], e['habit_status']) for e in entries), ensure_ascii=False)
+        now = datetime.now()
+        for score_type, score in (('core', day_score), ('streak', streak)):
+            self._conn.execute('''
+                INSERT INTO daily_score_log (for_date, user_id, username, log_txt_json, score, score_type, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, for_date, score_type)
+                DO UPDATE SET log_txt_json=excluded.log_txt_json, score=excluded.score
+            ''', (for_date, user_id, username, log_json, score, score_type, now))
+
+    async def apply_score_diff(self, updates: list, inserts: list, deletes: list):
+        """Same contract as DBClient.apply_score_diff."""
+        now = datetime.now()
+        self._conn.executemany('UPDATE daily_score_log SET score=? WHERE score_log_id=?',
+                               [(score, score_log_id) for score_log_id, score in updates])
+        self._conn.executemany('''
+            INSERT INTO daily_score_log (user_id, username, for_date, score_type, score, log_txt_json, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(u, name, as_date(d), t, score, log, now) for u, name, d, t, score, log in inserts])
+        self._conn.executemany('DELETE FROM daily_score_log WHERE score_log_id=?', [(i,) for i in deletes])
+        self._conn.commit()
+
+    # PARTITIONS, ROLLUPS AND ARCHIVAL: SQLite has no partitions, so only the rollup is real
+    async def ensure_log_partitions(self, from_date, months: int) -> List[str]:
+        return []
+
+    async def list_log_partitions(self) -> List[Dict[str, Any]]:
+        return []
+
+    async def detach_log_month(self, year_month: str, archive_schema: Optional[str] = None) -> List[str]:
+        return []
+
+    async def rollup_month(self, year_month: str) -> int:
+        """Same contract as DBClient.rollup_month."""
+        start, end = _month_bounds(year_month)
+        cursor = self._conn.execute('''
+            INSERT INTO monthly_score_summary (user_id, year_month, username, days_checked_in, clean_days, done_count,
+                                               missed_count, rest_count, dnd_count, core_total, streak_end, streak_max, rolled_up_at)
+            SELECT h.user_id, ?1, h.username, h.days_checked_in,
+                   (SELECT count(*) FROM daily_score_log d WHERE d.user_id = h.user_id AND d.for_date >= ?2 AND d.for_date < ?3
+                        AND d.score_type = 'core' AND d.score > 0),
+                   h.done_count, h.missed_count, h.rest_count, h.dnd_count,
+                   (SELECT COALESCE(sum(score), 0) FROM daily_score_log d WHERE d.user_id = h.user_id AND d.for_date >= ?2 AND d.for_date < ?3
+                        AND d.score_type = 'core'),
+                   (SELECT score FROM daily_score_log d WHERE d.user_id = h.user_id AND d.for_date >= ?2 AND d.for_date < ?3
+                        AND d.score_type = 'streak' ORDER BY for_date DESC LIMIT 1),
+                   (SELECT max(score) FROM daily_score_log d WHERE d.user_id = h.user_id AND d.for_date >= ?2 AND d.for_date < ?3
+                        AND d.score_type = 'streak'),
+                   ?4
+            FROM (
+                SELECT user_id, max(username) AS username, count(DISTINCT for_date) AS days_checked_in,
+                       sum(habit_status = '✅') AS done_count, sum(habit_status = '❌') AS missed_count,
+                       sum(habit_status = '⏭️') AS rest_count, sum(habit_status = '⛔') AS dnd_count
+                FROM core_habit_log WHERE for_date >= ?2 AND for_date < ?3
+                GROUP BY user_id
+            ) h
+            WHERE true
+            ON CONFLICT (user_id, year_month) DO UPDATE
+            SET username=excluded.username, days_checked_in=excluded.days_checked_in, clean_days=excluded.clean_days,
+                done_count=excluded.done_count, missed_count=excluded.missed_count, rest_count=excluded.rest_count,
+                dnd_count=excluded.dnd_count, core_total=excluded.core_total, streak_end=excluded.streak_end,
+                streak_max=excluded.streak_max, rolled_up_at=excluded.rolled_up_at
+        ''', (year_month, start, end, datetime.now()))
+        self._conn.commit()
+        return cursor.rowcount
+
+    async def get_rolled_up_months(self) -> List[str]:
+        return [r['year_month'] for r in self._fetch(None, 'SELECT DISTINCT year_month FROM monthly_score_summary ORDER BY year_month')]
+
+    async def get_monthly_summaries(self, user_id: int) -> List[Row]:
+        return self._fetch('monthly_score_summary', 'SELECT * FROM monthly_score_summary WHERE user_id=$1 ORDER BY year_month', user_id)
+
+    # CACHE VERIFICATION: SQLite has no md5(), so the checksums are computed here
+    async def table_checksums(self, table: str, buckets: int, since: Optional[date] = None) -> Dict[int, Tuple[int, int]]:
+        if table not in CHECKSUM_COLUMNS:
+            raise DBError(f"Table {table!r} has no checksum columns")
+        columns = CHECKSUM_COLUMNS[table]
+        query = f"SELECT {', '.join(columns)} FROM {table}"
+        args = ()
+        if since is not None and table in PARTITIONED_LOG_TABLES:
+            query, args = query + ' WHERE for_date >= ?', (as_date(since),)
+        sums: Dict[int, Tuple[int, int]] = {}
+        for r in self._conn.execute(query, args):
+            bucket = r['user_id'] % buckets
+            n, h = sums.get(bucket, (0, 0))
+            sums[bucket] = (n + 1, h + row_checksum(r, columns))
+        return sums
+
+    async def fetch_buckets(self, table: str, buckets: int, selected: List[int], since: Optional[date] = None) -> List[Row]:
+        if table not in CHECKSUM_COLUMNS:
+            raise DBError(f"Table {table!r} has no checksum columns")
+        marks = ', '.join('?' * len(selected))
+        query = f'SELECT * FROM {table} WHERE user_id % ? IN ({marks})'
+        args = [buckets, *selected]
+        if since is not None and table in PARTITIONED_LOG_TABLES:
+            query += ' AND for_date >= ?'
+            args.append(as_date(since))
+        return [_to_row(table, r) for r in self._conn.execute(query, args).fetchall()]
+
+    async def import_rows(self, table: str, columns: List[str], records: list) -> int:
+        """Same contract as DBClient.import_rows; scores are derived for the imported check-in days."""
+        if table not in IMPORT_KEYS:
+            raise DBError(f"Table {table!r} cannot be imported")
+        if not records:
+            return 0
+        match = ' AND '.join(f'{k} = :{k}' for k in IMPORT_KEYS[table])
+        query = f'''
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join(':' + c for c in columns)}
+            WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {match})
+        '''
+        params = [dict(zip(columns, r)) for r in records]
+        if table == 'core_habit_log':
+            params.sort(key=lambda p: p['for_date'])
+        inserted = 0
+        touched = {}
+        for p in params:
+            if self._conn.execute(query, p).rowcount:
+                inserted += 1
+                if table == 'core_habit_log':
+                    touched[(p['user_id'], p['for_date'])] = p.get('username')
+        # Stand-in for the production trigger
+        for (user_id, for_date), username in sorted(touched.items(), key=lambda kv: kv[0][1]):
+            self._derive_daily_scores(user_id, username, for_date)
+        self._conn.commit()
+        return inserted
+
+    async def reserve_ids(self, table: str, count: int) -> List[int]:
+        """Reserve ids by advancing the AUTOINCREMENT counter, like nextval() on a Postgres sequence."""
+        if table not in ID_COLUMNS:
+            raise DBError(f"Table {table!r} has no reservable id")
+        row = self._conn.execute('SELECT seq FROM sqlite_sequence WHERE name=?', (table,)).fetchone()
+        first = (row['seq'] if row else 0) + 1
+        if row:
+            self._conn.execute('UPDATE sqlite_sequence SET seq=? WHERE name=?', (first + count - 1, table))
+        else:
+            self._conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, first + count - 1))
+        self._conn.commit()
+        return list(range(first, first + count))
+
+    async def has_already_checked_in(self, user_id: int, for_date: str) -> bool:
+        return self._fetchrow(None, "SELECT 1 AS found FROM daily_score_log WHERE user_id=$1 AND for_date=$2 AND score_type='core' LIMIT 1", user_id, as_date(for_date)) is not None
+
+    async def get_user_checkin_summary(self, user_id: int, for_date: str) -> List[Row]:
+        return self._fetch('daily_score_log', "SELECT * FROM daily_score_log WHERE user_id=$1 AND for_date=$2 AND score_type='core' LIMIT 1", user_id, as_date(for_date))
+
+    # DND
+    async def add_dnd_period(self, year_month: str, username: str, user_id: int, habit_id: int, habit_text: str, start_date: str, end_date: str, dnd_log_id: Optional[int] = None):
+        cursor = self._conn.execute('''
+            INSERT INTO dnd_log (dnd_log_id, year_month, username, user_id, habit_id, habit_text, start_date, end_date, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (dnd_log_id, year_month, username, user_id, habit_id, habit_text, as_date(start_date), as_date(end_date), datetime.now()))
+        self._conn.commit()
+        return cursor.lastrowid
+
+    async def get_dnd_entries_for_user(self, user_id: int) -> List[Row]:
+        return self._fetch('dnd_log', 'SELECT * FROM dnd_log WHERE user_id=$1', user_id)
+
+    async def is_date_in_dnd_period(self, user_id: int, check_date: str, habit_id: int) -> bool:
+        return self._fetchrow(None, 'SELECT 1 AS found FROM dnd_log WHERE user_id=$1 AND habit_id=$2 AND start_date <= $3 AND end_date >= $3 LIMIT 1', user_id, habit_id, as_date(check_date)) is not None
+
+    # DAILY SCORE LOG
+    async def get_streak_summary(self, for_date: date) -> List[Row]:
+        return self._fetch('daily_score_log', "SELECT * FROM daily_score_log WHERE for_date=$1 AND score_type='streak'", as_date(for_date))
+
+    async def get_user_habits_for_date(self, user_id: int, date_obj: date) -> List[str]:
+        rows = self._fetch(None, 'SELECT habit_text FROM habits WHERE user_id=$1 AND year_month=$2', user_id, date_obj.strftime('%Y%m'))
+        return [r['habit_text'] for r in rows]
+
+    async def check_rest_day_eligibility(self, user_id: int, habit_id: int, check_date: str) -> bool:
+        rows = self._fetch(None, '''
+            SELECT habit_status FROM core_habit_log
+            WHERE user_id=$1 AND habit_id=$2 AND for_date < $3 AND for_date >= $4
+            ORDER BY for_date DESC LIMIT 6
+        ''', user_id, habit_id, as_date(check_date), as_date(check_date).replace(day=1))
+        return all(r['habit_status'] == '✅' for r in rows) if rows else True
+
+    async def get_habit_timestamp(self, user_id: int, year_month: str) -> Optional[str]:
+        row = self._fetchrow(None, 'SELECT created_at FROM habits WHERE user_id=$1 AND year_month=$2 ORDER BY created_at DESC LIMIT 1', user_id, year_month)
+        return row['created_at'].isoformat() if row else None
+
+    async def delete_dnd_entry(self, dnd_log_id: int) -> bool:
+        cursor = self._conn.execute('DELETE FROM dnd_log WHERE dnd_log_id=?', (dnd_log_id,))
+        self._conn.commit()
+        return cursor.rowcount == 1
+
+    async def update_dnd_entry(self, dnd_log_id: int, new_habit_text: Optional[str] = None, new_start_date: Optional[str] = None, new_end_date: Optional[str] = None) -> bool:
+        set_clauses = []
+        params = []
+        if new_habit_text is not None:
+            set_clauses.append('habit_text=?')
+            params.append(new_habit_text)
+        if new_start_date is not None:
+            set_clauses.append('start_date=?')
+            params.append(as_date(new_start_date))
+        if new_end_date is not None:
+            set_clauses.append('end_date=?')
+            params.append(as_date(new_end_date))
+        if not set_clauses:
+            return False
+        cursor = self._conn.execute(f"UPDATE dnd_log SET {', '.join(set_clauses)} WHERE dnd_log_id=?", (*params, dnd_log_id))
+        self._conn.commit()
+        return cursor.rowcount == 1
+
+    async def get_all_checkins_for_user(self, user_id: int) -> List[Row]:
+        return self._fetch('daily_score_log', "SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='core'", user_id)
+
+    async def iter_all_checkins_for_user(self, user_id: int, prefetch: Optional[int] = None) -> AsyncIterator[Row]:
+        async for row in self.iter_query("SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='core'", user_id, prefetch=prefetch, table='daily_score_log'):
+            yield row
+
+    async def get_all_daily_scores_for_user(self, user_id: int) -> List[Row]:
+        return self._fetch('daily_score_log', "SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='streak'", user_id)
+
+    async def iter_all_daily_scores_for_user(self, user_id: int, prefetch: Optional[int] = None) -> AsyncIterator[Row]:
+        async for row in self.iter_query("SELECT * FROM daily_score_log WHERE user_id=$1 and score_type='streak'", user_id, prefetch=prefetch, table='daily_score_log'):
+            yield row
+
+    # SCHEDULER STATE: timestamps are stored as UTC text so they compare in order
+    async def load_scheduler_state(self, since: datetime) -> Tuple[List[Row], Dict[str, str]]:
+        """Same contract as DBClient.load_scheduler_state."""
+        rows = self._fetch('scheduler_user_state', 'SELECT * FROM scheduler_user_state WHERE updated_at >= $1', _utc(since))
+        flags = self._conn.execute('SELECT name, value FROM scheduler_flags').fetchall()
+        return rows, {r['name']: r['value'] for r in flags}
+
+    async def save_scheduler_state(self, users: list, flags: Dict[str, Optional[str]], prune_before: Optional[datetime] = None):
+        """Same contract as DBClient.save_scheduler_state."""
+        now = _utc(datetime.now(timezone.utc))
+        self._conn.executemany('''
+            INSERT INTO scheduler_user_state (user_id, reminder_count, last_reminder_at, last_auto_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET reminder_count=excluded.reminder_count, last_reminder_at=excluded.last_reminder_at,
+                last_auto_at=excluded.last_auto_at, updated_at=excluded.updated_at
+        ''', [(user_id, count, _utc(reminded), _utc(auto), now) for user_id, count, reminded, auto in users])
+        self._conn.executemany('''
+            INSERT INTO scheduler_flags (name, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+        ''', [(name, value, now) for name, value in flags.items()])
+        if prune_before is not None:
+            self._conn.execute('DELETE FROM scheduler_user_state WHERE updated_at < ?', (_utc(prune_before),))
+        self._conn.commit()
+
+    async def heartbeat_scheduler_leases(self, worker_id: str, shards: int, lease_sec: float,
+                                         last_tick: Optional[datetime] = None) -> Tuple[List[int], bool, Dict[int, Optional[datetime]]]:
+        """Same contract as DBClient.heartbeat_scheduler_leases."""
+        now = _utc(datetime.now(timezone.utc))
+        expires = now + timedelta(seconds=lease_sec)
+        c = self._conn
+        c.execute('''
+            INSERT INTO scheduler_workers (worker_id, heartbeat_at) VALUES (?, ?)
+            ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at=excluded.heartbeat_at
+        ''', (worker_id, now))
+        c.execute('DELETE FROM scheduler_workers WHERE heartbeat_at < ?', (now - timedelta(seconds=lease_sec * 10),))
+        live = c.execute('SELECT count(*) FROM scheduler_workers WHERE heartbeat_at >= ?',
+                         (now - timedelta(seconds=lease_sec),)).fetchone()[0]
+        fair = -(-shards // max(live, 1))
+        c.execute('UPDATE scheduler_leases SET expires_at=?, last_tick_at=COALESCE(?, last_tick_at) WHERE owner=? AND shard >= 0 AND shard < ?',
+                  (expires, _utc(last_tick), worker_id, shards))
+        held = [r[0] for r in c.execute(
+            'SELECT shard FROM scheduler_leases WHERE owner=? AND shard >= 0 AND shard < ? ORDER BY shard', (worker_id, shards))]
+        if len(held) > fair:
+            c.executemany('DELETE FROM scheduler_leases WHERE owner=? AND shard=?', [(worker_id, s) for s in held[fair:]])
+            held = held[:fair]
+        claimed = {}
+        if len(held) < fair:
+            taken = {r[0] for r in c.execute('SELECT shard FROM scheduler_leases WHERE expires_at >= ?', (now,))}
+            free = [s for s in range(shards) if s not in taken][:fair - len(held)]
+            ticks = {r[0]: r[1] for r in c.execute('SELECT shard, last_tick_at FROM scheduler_leases WHERE shard >= 0')}
+            # An expired row keeps its last_tick_at: the dead owner's last pass
+            c.executemany('''
+                INSERT INTO scheduler_leases (shard, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (shard) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+            ''', [(s, worker_id, expires) for s in free])
+            claimed = {s: ticks.get(s) for s in free}
+            held = sorted(held + free)
+        leader = c.execute('SELECT owner, expires_at FROM scheduler_leases WHERE shard = -1').fetchone()
+        is_leader = leader is None or leader['owner'] == worker_id or leader['expires_at'] < now
+        if is_leader:
+            c.execute('INSERT OR REPLACE INTO scheduler_leases (shard, owner, expires_at) VALUES (-1, ?, ?)', (worker_id, expires))
+        c.commit()
+        return held, is_leader, claimed
+
+    async def release_scheduler_leases(self, worker_id: str):
+        """Same contract as DBClient.release_scheduler_leases."""
+        self._conn.execute('DELETE FROM scheduler_leases WHERE owner=?', (worker_id,))
+        self._conn.execute('DELETE FROM scheduler_workers WHERE worker_id=?', (worker_id,))
+        self._conn.commit()
+
+
+async def seed_synthetic_data(client, users: int, days: int, habits_per_user: int = 3, start: Optional[date] = None, seed: int = 0):
+    """
+    Fill a backend with `users` synthetic users, their core habits and `days`
+    of check-ins ending yesterday (or starting at `start`), for benchmarks.
+    Deterministic for a given seed.
+    """
+    from bot.utils.constants import SUPPORTED_TIMEZONES
+    rng = random.Random(seed)
+    start = start or (datetime.now().date() - timedelta(days=days))
+    user_ids = [1_000_000 + i for i in range(users)]
+    for i, user_id in enumerate(user_ids):
+        await client.add_user(user_id, f"user{i}", f"U{i}", "🐍", date(1990, 1, 1),
+                              SUPPORTED_TIMEZONES[i % len(SUPPORTED_TIMEZONES)], f"user{i}@example.com")
+    months = sorted({(start + timedelta(days=d)).strftime('%Y%m') for d in range(days)})
+    await client.add_habits([
+        {'user_id': user_id, 'username': f"user{i}", 'year_month': ym,
+         'habit_text': f"Habit {h + 1} ✅", 'habit_type': 'core'}
+        for i, user_id in enumerate(user_ids) for ym in months for h in range(habits_per_user)
+    ])
+    habit_ids = {}
+    for ym in months:
+        for user_id in user_ids:
+            habit_ids[(user_id, ym)] = [(h['habit_id'], h['habit_text']) for h in await client.get_user_habits_for_month(user_id, ym)]
+    statuses = ['✅'] * 8 + ['❌', '⏭️']
+    for d in range(days):
+        day = start + timedelta(days=d)
+        ym = day.strftime('%Y%m')
+        await client.add_checkins([
+            {'for_date': day, 'year_month': ym, 'user_id': user_id, 'username': f"user{i}",
+             'habit_id': habit_id, 'habit_text': text, 'habit_status': rng.choice(statuses),
+             'marked_by': 'manual'}
+            for i, user_id in enumerate(user_ids) for habit_id, text in habit_ids[(user_id, ym)]
+        ])
+    return user_ids
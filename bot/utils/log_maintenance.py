@@ -0,0 +1,88 @@
+"""
+Monthly upkeep of the partitioned log tables (schemas/sql/003_monthly_log_partitions.sql).
+
+run_log_maintenance() makes sure partitions exist ahead of time, rolls every
+closed month into monthly_score_summary and, when LOG_KEEP_MONTHS is set,
+detaches (or archives into LOG_ARCHIVE_SCHEMA) the raw partitions of months
+older than that. The scheduler calls maybe_run_log_maintenance() every loop;
+it does the work at most once per day.
+
+Usage:
+    python -m bot.utils.log_maintenance            # run once now
+"""
+import asyncio
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+from bot.utils.db import get_db_client
+from bot.utils.logger import get_logger
+
+logger = get_logger("log_maintenance")
+
+# Months of partitions created ahead of the current one
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", "2"))
+# Raw log months kept attached (current month included); 0 keeps everything
+LOG_KEEP_MONTHS = int(os.getenv("LOG_KEEP_MONTHS", "0"))
+# Schema detached partitions are moved into; empty leaves them in place
+LOG_ARCHIVE_SCHEMA = os.getenv("LOG_ARCHIVE_SCHEMA", "")
+
+_last_run_on: Optional[date] = None
+
+
+def _shift_month(year_month: str, months: int) -> str:
+    index = int(year_month[:4]) * 12 + int(year_month[4:]) - 1 + months
+    return f"{index // 12:04d}{index % 12 + 1:02d}"
+
+
+async def run_log_maintenance(today: Optional[date] = None, db_client=None) -> Dict[str, Any]:
+    """Create upcoming partitions, roll up closed months and detach expired ones."""
+    today = today or datetime.now().date()
+    current = today.strftime('%Y%m')
+    own_client = db_client is None
+    db_client = db_client or get_db_client()
+    await db_client.connect()
+    try:
+        created = await db_client.ensure_log_partitions(today.replace(day=1), LOG_PARTITIONS_AHEAD + 1)
+        partitions = await db_client.list_log_partitions()
+        rolled_up = set(await db_client.get_rolled_up_months())
+        attached = sorted({p['year_month'] for p in partitions})
+        # Last month is always re-rolled: corrections can still land after it closes
+        to_roll = {m for m in attached if m < current and m not in rolled_up}
+        to_roll.add(_shift_month(current, -1))
+        summarised = {}
+        for year_month in sorted(to_roll):
+            summarised[year_month] = await db_client.rollup_month(year_month)
+        detached = []
+        if LOG_KEEP_MONTHS > 0:
+            cutoff = _shift_month(current, -(LOG_KEEP_MONTHS - 1))
+            for year_month in attached:
+                if year_month >= cutoff:
+                    break
+                if year_month not in summarised:
+                    summarised[year_month] = await db_client.rollup_month(year_month)
+                detached += await db_client.detach_log_month(year_month, LOG_ARCHIVE_SCHEMA or None)
+        result = {'created': created, 'rolled_up': summarised, 'detached': detached}
+        logger.info(f"🗄️ Log maintenance: {result}")
+        return result
+    finally:
+        if own_client:
+            await db_client.close()
+
+
+async def maybe_run_log_maintenance():
+    """Run run_log_maintenance once per day; failures are logged and retried next loop."""
+    global _last_run_on
+    today = datetime.now().date()
+    if _last_run_on == today:
+        return
+    try:
+        await run_log_maintenance(today)
+        _last_run_on = today
+    except Exception as e:
+        logger.error(f"❌ Log maintenance failed: {e}")
+
+
+if __name__ == '__main__':
+    print(json.dumps(asyncio.run(run_log_maintenance()), indent=2, default=str))
@@ -0,0 +1,352 @@
+"""
+Vectorized recompute of daily_score_log from core_habit_log.
+
+Loads every check-in in a date range into user x day NumPy matrices, derives
+the core and streak scores with the rules in bot.utils.scoring for all users
+at once, and diffs the result against the stored daily_score_log rows. The
+diff can be applied in one bulk transaction (DBClient.apply_score_diff).
+
+Streaks follow scoring.streak_score: streak[d] = max(streak[d-1], 0) + core[d],
+restarting from 0 after a day without a check-in. With t = max(streak, 0)
+this is a Lindley recursion, t[d] = max(t[d-1] + core[d], 0), whose closed
+form is the running sum minus its running minimum (floored at 0), so the
+whole matrix is solved with cumsum/minimum.accumulate instead of a day loop.
+Each run of consecutive check-in days is a separate segment.
+
+correct_checkin() is the incremental variant for one corrected check-in: it
+recomputes a single user from the edited month on, seeded from a per-month
+streak checkpoint.
+
+Usage:
+    python -m bot.utils.recompute scores 2025-01-01 2025-12-31           # report the diff
+    python -m bot.utils.recompute scores 2025-01-01 2025-12-31 --apply   # and write it
+    python -m bot.utils.recompute correct 123456 2025-03-14 12=✅ 13=❌    # fix a past check-in
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bot.utils import scoring
+from bot.utils.db import as_date, get_db_client
+
+# Stored cells with no daily_score_log row
+_NO_ROW = np.iinfo(np.int64).min
+
+
+class CheckinMatrix:
+    """
+    Check-ins for [start, start + days) as user x day matrices. Column 0 is
+    the day before `start` and holds the stored streak as a seed; the stored
+    score matrices use _NO_ROW where no row exists.
+    """
+
+    def __init__(self, start: date, days: int, user_ids: List[int]):
+        self.start = start
+        self.days = days
+        self.user_ids = user_ids
+        self.user_index = {u: i for i, u in enumerate(user_ids)}
+        shape = (len(user_ids), days + 1)
+        self.total = np.zeros(shape, dtype=np.int64)
+        self.missed = np.zeros(shape, dtype=np.int64)
+        self.dnd = np.zeros(shape, dtype=np.int64)
+        self.seed = np.full(len(user_ids), _NO_ROW, dtype=np.int64)
+        self.stored = {t: np.full(shape, _NO_ROW, dtype=np.int64) for t in ('core', 'streak')}
+        self.stored_ids = {t: np.zeros(shape, dtype=np.int64) for t in ('core', 'streak')}
+        self.usernames: Dict[int, str] = {}
+
+
+async def load_matrix(db_client, start, end=None, user_id: Optional[int] = None) -> CheckinMatrix:
+    """
+    Stream core_habit_log and daily_score_log for [start, end] into a CheckinMatrix,
+    optionally for one user only. Without `end` the range runs to the last stored day.
+    """
+    start = as_date(start)
+    end = as_date(end) if end is not None else date.max
+    where = 'for_date >= $1 AND for_date <= $2'
+    args = [start, end]
+    if user_id is not None:
+        where += ' AND user_id = $3'
+        args.append(user_id)
+    # Raw columns first; users and the day count are only known once both tables have been read
+    c_user, c_day, c_missed, c_dnd = [], [], [], []
+    usernames = {}
+    async for r in db_client.iter_query(f'''
+        SELECT user_id, username, for_date, habit_status FROM core_habit_log
+        WHERE {where}
+    ''', *args, name='recompute_load_checkins'):
+        c_user.append(r['user_id'])
+        c_day.append((as_date(r['for_date']) - start).days + 1)
+        c_missed.append(r['habit_status'] == scoring.MISSED)
+        c_dnd.append(r['habit_status'] == scoring.DND)
+        usernames[r['user_id']] = r['username']
+    s_user, s_day, s_type, s_score, s_id = [], [], [], [], []
+    async for r in db_client.iter_query(f'''
+        SELECT score_log_id, user_id, username, for_date, score, score_type FROM daily_score_log
+        WHERE {where} AND score_type IN ('core', 'streak')
+    ''', start - timedelta(days=1), *args[1:], name='recompute_load_scores'):
+        s_user.append(r['user_id'])
+        s_day.append((as_date(r['for_date']) - start).days + 1)
+        s_type.append(r['score_type'] == 'streak')
+        s_score.append(r['score'])
+        s_id.append(r['score_log_id'])
+        usernames.setdefault(r['user_id'], r['username'])
+
+    if end == date.max:
+        end = start + timedelta(days=max(c_day + s_day + [1]) - 1)
+    days = (end - start).days + 1
+    user_ids = sorted(set(c_user) | set(s_user))
+    m = CheckinMatrix(start, days, user_ids)
+    m.usernames = usernames
+    lookup = m.user_index
+
+    if c_user:
+        ui = np.fromiter((lookup[u] for u in c_user), dtype=np.int64, count=len(c_user))
+        flat = ui * (days + 1) + np.asarray(c_day, dtype=np.int64)
+        size = len(user_ids) * (days + 1)
+        m.total = np.bincount(flat, minlength=size).reshape(m.total.shape)
+        m.missed = np.bincount(flat, weights=np.asarray(c_missed), minlength=size).astype(np.int64).reshape(m.total.shape)
+        m.dnd = np.bincount(flat, weights=np.asarray(c_dnd), minlength=size).astype(np.int64).reshape(m.total.shape)
+    if s_user:
+        ui = np.fromiter((lookup[u] for u in s_user), dtype=np.int64, count=len(s_user))
+        di = np.asarray(s_day, dtype=np.int64)
+        is_streak = np.asarray(s_type, dtype=bool)
+        scores = np.asarray(s_score, dtype=np.int64)
+        ids = np.asarray(s_id, dtype=np.int64)
+        for score_type, mask in (('core', ~is_streak), ('streak', is_streak)):
+            m.stored[score_type][ui[mask], di[mask]] = scores[mask]
+            m.stored_ids[score_type][ui[mask], di[mask]] = ids[mask]
+        # The stored streak of the day before the range seeds the first segment
+        m.seed = m.stored['streak'][:, 0].copy()
+    return m
+
+
+def compute_scores(total: np.ndarray, missed: np.ndarray, dnd: np.ndarray, seed: np.ndarray):
+    """
+    Core and streak matrices for user x day check-in counts. Column 0 is the
+    seed day: seed holds each user's stored streak there (_NO_ROW if none).
+    Returns (has, core, streak); cells where has is False carry no row.
+    """
+    has = total > 0
+    core = np.where(missed == 0, scoring.CLEAN_DAY_SCORE, -missed)
+    core = np.where(has & (dnd == total), 0, core)
+    core = np.where(has, core, 0)
+    # The seed column behaves like a day whose core score is the stored streak
+    has[:, 0] = seed != _NO_ROW
+    core[:, 0] = np.where(has[:, 0], seed, 0)
+
+    cols = np.arange(has.shape[1])
+    prev_has = np.zeros_like(has)
+    prev_has[:, 1:] = has[:, :-1]
+    seg_start = has & ~prev_has
+    seg_id = np.cumsum(seg_start, axis=1)
+    # Prefix sum of core within each run of consecutive check-in days
+    csum = np.cumsum(core, axis=1)
+    last_start = np.maximum.accumulate(np.where(seg_start, cols, 0), axis=1)
+    before = np.take_along_axis(csum - core, last_start, axis=1)
+    x = csum - before
+    # Running minimum restricted to the current segment: shifting later
+    # segments down by more than any prefix sum can span keeps earlier ones out
+    big = 2 * (int(np.abs(core).sum(axis=1).max(initial=0)) + 1)
+    shifted = x - seg_id * big
+    run_min = np.minimum.accumulate(shifted, axis=1) + seg_id * big
+    alive = x - np.minimum(run_min, 0)  # max(streak, 0) at the end of each day
+    prev_alive = np.zeros_like(alive)
+    prev_alive[:, 1:] = np.where(prev_has[:, 1:], alive[:, :-1], 0)
+    streak = prev_alive + core
+    return has, core, streak
+
+
+def score_diff(m: CheckinMatrix, delete_orphans: bool = False) -> Dict[str, list]:
+    """
+    Compare recomputed scores with the stored rows of m.
+    Returns {'update': [...], 'insert': [...], 'delete': [...]} where updates are
+    (score_log_id, score), inserts are (user_id, for_date, score_type, score) and
+    deletes are score_log_ids of stored rows for days with no check-ins (only
+    when delete_orphans is set).
+    """
+    has, core, streak = compute_scores(m.total, m.missed, m.dnd, m.seed)
+    diff = {'update': [], 'insert': [], 'delete': []}
+    for score_type, computed in (('core', core), ('streak', streak)):
+        stored = m.stored[score_type][:, 1:]
+        computed = computed[:, 1:]
+        day_has = has[:, 1:]
+        exists = stored != _NO_ROW
+        ui, di = np.nonzero(day_has & exists & (stored != computed))
+        ids = m.stored_ids[score_type][:, 1:]
+        diff['update'].extend(zip(ids[ui, di].tolist(), computed[ui, di].tolist()))
+        ui, di = np.nonzero(day_has & ~exists)
+        diff['insert'].extend(
+            (m.user_ids[u], m.start + timedelta(days=d), score_type, s)
+            for u, d, s in zip(ui.tolist(), di.tolist(), computed[ui, di].tolist())
+        )
+        if delete_orphans:
+            ui, di = np.nonzero(~day_has & exists)
+            diff['delete'].extend(ids[ui, di].tolist())
+    return diff
+
+
+async def _log_txt_for(db_client, keys) -> Dict[tuple, str]:
+    """log_txt_json text for each (user_id, for_date) in keys, read from core_habit_log."""
+    entries: Dict[tuple, list] = {k: [] for k in keys}
+    if not keys:
+        return {}
+    dates = sorted({d for _, d in keys})
+    async for r in db_client.iter_query('''
+        SELECT user_id, for_date, habit_text, habit_status FROM core_habit_log
+        WHERE for_date >= $1 AND for_date <= $2 ORDER BY core_log_id
+    ''', dates[0], dates[-1], name='recompute_load_log_txt'):
+        key = (r['user_id'], as_date(r['for_date']))
+        if key in entries:
+            entries[key].append((r['habit_text'], r['habit_status']))
+    return {k: json.dumps(scoring.log_txt(v), ensure_ascii=False) for k, v in entries.items()}
+
+
+async def recompute_scores(start, end, apply: bool = False, delete_orphans: bool = False,
+                           db_client=None) -> Dict[str, Any]:
+    """
+    Recompute daily_score_log for [start, end] and return the diff with timings.
+    With apply=True the diff is written in one transaction.
+    """
+    own_client = db_client is None
+    db_client = db_client or get_db_client()
+    await db_client.connect()
+    try:
+        t0 = time.perf_counter()
+        m = await load_matrix(db_client, start, end)
+        t1 = time.perf_counter()
+        diff = score_diff(m, delete_orphans)
+        t2 = time.perf_counter()
+        result = {
+            'users': len(m.user_ids),
+            'days': m.days,
+            'checkins': int(m.total[:, 1:].sum()),
+            'update': len(diff['update']),
+            'insert': len(diff['insert']),
+            'delete': len(diff['delete']),
+            'load_sec': round(t1 - t0, 3),
+            'compute_sec': round(t2 - t1, 3),
+            'diff': diff,
+        }
+        if apply and (diff['update'] or diff['insert'] or diff['delete']):
+            log_txt = await _log_txt_for(db_client, {(u, d) for u, d, _, _ in diff['insert']})
+            inserts = [(u, m.usernames.get(u), d, t, s, log_txt[(u, d)]) for u, d, t, s in diff['insert']]
+            await db_client.apply_score_diff(diff['update'], inserts, diff['delete'])
+            result['apply_sec'] = round(time.perf_counter() - t2, 3)
+        return result
+    finally:
+        if own_client:
+            await db_client.close()
+
+
+def month_end_streaks(m: CheckinMatrix, streak: np.ndarray, has: np.ndarray, user: int = 0) -> Dict[str, Optional[int]]:
+    """
+    Running-state checkpoints for one user of m: {'YYYYMM': streak on the month's
+    last day, or None when that day has no check-in}, for every month m ends past.
+    """
+    checkpoints = {}
+    day = m.start
+    last = m.start + timedelta(days=m.days - 1)
+    while True:
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        month_end = next_month - timedelta(days=1)
+        if month_end > last:
+            return checkpoints
+        col = (month_end - m.start).days + 1
+        checkpoints[month_end.strftime('%Y%m')] = int(streak[user, col]) if has[user, col] else None
+        day = next_month
+
+
+async def correct_checkin(user_id: int, username: str, for_date, statuses: list, cache=None,
+                          db_client=None) -> Dict[str, Any]:
+    """
+    Correct a past check-in and re-derive only that user's scores from its month on.
+
+    statuses is [(habit_id, habit_text, habit_status), ...]; the rows replace whatever
+    core_habit_log holds for (user_id, habit_id, for_date), marked 'manual'. The streak
+    is seeded from the month checkpoint of the previous month (DbCache keeps these;
+    without a cache the stored streak of that month's last day is used), so the work
+    is proportional to the days from the edited month on, not the user's history.
+    With a DbCache, its rows for the user from for_date on are patched in place.
+    """
+    for_date = as_date(for_date)
+    month_start = for_date.replace(day=1)
+    prev_month_end = month_start - timedelta(days=1)
+    own_client = db_client is None
+    db_client = db_client or get_db_client()
+    await db_client.connect()
+    try:
+        checkin_rows = await db_client.overwrite_checkins([
+            {'for_date': for_date, 'year_month': for_date.strftime('%Y%m'), 'user_id': user_id,
+             'username': username, 'habit_id': habit_id, 'habit_text': habit_text,
+             'habit_status': habit_status, 'marked_by': 'manual'}
+            for habit_id, habit_text, habit_status in statuses
+        ])
+        m = await load_matrix(db_client, month_start, user_id=user_id)
+        if not m.user_ids:
+            return {'update': 0, 'insert': 0, 'days': 0}
+        if cache is not None and cache.caches_log_date(prev_month_end):
+            seed = cache.get_streak_checkpoint(user_id, prev_month_end.strftime('%Y%m'))
+            m.seed[0] = _NO_ROW if seed is None else seed
+        diff = score_diff(m)
+        if diff['update'] or diff['insert']:
+            log_txt = await _log_txt_for(db_client, {(u, d) for u, d, _, _ in diff['insert']})
+            inserts = [(u, m.usernames.get(u, username), d, t, sc, log_txt[(u, d)]) for u, d, t, sc in diff['insert']]
+            await db_client.apply_score_diff(diff['update'], inserts, [])
+        if cache is not None:
+            has, _, streak = compute_scores(m.total, m.missed, m.dnd, m.seed)
+            score_rows = await db_client.get_daily_scores_since(user_id, for_date)
+            cache.apply_checkin_correction(user_id, for_date, checkin_rows, score_rows,
+                                           month_end_streaks(m, streak, has))
+        return {'update': len(diff['update']), 'insert': len(diff['insert']), 'days': m.days}
+    finally:
+        if own_client:
+            await db_client.close()
+
+
+async def _correct_from_cli(user_id: int, for_date: date, changes: List[str]) -> Dict[str, Any]:
+    db_client = get_db_client()
+    await db_client.connect()
+    try:
+        user = await db_client.get_user_by_id(user_id)
+        habits = {h['habit_id']: h['habit_text'] for h in await db_client.get_user_habits_for_month(user_id, for_date.strftime('%Y%m'))}
+        statuses = []
+        for change in changes:
+            habit_id, status = change.split('=', 1)
+            statuses.append((int(habit_id), habits[int(habit_id)], status))
+        return await correct_checkin(user_id, user['username'] if user else '', for_date, statuses, db_client=db_client)
+    finally:
+        await db_client.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Recompute daily_score_log from core_habit_log")
+    commands = parser.add_subparsers(dest='command', required=True)
+    scores = commands.add_parser('scores', help="recompute every user's scores for a date range")
+    scores.add_argument('start', help="first day, YYYY-MM-DD")
+    scores.add_argument('end', help="last day, YYYY-MM-DD")
+    scores.add_argument('--apply', action='store_true', help="write the diff to the database")
+    scores.add_argument('--delete-orphans', action='store_true', help="also delete score rows for days without check-ins")
+    scores.add_argument('--show', type=int, default=20, help="number of diff entries of each kind to print")
+    correct = commands.add_parser('correct', help="correct one user's past check-in and recompute forward")
+    correct.add_argument('user_id', type=int)
+    correct.add_argument('for_date', help="day to correct, YYYY-MM-DD")
+    correct.add_argument('changes', nargs='+', help="HABIT_ID=STATUS, e.g. 12=✅")
+    args = parser.parse_args(argv)
+    if args.command == 'correct':
+        print(json.dumps(asyncio.run(_correct_from_cli(args.user_id, as_date(args.for_date), args.changes)), indent=2))
+        return
+    result = asyncio.run(recompute_scores(args.start, args.end, args.apply, args.delete_orphans))
+    diff = result.pop('diff')
+    print(json.dumps(result, indent=2))
+    for kind, entries in diff.items():
+        for entry in entries[:args.show]:
+            print(kind, entry)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Lightweight row objects for DBClient/DbCache.
+
+Each table gets a generated `__slots__` class whose fields are the table's
+columns, built the first time a record with that column layout is seen. Rows
+behave like the dicts the handlers already use (row['field'], row.get(),
+row['field'] = value, `in`, keys()/items(), dict(row), == with a dict) but carry no per-row
+hash table, so large caches cost a fraction of the memory and copy time.
+"""
+import keyword
+from typing import Any, Dict, Iterable, Tuple
+
+
+class Row:
+    """Base class for generated row types; subclasses define _table, _fields and __slots__."""
+    __slots__ = ()
+    _table = ''
+    _fields: Tuple[str, ...] = ()
+
+    def __getitem__(self, key):
+        # Only columns: getattr alone would also hand out methods and class attributes (row['get'])
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(f"{self._table} has no column {key!r}")
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        if key not in self._fields:
+            return default
+        return getattr(self, key, default)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return [getattr(self, f, None) for f in self._fields]
+
+    def items(self):
+        return [(f, getattr(self, f, None)) for f in self._fields]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __eq__(self, other):
+        # Equal to a Row or dict with the same columns and values, like two dicts
+        if isinstance(other, Row):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    # Mutable and compared by value, so unhashable like the dicts rows stand in for
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+_row_types: Dict[Tuple[str, Tuple[str, ...]], type] = {}
+
+
+def row_type(table: str, fields: Iterable[str]) -> type:
+    """Return (creating once) the row class for `table` with the given column order."""
+    fields = tuple(fields)
+    key = (table, fields)
+    cls = _row_types.get(key)
+    if cls is not None:
+        return cls
+    for f in fields:
+        if not f.isidentifier() or keyword.iskeyword(f) or f.startswith('_'):
+            raise ValueError(f"Column {f!r} of {table} cannot be used as a row field")
+    # Generated positional __init__ avoids a per-field setattr loop on hot load paths
+    args = ', '.join(fields)
+    body = '\n'.join(f'    self.{f} = {f}' for f in fields) or '    pass'
+    namespace: Dict[str, Any] = {}
+    exec(f"def __init__(self, {args}):\n{body}\n" if fields else f"def __init__(self):\n{body}\n", namespace)
+    name = ''.join(part.capitalize() for part in table.split('_')) + 'Row'
+    cls = type(name, (Row,), {
+        '__slots__': fields,
+        '__init__': namespace['__init__'],
+        '_table': table,
+        '_fields': fields,
+    })
+    _row_types[key] = cls
+    return cls
+
+
+def to_row(table: str, record) -> Row:
+    """Convert an asyncpg.Record (or a dict) to the row type of `table`."""
+    return row_type(table, record.keys())(*record.values())
+
+
+def to_rows(table: str, records) -> list:
+    """Convert a list of records sharing one column layout."""
+    if not records:
+        return []
+    cls = row_type(table, records[0].keys())
+    return [cls(*r.values()) for r in records]
@@ -0,0 +1,158 @@
+"""
+Shard ownership for running the scheduler in several processes
+(schemas/sql/005_scheduler_leases.sql).
+
+With SCHEDULER_SHARDS set, users are split into that many shards by
+user_id % SCHEDULER_SHARDS and a worker only reminds/auto-marks the users of
+the shards it holds a lease on. The daily channel summary, partition
+maintenance and the Sheets export only run on the worker holding the leader
+lease; cache verification runs in every process, as each has its own DbCache.
+Every heartbeat
+(a third of SCHEDULER_LEASE_SEC) renews the leases in one transaction and
+moves towards a fair share of the shards: a new worker gets shards as the
+others give back their extras, and a dead worker's leases expire and are
+picked up by the survivors. Heartbeats also stamp the worker's last scheduler
+pass on its leases (schemas/sql/006_scheduler_lease_ticks.sql); a survivor
+gets the dead worker's stamp with each shard it claims and uses it instead of
+its own last pass when catching up missed auto-marks (last_tick_for).
+
+A worker stops acting on its leases once they are two thirds through their
+lifetime without a successful renewal, so a stalled worker has stopped before
+anyone else can claim its shards. SCHEDULER_SHARDS=0 (the default) keeps the
+single-process behaviour: this process owns every user and is the leader.
+"""
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Optional
+
+from bot.utils.db import get_db_client
+from bot.utils.logger import get_logger
+
+logger = get_logger("scheduler_leases")
+
+# Number of user shards shared out between scheduler workers (0 = no sharding)
+SCHEDULER_SHARDS = int(os.getenv("SCHEDULER_SHARDS", "0"))
+# Seconds a lease lasts without renewal; workers renew every third of it
+SCHEDULER_LEASE_SEC = float(os.getenv("SCHEDULER_LEASE_SEC", "30"))
+# Name this worker's leases are held under
+SCHEDULER_WORKER_ID = os.getenv("SCHEDULER_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class SchedulerLeases:
+    def __init__(self, shards: int = SCHEDULER_SHARDS, lease_sec: float = SCHEDULER_LEASE_SEC,
+                 worker_id: str = SCHEDULER_WORKER_ID):
+        self.shards = shards
+        self.lease_sec = lease_sec
+        self.worker_id = worker_id
+        self.owned: FrozenSet[int] = frozenset()
+        # Last pass the previous owner stamped on each shard claimed since the last full pass
+        self.inherited_ticks: Dict[int, Optional[datetime]] = {}
+        self._leader = False
+        self._valid_until = 0.0
+        self._db_client = None
+        self.heartbeats = 0
+        self.failures = 0
+        self.changes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.shards > 0
+
+    @property
+    def heartbeat_sec(self) -> float:
+        return self.lease_sec / 3
+
+    def _valid(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    def owns(self, user_id: int) -> bool:
+        if not self.enabled:
+            return True
+        return self._valid() and user_id % self.shards in self.owned
+
+    def last_tick_for(self, user_id: int, default: Optional[datetime]) -> Optional[datetime]:
+        """The pass catch-up compares against for this user: their shard's previous owner's, if just claimed."""
+        if not self.enabled:
+            return default
+        tick = self.inherited_ticks.get(user_id % self.shards)
+        return tick if tick is not None else default
+
+    def caught_up(self):
+        """The claimed shards' users had a full pass; from now on this worker's own ticks apply."""
+        self.inherited_ticks.clear()
+
+    @property
+    def is_leader(self) -> bool:
+        if not self.enabled:
+            return True
+        return self._valid() and self._leader
+
+    async def _client(self):
+        if self._db_client is None:
+            self._db_client = get_db_client()
+        await self._db_client.connect()
+        return self._db_client
+
+    async def heartbeat(self, last_tick: Optional[datetime] = None) -> bool:
+        """
+        Renew and rebalance the leases, stamping last_tick (this worker's last full
+        pass) on them. Returns True when shards were gained (their users need planning).
+        """
+        if not self.enabled:
+            return False
+        started = time.monotonic()
+        try:
+            client = await self._client()
+            owned, leader, claimed = await client.heartbeat_scheduler_leases(self.worker_id, self.shards, self.lease_sec,
+                                                                             last_tick)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"❌ Scheduler lease heartbeat failed (held until expiry): {e}")
+            return False
+        self.heartbeats += 1
+        self._valid_until = started + self.lease_sec * 2 / 3
+        owned = frozenset(owned)
+        gained = owned - self.owned
+        if owned != self.owned or leader != self._leader:
+            self.changes += 1
+            logger.info(f"🔀 Scheduler worker {self.worker_id} owns shards {sorted(owned)} of {self.shards}"
+                        f"{' and is leader' if leader else ''}")
+        self.owned = owned
+        self._leader = leader
+        for shard in gained:
+            self.inherited_ticks[shard] = claimed.get(shard)
+        for shard in set(self.inherited_ticks) - owned:
+            del self.inherited_ticks[shard]
+        return bool(gained)
+
+    async def release(self):
+        """Hand every lease back (on shutdown) so other workers take over right away."""
+        if not self.enabled:
+            return
+        self.owned = frozenset()
+        self._leader = False
+        self._valid_until = 0.0
+        try:
+            client = await self._client()
+            await client.release_scheduler_leases(self.worker_id)
+        except Exception as e:
+            logger.error(f"❌ Could not release scheduler leases: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'worker_id': self.worker_id,
+            'shards': self.shards,
+            'owned': sorted(self.owned),
+            'leader': self.is_leader,
+            'valid_for_sec': round(max(self._valid_until - time.monotonic(), 0), 3),
+            'heartbeats': self.heartbeats,
+            'failures': self.failures,
+            'changes': self.changes,
+        }
+
+
+scheduler_leases = SchedulerLeases()
@@ -0,0 +1,215 @@
+"""
+Scheduler bookkeeping that survives restarts (schemas/sql/004_scheduler_state.sql).
+
+The scheduler keeps, per user, how many reminders went out for the current
+day, when the last one did, and when the user was last auto-marked, plus the
+day the reminder counts belong to and the day the channel summary was last
+posted. All of it used to live in bot/scheduler.py module dicts, so every
+restart re-sent the reminder sequence and could post the summary twice.
+
+Reads go straight to the dicts on `scheduler_state`; changes go through its
+methods, which only mark the user (or flag) dirty. flush() writes everything
+dirty in one save_scheduler_state call and runs once per scheduler tick, so a
+tick that reminds 500 users is one upsert. load() at startup only reads rows
+touched within SCHEDULER_STATE_LOAD_HOURS, i.e. the users active lately.
+"""
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Set
+
+from bot.utils import clock
+from bot.utils.db import get_db_client
+from bot.utils.logger import get_logger
+
+logger = get_logger("scheduler_state")
+
+# Rows touched this recently are loaded at startup; older ones can't matter
+# (reminder counts reset daily, auto-marks block re-marking for 24h)
+SCHEDULER_STATE_LOAD_HOURS = float(os.getenv("SCHEDULER_STATE_LOAD_HOURS", "36"))
+# Rows older than this are deleted when the day changes
+SCHEDULER_STATE_KEEP_DAYS = int(os.getenv("SCHEDULER_STATE_KEEP_DAYS", "2"))
+
+RESET_DAY_FLAG = 'reset_day'
+SUMMARY_DAY_FLAG = 'summary_day'
+LAST_TICK_FLAG = 'last_tick'
+
+
+class SchedulerState:
+    def __init__(self):
+        self.reminder_counts: Dict[int, int] = {}
+        self.last_reminder_time: Dict[int, datetime] = {}
+        self.last_auto_x_sent: Dict[int, datetime] = {}
+        # Day each user checked in for since start_day; in memory only, the DB holds the check-in itself
+        self.checked_in: Dict[int, str] = {}
+        # Last failed reminder send / auto-mark write per user, in memory only: they just space out retries
+        self.failed_reminder_at: Dict[int, datetime] = {}
+        self.failed_auto_mark_at: Dict[int, datetime] = {}
+        # IST day the reminder counts belong to, and the last day the summary was posted
+        self.reset_day: Optional[date] = None
+        self.summary_day: Optional[date] = None
+        # When the scheduler last evaluated users; deadlines after it may have been slept through
+        self.last_tick_at: Optional[datetime] = None
+        self.loaded = False
+        self._dirty_users: Set[int] = set()
+        self._dirty_flags: Set[str] = set()
+        self._prune = False
+        self._lock = threading.Lock()
+        self._db_client = None
+        self.writes = 0
+        self.rows_written = 0
+
+    # CHANGES
+    def record_reminder(self, user_id: int, count: int, at: datetime):
+        with self._lock:
+            self.reminder_counts[user_id] = count
+            self.last_reminder_time[user_id] = at
+            self._dirty_users.add(user_id)
+
+    def record_auto_mark(self, user_id: int, at: datetime):
+        with self._lock:
+            self.last_auto_x_sent[user_id] = at
+            self._dirty_users.add(user_id)
+
+    def record_reminder_failure(self, user_id: int, at: datetime):
+        with self._lock:
+            self.failed_reminder_at[user_id] = at
+
+    def record_auto_mark_failure(self, user_id: int, at: datetime):
+        with self._lock:
+            self.failed_auto_mark_at[user_id] = at
+
+    def record_checkin(self, user_id: int, for_date: str):
+        with self._lock:
+            self.checked_in[user_id] = for_date
+
+    def reset_user(self, user_id: int):
+        with self._lock:
+            had_count = self.reminder_counts.pop(user_id, None) is not None
+            had_time = self.last_reminder_time.pop(user_id, None) is not None
+            if had_count or had_time:
+                self._dirty_users.add(user_id)
+
+    def start_day(self, day: date):
+        """Forget every reminder count (they belong to the previous day)."""
+        with self._lock:
+            self._dirty_users.update(self.reminder_counts)
+            self._dirty_users.update(self.last_reminder_time)
+            self.reminder_counts.clear()
+            self.last_reminder_time.clear()
+            self.checked_in.clear()
+            self.failed_reminder_at.clear()
+            self.failed_auto_mark_at.clear()
+            self.reset_day = day
+            self._dirty_flags.add(RESET_DAY_FLAG)
+            self._prune = True
+
+    def record_summary(self, day: date):
+        with self._lock:
+            self.summary_day = day
+            self._dirty_flags.add(SUMMARY_DAY_FLAG)
+
+    def record_tick(self, at: datetime):
+        with self._lock:
+            self.last_tick_at = at
+            self._dirty_flags.add(LAST_TICK_FLAG)
+
+    # PERSISTENCE
+    async def _client(self, db_client=None):
+        if db_client is not None:
+            await db_client.connect()
+            return db_client
+        if self._db_client is None:
+            self._db_client = get_db_client()
+        await self._db_client.connect()
+        return self._db_client
+
+    async def load(self, db_client=None, now: Optional[datetime] = None):
+        """Replace the in-memory state with what was saved; errors are logged and leave it empty."""
+        now = now or clock.now_utc()
+        try:
+            client = await self._client(db_client)
+            rows, flags = await client.load_scheduler_state(now - timedelta(hours=SCHEDULER_STATE_LOAD_HOURS))
+        except Exception as e:
+            logger.error(f"❌ Could not load scheduler state, starting empty: {e}")
+            return
+        with self._lock:
+            self.reminder_counts.clear()
+            self.last_reminder_time.clear()
+            self.last_auto_x_sent.clear()
+            for row in rows:
+                user_id = row['user_id']
+                if row['reminder_count']:
+                    self.reminder_counts[user_id] = row['reminder_count']
+                if row['last_reminder_at'] is not None:
+                    self.last_reminder_time[user_id] = row['last_reminder_at']
+                if row['last_auto_at'] is not None:
+                    self.last_auto_x_sent[user_id] = row['last_auto_at']
+            self.reset_day = _parse_day(flags.get(RESET_DAY_FLAG))
+            self.summary_day = _parse_day(flags.get(SUMMARY_DAY_FLAG))
+            last_tick = flags.get(LAST_TICK_FLAG)
+            self.last_tick_at = datetime.fromisoformat(last_tick) if last_tick else None
+            self._dirty_users.clear()
+            self._dirty_flags.clear()
+            self.loaded = True
+        logger.info(f"📥 Loaded scheduler state for {len(rows)} user(s), reset day {self.reset_day}, summary day {self.summary_day}")
+
+    async def flush(self, db_client=None) -> int:
+        """Write every dirty user and flag in one call. Returns the number of rows written."""
+        with self._lock:
+            if not self._dirty_users and not self._dirty_flags and not self._prune:
+                return 0
+            users = [
+                (user_id, self.reminder_counts.get(user_id, 0), self.last_reminder_time.get(user_id),
+                 self.last_auto_x_sent.get(user_id))
+                for user_id in sorted(self._dirty_users)
+            ]
+            flags = {name: self._flag(name) for name in sorted(self._dirty_flags)}
+            prune = self._prune
+            self._dirty_users.clear()
+            self._dirty_flags.clear()
+            self._prune = False
+        prune_before = clock.now_utc() - timedelta(days=SCHEDULER_STATE_KEEP_DAYS) if prune else None
+        try:
+            client = await self._client(db_client)
+            await client.save_scheduler_state(users, flags, prune_before)
+        except Exception as e:
+            # Keep them dirty so the next tick tries again (newer values win, as they are read at flush time)
+            with self._lock:
+                self._dirty_users.update(user_id for user_id, *_ in users)
+                self._dirty_flags.update(flags)
+                self._prune = self._prune or prune
+            logger.error(f"❌ Could not save scheduler state ({len(users)} user(s)): {e}")
+            return 0
+        self.writes += 1
+        self.rows_written += len(users) + len(flags)
+        return len(users) + len(flags)
+
+    def _flag(self, name: str) -> Optional[str]:
+        value = {RESET_DAY_FLAG: self.reset_day, SUMMARY_DAY_FLAG: self.summary_day, LAST_TICK_FLAG: self.last_tick_at}[name]
+        return value.isoformat() if value else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'loaded': self.loaded,
+                'reminded_users': len(self.reminder_counts),
+                'auto_marked_users': len(self.last_auto_x_sent),
+                'reset_day': _format_day(self.reset_day),
+                'summary_day': _format_day(self.summary_day),
+                'last_tick_at': self.last_tick_at.isoformat() if self.last_tick_at else None,
+                'dirty': len(self._dirty_users) + len(self._dirty_flags),
+                'writes': self.writes,
+                'rows_written': self.rows_written,
+            }
+
+
+def _parse_day(value: Optional[str]) -> Optional[date]:
+    return date.fromisoformat(value) if value else None
+
+
+def _format_day(value: Optional[date]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+scheduler_state = SchedulerState()
@@ -0,0 +1,101 @@
+"""
+Lag and missed-window statistics for the scheduler loop (bot/scheduler.py).
+
+Every event the loop pops records its lag (wake-up time minus due time) in a
+histogram, and every pass of check_and_prompt records how long it took. A
+daily summary or auto-mark deadline the scheduler slept through (a restart,
+or the event loop stalled on a synchronous cache reload) is counted as caught
+up when the late run still handled it and as missed when it was too late to.
+"""
+import threading
+from typing import Any, Dict, Hashable, Set, Tuple
+
+# Upper bounds (ms) of the lag/tick histogram buckets; the last bucket is open-ended
+LAG_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 5000, 15000, 60000, 300000)
+
+
+class _Histogram:
+    __slots__ = ("count", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LAG_BUCKETS_MS) + 1)
+
+    def add(self, ms: float):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={b}ms" for b in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}ms"]
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+class SchedulerStats:
+    """Thread-safe counters; snapshot() for dashboards."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.lag = _Histogram()
+            self.ticks = _Histogram()
+            self.lag_resyncs = 0
+            self.caught_up: Dict[str, int] = {}
+            self.missed: Dict[str, int] = {}
+            # (window, key) pairs already counted as missed, so a window is counted once
+            self._missed_seen: Set[Tuple[str, Hashable]] = set()
+
+    def record_lag(self, lag_sec: float):
+        with self._lock:
+            self.lag.add(max(lag_sec, 0) * 1000)
+
+    def record_tick(self, elapsed_ms: float):
+        with self._lock:
+            self.ticks.add(elapsed_ms)
+
+    def record_lag_resync(self):
+        with self._lock:
+            self.lag_resyncs += 1
+
+    def record_caught_up(self, window: str, count: int = 1):
+        with self._lock:
+            self.caught_up[window] = self.caught_up.get(window, 0) + count
+
+    def record_missed(self, window: str, key: Hashable) -> bool:
+        """Count a missed window once per key; returns True the first time."""
+        with self._lock:
+            if (window, key) in self._missed_seen:
+                return False
+            if len(self._missed_seen) > 10000:
+                self._missed_seen.clear()
+            self._missed_seen.add((window, key))
+            self.missed[window] = self.missed.get(window, 0) + 1
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'lag': self.lag.snapshot(),
+                'ticks': self.ticks.snapshot(),
+                'lag_resyncs': self.lag_resyncs,
+                'caught_up': dict(self.caught_up),
+                'missed': dict(self.missed),
+            }
+
+
+scheduler_stats = SchedulerStats()
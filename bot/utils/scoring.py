@@ -0,0 +1,40 @@
+"""
+Snake scoring rules.
+
+These mirror the daily_score_log triggers in production so that code running
+outside Postgres (the local backend, recompute jobs) derives identical rows:
+
+- core score for a day: +1 if no habit is ❌ (a "clean" day), otherwise minus
+  the number of ❌. A day where every habit is ⛔ (DND) scores 0.
+  ✅, ⏭️ (rest day) and ⛔ never count as missed.
+- streak score (snake length): previous day's streak plus today's core score.
+  A dead snake (streak below 0) or a missing previous day restarts from 0.
+"""
+from typing import Iterable, List, Tuple
+
+DONE = "✅"
+MISSED = "❌"
+REST = "⏭️"
+DND = "⛔"
+
+CLEAN_DAY_SCORE = 1
+
+
+def core_score(statuses: Iterable[str]) -> int:
+    """Core score for one user/day from its habit statuses."""
+    statuses = list(statuses)
+    if statuses and all(s == DND for s in statuses):
+        return 0
+    missed = sum(1 for s in statuses if s == MISSED)
+    return CLEAN_DAY_SCORE if missed == 0 else -missed
+
+
+def streak_score(prev_streak, day_score: int) -> int:
+    """Snake length after a day, given the previous day's streak (None if absent)."""
+    base = prev_streak if prev_streak is not None and prev_streak > 0 else 0
+    return base + day_score
+
+
+def log_txt(entries: Iterable[Tuple[str, str]]) -> List[dict]:
+    """log_txt_json payload for a day: [{'habit_text': ..., 'habit_status': ...}, ...]."""
+    return [{"habit_text": text, "habit_status": status} for text, status in entries]
@@ -0,0 +1,325 @@
+"""
+Rate-limited queue for outgoing Telegram messages.
+
+Every bot.send_message goes through send_message() here instead of being
+awaited inline. Messages wait in one of three priority lanes (interactive
+replies first, then channel posts, then bulk reminders) and a dispatcher
+hands them to at most SEND_WORKERS concurrent sends while respecting token
+buckets for the bot as a whole (SEND_GLOBAL_PER_SEC), each private chat
+(SEND_CHAT_PER_SEC) and each group/channel (SEND_CHANNEL_PER_MIN), which
+mirror Telegram's flood limits. A message whose chat is out of tokens is
+skipped over, so one busy chat doesn't hold up the rest of its lane.
+
+Handlers answer updates with reply_text/edit_message_text, which don't go
+through the queue: the reply is what the user is waiting on. They still take a
+token from the bot-wide bucket though, through SendQueueRateLimiter, which
+main.py installs on the Application's bot.
+
+A RetryAfter from Telegram pauses the whole queue for the requested time and
+puts the message back at the front of its lane; TimedOut/NetworkError are
+retried with backoff. The caller's await resolves when the message is
+delivered (or raises what the final attempt raised). Counters and lane depths
+are available from send_queue.snapshot().
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from bot.utils.logger import get_logger
+
+logger = get_logger("send_queue")
+
+# Messages per second for the whole bot (Telegram allows about 30)
+SEND_GLOBAL_PER_SEC = float(os.getenv("SEND_GLOBAL_PER_SEC", "25"))
+# Messages per second to one private chat
+SEND_CHAT_PER_SEC = float(os.getenv("SEND_CHAT_PER_SEC", "1"))
+# Messages per minute to one group or channel (Telegram allows about 20)
+SEND_CHANNEL_PER_MIN = float(os.getenv("SEND_CHANNEL_PER_MIN", "18"))
+# Concurrent send_message calls in flight
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+# Attempts per message on RetryAfter/TimedOut/NetworkError
+SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", "5"))
+
+# Priority lanes, highest first
+LANE_INTERACTIVE = 0
+LANE_CHANNEL = 1
+LANE_BULK = 2
+LANE_NAMES = ('interactive', 'channel', 'bulk')
+
+# Jobs looked at per lane when searching for one whose chat has a token
+_SCAN_DEPTH = 64
+
+# Set while _deliver sends a job, so SendQueueRateLimiter doesn't charge it twice
+_delivering = contextvars.ContextVar('send_queue_delivering', default=False)
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def ready_in(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is now)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ('bot', 'chat_id', 'kwargs', 'lane', 'future', 'attempts', 'queued_at')
+
+    def __init__(self, bot, chat_id, kwargs, lane, future, queued_at):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.lane = lane
+        self.future = future
+        self.attempts = 0
+        self.queued_at = queued_at
+
+
+def _is_channel(chat_id) -> bool:
+    # Groups and channels have negative ids (or an @username); private chats are positive
+    return isinstance(chat_id, str) or chat_id < 0
+
+
+class SendQueue:
+    def __init__(self, global_per_sec: float = SEND_GLOBAL_PER_SEC, chat_per_sec: float = SEND_CHAT_PER_SEC,
+                 channel_per_min: float = SEND_CHANNEL_PER_MIN, workers: int = SEND_WORKERS):
+        self.global_per_sec = global_per_sec
+        self.chat_per_sec = chat_per_sec
+        self.channel_per_min = channel_per_min
+        self.workers = workers
+        self._lanes: List[Deque[_Job]] = [deque() for _ in LANE_NAMES]
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.sent = [0] * len(LANE_NAMES)
+            self.failed = 0
+            self.retry_after = 0
+            self.retried = 0
+            self.max_depth = 0
+            self.total_wait_sec = 0.0
+            self.max_wait_sec = 0.0
+
+    # ENQUEUE
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._global = TokenBucket(self.global_per_sec, max(self.global_per_sec, 1), time.monotonic())
+            self._chats = {}
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def submit(self, bot, chat_id, lane: int = LANE_BULK, **kwargs) -> asyncio.Future:
+        """Queue bot.send_message(chat_id=chat_id, **kwargs); the future resolves to the sent Message."""
+        self._ensure_started()
+        job = _Job(bot, chat_id, kwargs, lane, self._loop.create_future(), time.monotonic())
+        self._lanes[lane].append(job)
+        depth = self.depth()
+        with self._stats_lock:
+            self.max_depth = max(self.max_depth, depth)
+        self._wakeup.set()
+        return job.future
+
+    async def send(self, bot, chat_id, lane: int = LANE_BULK, **kwargs):
+        return await self.submit(bot, chat_id, lane, **kwargs)
+
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    async def take_global(self):
+        """Wait for a token from the bot-wide bucket, for sends made outside the queue."""
+        self._ensure_started()
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._global.ready_in(now))
+            if wait <= 0:
+                self._global.take()
+                return
+            await asyncio.sleep(wait)
+
+    # DISPATCH
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if _is_channel(chat_id):
+                bucket = TokenBucket(self.channel_per_min / 60, 3, now)
+            else:
+                bucket = TokenBucket(self.chat_per_sec, 1, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _pick(self, now: float) -> Tuple[Optional[_Job], Optional[float]]:
+        """The next job allowed to go out, or None and the seconds until one may be."""
+        wait = self._global.ready_in(now)
+        if wait > 0:
+            return None, wait
+        soonest = None
+        for lane in self._lanes:
+            for i, job in enumerate(itertools.islice(lane, _SCAN_DEPTH)):
+                try:
+                    bucket = self._chat_bucket(job.chat_id, now)
+                except Exception as e:
+                    # e.g. chat_id=None: fail the caller instead of blocking the lane
+                    del lane[i]
+                    self._fail(job, e)
+                    return None, 0.0
+                chat_wait = bucket.ready_in(now)
+                if chat_wait == 0:
+                    del lane[i]
+                    bucket.take()
+                    self._global.take()
+                    return job, None
+                soonest = chat_wait if soonest is None else min(soonest, chat_wait)
+        return None, soonest
+
+    async def _dispatch(self):
+        while True:
+            try:
+                now = time.monotonic()
+                job, wait = None, self._paused_until - now
+                if wait <= 0:
+                    job, wait = self._pick(now)
+                if job is not None:
+                    await self._slots.acquire()
+                    asyncio.ensure_future(self._deliver(job))
+                    continue
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A dead dispatcher would leave every queued caller waiting forever
+                logger.error(f"❌ Send queue dispatcher error: {e}")
+                await asyncio.sleep(1)
+
+    def _fail(self, job: _Job, error: Exception):
+        with self._stats_lock:
+            self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    async def _deliver(self, job: _Job):
+        _delivering.set(True)
+        try:
+            job.attempts += 1
+            try:
+                message = await job.bot.send_message(chat_id=job.chat_id, **job.kwargs)
+            except RetryAfter as e:
+                retry_after = float(getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)())
+                with self._stats_lock:
+                    self.retry_after += 1
+                # Flood control applies to the whole bot: hold everything, then resend this one first
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.error(f"⏳ Rate limited by Telegram, pausing sends for {retry_after}s")
+                self._requeue(job, e, front=True)
+                return
+            except (TimedOut, NetworkError) as e:
+                self._requeue(job, e, delay=min(2 ** job.attempts, 30))
+                return
+            except Exception as e:
+                self._fail(job, e)
+                return
+            waited = time.monotonic() - job.queued_at
+            with self._stats_lock:
+                self.sent[job.lane] += 1
+                self.total_wait_sec += waited
+                self.max_wait_sec = max(self.max_wait_sec, waited)
+            if not job.future.done():
+                job.future.set_result(message)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
+
+    def _requeue(self, job: _Job, error: Exception, front: bool = False, delay: float = 0):
+        if job.attempts >= SEND_MAX_ATTEMPTS or job.future.done():
+            self._fail(job, error)
+            return
+        with self._stats_lock:
+            self.retried += 1
+        if delay:
+            self._loop.call_later(delay, self._put_back, job, front)
+        else:
+            self._put_back(job, front)
+
+    def _put_back(self, job: _Job, front: bool):
+        if front:
+            self._lanes[job.lane].appendleft(job)
+        else:
+            self._lanes[job.lane].append(job)
+        self._wakeup.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            delivered = sum(self.sent)
+            return {
+                'depth': {name: len(lane) for name, lane in zip(LANE_NAMES, self._lanes)},
+                'max_depth': self.max_depth,
+                'sent': dict(zip(LANE_NAMES, self.sent)),
+                'failed': self.failed,
+                'retried': self.retried,
+                'retry_after': self.retry_after,
+                'paused_for_sec': round(max(self._paused_until - time.monotonic(), 0), 3),
+                'avg_wait_ms': round(self.total_wait_sec / delivered * 1000, 3) if delivered else 0.0,
+                'max_wait_ms': round(self.max_wait_sec * 1000, 3),
+            }
+
+
+send_queue = SendQueue()
+
+
+class SendQueueRateLimiter(BaseRateLimiter):
+    """
+    Charges the bot's direct send*/edit* API calls (reply_text, edit_message_text, ...)
+    to send_queue's bot-wide bucket; calls made by the queue itself pass straight through.
+    """
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not _delivering.get() and endpoint.startswith(('send', 'edit')):
+            await send_queue.take_global()
+        return await callback(*args, **kwargs)
+
+
+async def send_message(bot, chat_id, text: Optional[str] = None, lane: int = LANE_BULK, **kwargs):
+    """Drop-in for `await bot.send_message(chat_id=..., text=...)` that goes through send_queue."""
+    if text is not None:
+        kwargs['text'] = text
+    return await send_queue.send(bot, chat_id, lane, **kwargs)
@@ -0,0 +1,369 @@
+"""
+Diff-based export of the scores to a spreadsheet.
+
+Each exported sheet is built as a full grid of cell values, compared with the
+grid exported last time (kept in SHEETS_EXPORT_STATE), and only the changed
+cells are sent: changed cells are grouped into rectangular A1 ranges and all
+ranges of a sheet go out in one batch_update call (split every
+SHEETS_EXPORT_MAX_CELLS cells). A nightly sync where only yesterday's column
+moved is one call per sheet instead of one per row.
+
+Sheets:
+    Scores YYYYMM   one row per user, one column per day (streak), current streak
+    Leaderboard     users ranked by their latest streak
+
+The spreadsheet side is pluggable (SheetsClient): GspreadClient writes to the
+Google spreadsheet SHEET_ID, FileSheetsClient keeps every sheet as a CSV file
+in a directory and is what tests and offline runs use. Select one with
+SHEETS_EXPORT_BACKEND ('gspread' or 'file'; empty disables the nightly sync).
+
+Usage:
+    python -m bot.utils.sheets_export               # export now
+    python -m bot.utils.sheets_export --full        # forget the state and rewrite everything
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from bot.utils.db import _month_bounds, get_db_client
+from bot.utils.exceptions import SheetsError
+from bot.utils.logger import get_logger
+
+logger = get_logger("sheets_export")
+
+# 'gspread', 'file', or empty to disable the nightly export
+SHEETS_EXPORT_BACKEND = os.getenv("SHEETS_EXPORT_BACKEND", "").lower()
+# Directory of the file-backed client's CSV sheets
+SHEETS_EXPORT_DIR = os.getenv("SHEETS_EXPORT_DIR", "sheets_export")
+# Last exported grid per sheet
+SHEETS_EXPORT_STATE = os.getenv("SHEETS_EXPORT_STATE", "sheets_export_state.json")
+# Cells per batch_update call
+SHEETS_EXPORT_MAX_CELLS = int(os.getenv("SHEETS_EXPORT_MAX_CELLS", "40000"))
+# Unchanged cells between two changed ones that are rewritten rather than splitting the range
+SHEETS_EXPORT_GAP_CELLS = int(os.getenv("SHEETS_EXPORT_GAP_CELLS", "2"))
+# Local time (HHMM) after which the nightly export runs
+SHEETS_EXPORT_HHMM = os.getenv("SHEETS_EXPORT_HHMM", "0300")
+# Minutes before a failed nightly export is tried again
+SHEETS_EXPORT_RETRY_MIN = int(os.getenv("SHEETS_EXPORT_RETRY_MIN", "30"))
+
+Grid = List[List[Any]]
+# (first row, first column, last row, last column), 0-based and inclusive
+Rect = Tuple[int, int, int, int]
+
+_last_run_on: Optional[date] = None
+_failed_at: Optional[datetime] = None
+
+
+class SheetsClient:
+    """What the exporter needs from a spreadsheet."""
+
+    def ensure_size(self, sheet: str, rows: int, cols: int):
+        """Create the sheet if needed and make it at least rows x cols."""
+        raise NotImplementedError
+
+    def batch_update(self, sheet: str, updates: List[Tuple[str, Grid]]):
+        """Write every (A1 range, values) pair in one call."""
+        raise NotImplementedError
+
+
+class FileSheetsClient(SheetsClient):
+    """Stand-in client keeping each sheet as <directory>/<sheet>.csv; counts calls like the API would."""
+
+    def __init__(self, directory: str = SHEETS_EXPORT_DIR):
+        self.directory = directory
+        self.calls = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sheet: str) -> str:
+        return os.path.join(self.directory, f'{sheet}.csv')
+
+    def read(self, sheet: str) -> Grid:
+        if not os.path.exists(self._path(sheet)):
+            return []
+        with open(self._path(sheet), newline='', encoding='utf-8') as f:
+            return [row for row in csv.reader(f)]
+
+    def ensure_size(self, sheet: str, rows: int, cols: int):
+        if not os.path.exists(self._path(sheet)):
+            self.calls += 1
+            self._write(sheet, [])
+
+    def batch_update(self, sheet: str, updates: List[Tuple[str, Grid]]):
+        self.calls += 1
+        grid = self.read(sheet)
+        for a1, values in updates:
+            r0, c0, _, _ = parse_a1(a1)
+            for i, row in enumerate(values):
+                while len(grid) <= r0 + i:
+                    grid.append([])
+                target = grid[r0 + i]
+                for j, value in enumerate(row):
+                    while len(target) <= c0 + j:
+                        target.append('')
+                    target[c0 + j] = '' if value is None else str(value)
+        self._write(sheet, grid)
+
+    def _write(self, sheet: str, grid: Grid):
+        tmp = self._path(sheet) + '.tmp'
+        with open(tmp, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(grid)
+        os.replace(tmp, self._path(sheet))
+
+
+class GspreadClient(SheetsClient):
+    """Google Sheets through gspread, using the bot's SHEET_ID and CREDS_JSON."""
+
+    def __init__(self, sheet_id: Optional[str] = None, creds: Optional[str] = None):
+        import gspread
+        from bot.utils.config import CREDS_JSON, SHEET_ID
+        creds = creds or CREDS_JSON
+        # CREDS_JSON is either a path to the service account file or its JSON content
+        if os.path.exists(creds):
+            gc = gspread.service_account(filename=creds)
+        else:
+            gc = gspread.service_account_from_dict(json.loads(creds))
+        self._gspread = gspread
+        self._spreadsheet = gc.open_by_key(sheet_id or SHEET_ID)
+        self._worksheets: Dict[str, Any] = {}
+
+    def ensure_size(self, sheet: str, rows: int, cols: int):
+        ws = self._worksheets.get(sheet)
+        if ws is None:
+            try:
+                ws = self._spreadsheet.worksheet(sheet)
+            except self._gspread.WorksheetNotFound:
+                ws = self._spreadsheet.add_worksheet(sheet, rows=max(rows, 1), cols=max(cols, 1))
+            self._worksheets[sheet] = ws
+        if ws.row_count < rows or ws.col_count < cols:
+            ws.resize(rows=max(rows, ws.row_count), cols=max(cols, ws.col_count))
+
+    def batch_update(self, sheet: str, updates: List[Tuple[str, Grid]]):
+        try:
+            self._worksheets[sheet].batch_update([{'range': a1, 'values': values} for a1, values in updates])
+        except self._gspread.exceptions.APIError as e:
+            raise SheetsError(f"Updating sheet {sheet!r} failed: {e}") from e
+
+
+def get_sheets_client(backend: Optional[str] = None) -> SheetsClient:
+    backend = backend or SHEETS_EXPORT_BACKEND
+    if backend == 'file':
+        return FileSheetsClient()
+    if backend == 'gspread':
+        return GspreadClient()
+    raise SheetsError(f"Unknown SHEETS_EXPORT_BACKEND {backend!r}")
+
+
+# A1 NOTATION
+def column_letter(col: int) -> str:
+    """0-based column index -> 'A', 'B', ..., 'AA'."""
+    letters = ''
+    col += 1
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def to_a1(rect: Rect) -> str:
+    r0, c0, r1, c1 = rect
+    return f'{column_letter(c0)}{r0 + 1}:{column_letter(c1)}{r1 + 1}'
+
+
+def parse_a1(a1: str) -> Rect:
+    def cell(ref):
+        letters = ''.join(ch for ch in ref if ch.isalpha())
+        col = 0
+        for ch in letters.upper():
+            col = col * 26 + ord(ch) - ord('A') + 1
+        return int(ref[len(letters):]) - 1, col - 1
+    start, _, end = a1.partition(':')
+    r0, c0 = cell(start)
+    r1, c1 = cell(end or start)
+    return r0, c0, r1, c1
+
+
+# DIFFING
+def _cell(grid: Grid, r: int, c: int) -> Any:
+    if r < len(grid) and c < len(grid[r]):
+        value = grid[r][c]
+        return '' if value is None else value
+    return ''
+
+
+def diff_grid(old: Grid, new: Grid, gap: int = SHEETS_EXPORT_GAP_CELLS) -> List[Rect]:
+    """
+    Rectangles covering every cell that differs between old and new. Changed cells
+    in a row become column runs (bridging up to `gap` unchanged cells), and equal
+    runs on consecutive rows are stacked into one rectangle. Cells only in old are
+    cleared, so a shrinking sheet leaves no stale values.
+    """
+    rects: List[Rect] = []
+    open_rects: Dict[Tuple[int, int], int] = {}
+    for r in range(max(len(old), len(new))):
+        width = max(len(old[r]) if r < len(old) else 0, len(new[r]) if r < len(new) else 0)
+        runs = []
+        for c in range(width):
+            if _cell(old, r, c) != _cell(new, r, c):
+                if runs and c - runs[-1][1] - 1 <= gap:
+                    runs[-1][1] = c
+                else:
+                    runs.append([c, c])
+        still_open = {}
+        for c0, c1 in runs:
+            top = open_rects.pop((c0, c1), r)
+            still_open[(c0, c1)] = top
+        for (c0, c1), top in open_rects.items():
+            rects.append((top, c0, r - 1, c1))
+        open_rects = still_open
+    last = max(len(old), len(new)) - 1
+    for (c0, c1), top in open_rects.items():
+        rects.append((top, c0, last, c1))
+    return sorted(rects)
+
+
+def _values(grid: Grid, rect: Rect) -> Grid:
+    r0, c0, r1, c1 = rect
+    return [[_cell(grid, r, c) for c in range(c0, c1 + 1)] for r in range(r0, r1 + 1)]
+
+
+def _json_safe(grid: Grid) -> Grid:
+    # Cells as JSON would give them back, so the stored state compares equal next run
+    return [[v if isinstance(v, (int, float, str)) else ('' if v is None else str(v)) for v in row] for row in grid]
+
+
+def load_state(path: str = SHEETS_EXPORT_STATE) -> Dict[str, Grid]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state: Dict[str, Grid], path: str = SHEETS_EXPORT_STATE):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def push_sheet(client: SheetsClient, sheet: str, grid: Grid, previous: Optional[Grid],
+               max_cells: int = SHEETS_EXPORT_MAX_CELLS) -> Dict[str, int]:
+    """Send the difference between previous and grid; returns the ranges, cells and calls used."""
+    rects = diff_grid(previous or [], grid)
+    if not rects:
+        return {'ranges': 0, 'cells': 0, 'calls': 0}
+    client.ensure_size(sheet, max(len(grid), 1), max((len(row) for row in grid), default=1))
+    calls = cells = 0
+    updates: List[Tuple[str, Grid]] = []
+    pending = 0
+    for rect in rects:
+        size = (rect[2] - rect[0] + 1) * (rect[3] - rect[1] + 1)
+        if updates and pending + size > max_cells:
+            client.batch_update(sheet, updates)
+            calls += 1
+            updates, pending = [], 0
+        updates.append((to_a1(rect), _values(grid, rect)))
+        pending += size
+        cells += size
+    client.batch_update(sheet, updates)
+    return {'ranges': len(rects), 'cells': cells, 'calls': calls + 1}
+
+
+# SHEETS
+def _display_name(user) -> str:
+    name = user['nickname'] or user['username'] or str(user['user_id'])
+    return f"{user['user_moji']} {name}" if user['user_moji'] else name
+
+
+async def build_score_sheets(db_client, year_month: str) -> Dict[str, Grid]:
+    """The month's score grid and the leaderboard, as lists of rows."""
+    start, end = _month_bounds(year_month)
+    users = {}
+    async for u in db_client.iter_table('users'):
+        users[u['user_id']] = u
+    streaks: Dict[int, Dict[int, int]] = {}
+    async for row in db_client.iter_table('daily_score_log', since=start):
+        if row['score_type'] == 'streak' and row['for_date'] < end:
+            streaks.setdefault(row['user_id'], {})[row['for_date'].day] = row['score']
+    days = (end - start).days
+    header = ['User'] + [f'{d:02d}' for d in range(1, days + 1)] + ['Streak']
+    month = [header]
+    latest = []
+    # Rows stay in user_id order so a new day only changes one column
+    for user_id in sorted(streaks):
+        user = users.get(user_id)
+        name = _display_name(user) if user else str(user_id)
+        by_day = streaks[user_id]
+        current = by_day[max(by_day)]
+        month.append([name] + [by_day.get(d, '') for d in range(1, days + 1)] + [current])
+        latest.append((current, name))
+    latest.sort(key=lambda x: (-x[0], x[1]))
+    leaderboard = [['Rank', 'User', 'Streak']] + [[i + 1, name, score] for i, (score, name) in enumerate(latest)]
+    return {f'Scores {year_month}': month, 'Leaderboard': leaderboard}
+
+
+async def export_scores(client: Optional[SheetsClient] = None, year_month: Optional[str] = None, full: bool = False,
+                        state_path: str = SHEETS_EXPORT_STATE, db_client=None) -> Dict[str, Dict[str, int]]:
+    """
+    Build the score sheets for year_month (default: the month of yesterday) and
+    push what changed since the last export. full=True rewrites every cell.
+    The spreadsheet clients are blocking (gspread is plain HTTP), so they run
+    in a worker thread and the scheduler loop keeps going meanwhile.
+    """
+    client = client or await asyncio.to_thread(get_sheets_client)
+    year_month = year_month or (datetime.now().date() - timedelta(days=1)).strftime('%Y%m')
+    own_client = db_client is None
+    db_client = db_client or get_db_client()
+    await db_client.connect()
+    try:
+        sheets = await build_score_sheets(db_client, year_month)
+    finally:
+        if own_client:
+            await db_client.close()
+    state = {} if full else load_state(state_path)
+    results = {}
+    for sheet, grid in sheets.items():
+        grid = _json_safe(grid)
+        results[sheet] = await asyncio.to_thread(push_sheet, client, sheet, grid, state.get(sheet))
+        # Saved per sheet, so a failure halfway only resends the sheets not done yet
+        state[sheet] = grid
+        save_state(state, state_path)
+    logger.info(f"📤 Sheets export {year_month}: {results}")
+    return results
+
+
+async def maybe_export_scores():
+    """Run export_scores once a day after SHEETS_EXPORT_HHMM; errors are logged and retried after SHEETS_EXPORT_RETRY_MIN."""
+    global _last_run_on, _failed_at
+    if not SHEETS_EXPORT_BACKEND:
+        return
+    now = datetime.now()
+    if _last_run_on == now.date() or now.strftime('%H%M') < SHEETS_EXPORT_HHMM:
+        return
+    if _failed_at is not None and now < _failed_at + timedelta(minutes=SHEETS_EXPORT_RETRY_MIN):
+        return
+    try:
+        await export_scores()
+        _last_run_on = now.date()
+        _failed_at = None
+    except Exception as e:
+        _failed_at = now
+        logger.error(f"❌ Sheets export failed, retrying in {SHEETS_EXPORT_RETRY_MIN} min: {e}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export the scores to a spreadsheet, sending only changed cells")
+    parser.add_argument('--month', help="YYYYMM to export (default: month of yesterday)")
+    parser.add_argument('--backend', choices=('gspread', 'file'), help="override SHEETS_EXPORT_BACKEND")
+    parser.add_argument('--full', action='store_true', help="ignore the saved state and rewrite every cell")
+    args = parser.parse_args(argv)
+    client = get_sheets_client(args.backend or SHEETS_EXPORT_BACKEND or 'file')
+    result = asyncio.run(export_scores(client, args.month, args.full))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+"""
+Offline importer of the old Google Sheets data into the database.
+
+Each sheet is exported to CSV (File > Download > CSV) into one directory:
+
+    users.csv           user_id, username, nickname, usermoji, dob, timezone, email, ...
+    habits.csv          habit_id?, user_id, year_month, habit_text, habit_type
+    core_habit_log.csv  core_log_id?, for_date, user_id, habit_id or habit_text, habit_status, marked_by
+    dnd_log.csv         dnd_log_id?, user_id, habit_id or habit_text, start_date, end_date
+
+(checkins.csv / dnd.csv are accepted too). Headers are matched loosely
+("Habit Status" == habit_status, see HEADER_ALIASES); a users export without a
+header row is read by the USER_*_COL sheet column indices. Unknown columns are
+ignored.
+
+The files are streamed row by row, converted and validated with the same rules
+as the bot (bot.utils.validation / constants), and loaded in batches of
+IMPORT_BATCH_ROWS with DBClient.import_rows (COPY into a staging table, then an
+insert that skips rows already stored). Check-ins and DND periods without a
+habit_id are matched to the imported habits by (user, month, habit text).
+Invalid rows are written to <dir>/rejects/<table>.csv with the reason.
+
+After every batch the number of rows consumed is saved to the checkpoint file,
+and a re-run continues from there. Since import_rows skips stored rows, a batch
+replayed after a crash is harmless. Once the check-ins are in, daily_score_log
+is recomputed for the imported date range (bot.utils.recompute).
+
+Usage:
+    python -m bot.utils.sheets_import exports/                 # import (or resume)
+    python -m bot.utils.sheets_import exports/ --restart       # ignore the checkpoint
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bot.utils.constants import (DATE_PATTERN, EMAIL_PATTERN, SUPPORTED_TIMEZONES, USER_ID_COL, USERNAME_COL,
+                                 NICKNAME_COL, USERMOJI_COL, DOB_COL, TIMEZONE_COL, EMAIL_COL, REGISTRATION_DATE_COL)
+from bot.utils.db import get_db_client
+from bot.utils.exceptions import SheetsError
+from bot.utils.logger import get_logger
+from bot.utils import scoring
+from bot.utils.validation import validate_habit_name, validate_user_id
+
+logger = get_logger("sheets_import")
+
+# Rows per import_rows call (one COPY + insert + checkpoint each)
+IMPORT_BATCH_ROWS = int(os.getenv("IMPORT_BATCH_ROWS", "5000"))
+
+# Tables in load order; later tables are matched against the earlier ones
+IMPORT_ORDER = ('users', 'habits', 'core_habit_log', 'dnd_log')
+
+# Export file names tried per table
+IMPORT_FILES = {
+    'users': ('users.csv',),
+    'habits': ('habits.csv',),
+    'core_habit_log': ('core_habit_log.csv', 'checkins.csv'),
+    'dnd_log': ('dnd_log.csv', 'dnd.csv'),
+}
+
+# Sheet header spellings -> column names (after lower-casing and _ for spaces)
+HEADER_ALIASES = {
+    'usermoji': 'user_moji', 'emoji': 'user_moji', 'registration_date': 'created_at',
+    'date': 'for_date', 'status': 'habit_status', 'habit': 'habit_text', 'habit_name': 'habit_text',
+    'type': 'habit_type', 'month': 'year_month', 'start': 'start_date', 'end': 'end_date',
+}
+
+# Headerless users exports are laid out like the old user sheet
+USER_SHEET_COLUMNS = {
+    USER_ID_COL: 'user_id', USERNAME_COL: 'username', NICKNAME_COL: 'nickname', USERMOJI_COL: 'user_moji',
+    DOB_COL: 'dob', TIMEZONE_COL: 'timezone', EMAIL_COL: 'email', REGISTRATION_DATE_COL: 'created_at',
+}
+
+# Status spellings seen in the sheets -> the emoji stored in core_habit_log
+STATUS_ALIASES = {
+    'done': scoring.DONE, 'yes': scoring.DONE, 'y': scoring.DONE, '1': scoring.DONE, 'true': scoring.DONE,
+    'missed': scoring.MISSED, 'no': scoring.MISSED, 'n': scoring.MISSED, '0': scoring.MISSED, 'false': scoring.MISSED,
+    'rest': scoring.REST, 'skip': scoring.REST, '⏭': scoring.REST, 'dnd': scoring.DND,
+}
+STATUSES = (scoring.DONE, scoring.MISSED, scoring.REST, scoring.DND)
+
+
+def _text(value: str) -> Optional[str]:
+    return value.strip() or None
+
+
+def _int(value: str) -> Optional[int]:
+    value = value.strip()
+    if not value:
+        return None
+    # Sheets exports whole numbers as "123" or "123.0"
+    return int(value[:-2]) if value.endswith('.0') else int(value)
+
+
+def _date(value: str) -> Optional[date]:
+    value = value.strip()
+    if not value:
+        return None
+    if not DATE_PATTERN.match(value[:10]):
+        raise ValueError(f"invalid date {value!r}, expected YYYY-MM-DD")
+    return date.fromisoformat(value[:10])
+
+
+def _timestamp(value: str) -> Optional[datetime]:
+    value = value.strip()
+    return datetime.fromisoformat(value) if value else None
+
+
+# Parser per importable column
+COLUMN_PARSERS: Dict[str, Dict[str, Callable[[str], Any]]] = {
+    'users': {'user_id': _int, 'username': _text, 'nickname': _text, 'user_moji': _text, 'dob': _date,
+              'timezone': _text, 'email': _text, 'user_status': _text, 'created_at': _timestamp},
+    'habits': {'habit_id': _int, 'user_id': _int, 'username': _text, 'year_month': _text, 'habit_text': _text,
+               'habit_type': _text, 'created_at': _timestamp},
+    'core_habit_log': {'core_log_id': _int, 'for_date': _date, 'year_month': _text, 'user_id': _int, 'username': _text,
+                       'habit_id': _int, 'habit_text': _text, 'habit_status': _text, 'marked_by': _text,
+                       'created_at': _timestamp},
+    'dnd_log': {'dnd_log_id': _int, 'year_month': _text, 'username': _text, 'user_id': _int, 'habit_id': _int,
+                'habit_text': _text, 'start_date': _date, 'end_date': _date, 'created_at': _timestamp},
+}
+
+# Columns always written (filled in by validation); the rest only when the export has them
+DERIVED_COLUMNS = {
+    'users': ('user_id',),
+    'habits': ('user_id', 'username', 'year_month', 'habit_text', 'habit_type'),
+    'core_habit_log': ('for_date', 'year_month', 'user_id', 'username', 'habit_id', 'habit_text', 'habit_status', 'marked_by'),
+    'dnd_log': ('year_month', 'username', 'user_id', 'habit_id', 'habit_text', 'start_date', 'end_date'),
+}
+
+
+class ImportState:
+    """Lookups shared across tables plus the checkpoint file."""
+
+    def __init__(self, directory: str, checkpoint_path: str):
+        self.directory = directory
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as f:
+                self.checkpoint = json.load(f)
+        self.usernames: Dict[int, Optional[str]] = {}
+        self.habits_by_key: Dict[Tuple[int, str, str], int] = {}
+        self.habits_by_id: Dict[int, Tuple[int, str, str]] = {}
+
+    def save(self):
+        # Write-then-rename, so a crash never leaves a torn checkpoint
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f, indent=2, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    async def load_lookups(self, db_client):
+        """Users and habits as stored now, to match the rows of the later tables."""
+        self.usernames = {}
+        async for u in db_client.iter_table('users'):
+            self.usernames[u['user_id']] = u['username']
+        self.habits_by_key, self.habits_by_id = {}, {}
+        async for h in db_client.iter_table('habits'):
+            key = (h['user_id'], h['year_month'], h['habit_text'])
+            self.habits_by_key.setdefault(key, h['habit_id'])
+            self.habits_by_id[h['habit_id']] = key
+
+
+def _check_user(row: Dict[str, Any], state: ImportState) -> Optional[str]:
+    ok, error = validate_user_id(row['user_id'])
+    if not ok:
+        return error
+    if row.get('timezone') is not None and row['timezone'] not in SUPPORTED_TIMEZONES:
+        return f"Unsupported timezone {row['timezone']!r}"
+    if row.get('email') is not None and not EMAIL_PATTERN.match(row['email']):
+        return f"Invalid email {row['email']!r}"
+    return None
+
+
+def _check_owner(row: Dict[str, Any], state: ImportState) -> Optional[str]:
+    ok, error = validate_user_id(row['user_id'])
+    if not ok:
+        return error
+    if row['user_id'] not in state.usernames:
+        return f"Unknown user {row['user_id']}"
+    if row['username'] is None:
+        row['username'] = state.usernames[row['user_id']]
+    return None
+
+
+def _resolve_habit(row: Dict[str, Any], state: ImportState) -> Optional[str]:
+    if row['habit_id'] is not None:
+        habit = state.habits_by_id.get(row['habit_id'])
+        if habit is None or habit[0] != row['user_id']:
+            return f"Unknown habit_id {row['habit_id']} for user {row['user_id']}"
+        if row['habit_text'] is None:
+            row['habit_text'] = habit[2]
+        return None
+    if row['habit_text'] is None:
+        return "Missing habit_id and habit_text"
+    row['habit_id'] = state.habits_by_key.get((row['user_id'], row['year_month'], row['habit_text']))
+    if row['habit_id'] is None:
+        return f"No habit {row['habit_text']!r} for user {row['user_id']} in {row['year_month']}"
+    return None
+
+
+def _check_habit(row: Dict[str, Any], state: ImportState) -> Optional[str]:
+    error = _check_owner(row, state)
+    if error:
+        return error
+    if row['year_month'] is None or not (len(row['year_month']) == 6 and row['year_month'].isdigit()):
+        return f"Invalid year_month {row['year_month']!r}, expected YYYYMM"
+    ok, error = validate_habit_name(row['habit_text'] or '')
+    if not ok:
+        return error
+    row['habit_type'] = row['habit_type'] or 'core'
+    return None
+
+
+def _check_checkin(row: Dict[str, Any], state: ImportState) -> Optional[str]:
+    if row['for_date'] is None:
+        return "Missing for_date"
+    status = row['habit_status']
+    row['habit_status'] = STATUS_ALIASES.get(status.lower(), status) if status else None
+    if row['habit_status'] not in STATUSES:
+        return f"Invalid habit_status {status!r}"
+    row['year_month'] = row['for_date'].strftime('%Y%m')
+    row['marked_by'] = row['marked_by'] or 'manual'
+    return _check_owner(row, state) or _resolve_habit(row, state)
+
+
+def _check_dnd(row: Dict[str, Any], state: ImportState) -> Optional[str]:
+    if row['start_date'] is None or row['end_date'] is None:
+        return "Missing start_date or end_date"
+    if row['end_date'] < row['start_date']:
+        return "end_date is before start_date"
+    row['year_month'] = row['year_month'] or row['start_date'].strftime('%Y%m')
+    return _check_owner(row, state) or _resolve_habit(row, state)
+
+
+ROW_CHECKS = {'users': _check_user, 'habits': _check_habit, 'core_habit_log': _check_checkin, 'dnd_log': _check_dnd}
+
+
+def _find_export(directory: str, table: str) -> Optional[str]:
+    for name in IMPORT_FILES[table]:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _map_header(table: str, header: List[str]) -> Tuple[Dict[int, str], bool]:
+    """Column index -> column name for the export's first row, and whether that row was a header."""
+    parsers = COLUMN_PARSERS[table]
+    mapping = {}
+    for i, name in enumerate(header):
+        name = name.strip().lower().replace(' ', '_').replace('-', '_')
+        name = HEADER_ALIASES.get(name, name)
+        if name in parsers and name not in mapping.values():
+            mapping[i] = name
+    if table == 'users' and header and header[USER_ID_COL].strip().isdigit():
+        return dict(USER_SHEET_COLUMNS), False
+    if 'user_id' not in mapping.values():
+        raise SheetsError(f"{table} export has no user_id column (header: {header})")
+    return mapping, True
+
+
+async def import_table(db_client, table: str, path: str, state: ImportState,
+                       batch_rows: int = IMPORT_BATCH_ROWS) -> Dict[str, Any]:
+    """Stream one export into `table`, resuming from and updating its checkpoint."""
+    stat = os.stat(path)
+    source = {'file': os.path.basename(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+    progress = state.checkpoint.get(table)
+    if progress and any(progress.get(k) != v for k, v in source.items()):
+        logger.info(f"📄 {path} changed since the last run, importing it from the start")
+        progress = None
+    if progress and progress.get('done'):
+        return progress
+    progress = progress or {**source, 'rows_done': 0, 'imported': 0, 'rejected': 0,
+                            'first_date': None, 'last_date': None, 'done': False}
+    os.makedirs(os.path.join(state.directory, 'rejects'), exist_ok=True)
+    rejects_path = os.path.join(state.directory, 'rejects', f'{table}.csv')
+    parsers = COLUMN_PARSERS[table]
+    check = ROW_CHECKS[table]
+    start = time.perf_counter()
+    read = 0
+
+    with open(path, newline='', encoding='utf-8-sig') as f, \
+            open(rejects_path, 'a' if progress['rows_done'] else 'w', newline='', encoding='utf-8') as rf:
+        reader = csv.reader(f)
+        rejects = csv.writer(rf)
+        first = next(reader, None)
+        if first is None:
+            progress['done'] = True
+            state.checkpoint[table] = progress
+            state.save()
+            return progress
+        mapping, has_header = _map_header(table, first)
+        rows = reader if has_header else itertools.chain([first], reader)
+        # Line numbers in rejects refer to the CSV file (1-based, header included)
+        line_offset = 2 if has_header else 1
+        columns = list(dict.fromkeys([*DERIVED_COLUMNS[table], *mapping.values()]))
+        rows = itertools.islice(rows, progress['rows_done'], None)
+        batch: List[tuple] = []
+        consumed = 0
+
+        async def flush():
+            nonlocal consumed
+            progress['imported'] += await db_client.import_rows(table, columns, batch)
+            progress['rows_done'] += consumed
+            rf.flush()
+            state.checkpoint[table] = progress
+            state.save()
+            batch.clear()
+            consumed = 0
+
+        for n, raw in enumerate(rows, start=progress['rows_done'] + line_offset):
+            consumed += 1
+            read += 1
+            if not any(cell.strip() for cell in raw):
+                continue
+            row = dict.fromkeys(columns)
+            error = None
+            for i, name in mapping.items():
+                if i < len(raw):
+                    try:
+                        row[name] = parsers[name](raw[i])
+                    except ValueError:
+                        error = f"Invalid {name} {raw[i]!r}"
+                        break
+            error = error or check(row, state)
+            if error:
+                progress['rejected'] += 1
+                rejects.writerow([n, error, *raw])
+            else:
+                batch.append(tuple(row[c] for c in columns))
+                if table == 'core_habit_log':
+                    day = row['for_date'].isoformat()
+                    if progress['first_date'] is None or day < progress['first_date']:
+                        progress['first_date'] = day
+                    if progress['last_date'] is None or day > progress['last_date']:
+                        progress['last_date'] = day
+            if consumed >= batch_rows:
+                await flush()
+        await flush()
+
+    progress['done'] = True
+    state.checkpoint[table] = progress
+    state.save()
+    elapsed = time.perf_counter() - start
+    rate = round(read / elapsed) if elapsed > 0 else read
+    logger.info(f"📥 {table}: {read} rows read, {progress['imported']} imported in total, "
+                f"{progress['rejected']} rejected ({rate} rows/s)")
+    return progress
+
+
+async def run_import(directory: str, checkpoint_path: Optional[str] = None, restart: bool = False,
+                     recompute: bool = True, batch_rows: int = IMPORT_BATCH_ROWS, db_client=None) -> Dict[str, Any]:
+    """Import every export found in `directory` in IMPORT_ORDER; returns the checkpoint."""
+    checkpoint_path = checkpoint_path or os.path.join(directory, '.import_checkpoint.json')
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    state = ImportState(directory, checkpoint_path)
+    own_client = db_client is None
+    db_client = db_client or get_db_client()
+    await db_client.connect()
+    try:
+        for table in IMPORT_ORDER:
+            path = _find_export(directory, table)
+            if path is None:
+                logger.info(f"📄 No export for {table} in {directory}, skipping")
+                continue
+            if table in ('habits', 'core_habit_log'):
+                # Rows are matched against what the previous tables stored
+                await state.load_lookups(db_client)
+            await import_table(db_client, table, path, state, batch_rows)
+
+        checkins = state.checkpoint.get('core_habit_log')
+        if recompute and checkins and checkins['done'] and checkins['first_date'] and not checkins.get('recomputed'):
+            # The triggers derive each day as it lands; a full pass fixes streaks of days imported out of order
+            from bot.utils.recompute import recompute_scores
+            result = await recompute_scores(checkins['first_date'], checkins['last_date'], apply=True, db_client=db_client)
+            logger.info(f"🧮 Recomputed scores {checkins['first_date']}..{checkins['last_date']}: "
+                        f"{result['update']} updated, {result['insert']} inserted")
+            checkins['recomputed'] = True
+            state.save()
+        return state.checkpoint
+    finally:
+        if own_client:
+            await db_client.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Import Google Sheets CSV exports into the database")
+    parser.add_argument('directory', help="directory with users.csv, habits.csv, core_habit_log.csv, dnd_log.csv")
+    parser.add_argument('--checkpoint', help="checkpoint file (default: DIRECTORY/.import_checkpoint.json)")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and import everything again")
+    parser.add_argument('--batch', type=int, default=IMPORT_BATCH_ROWS, help="rows per COPY batch")
+    parser.add_argument('--no-recompute', action='store_true', help="don't recompute daily_score_log afterwards")
+    args = parser.parse_args(argv)
+    result = asyncio.run(run_import(args.directory, args.checkpoint, args.restart, not args.no_recompute, args.batch))
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
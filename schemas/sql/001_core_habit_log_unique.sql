@@ -0,0 +1,26 @@
+-- One core_habit_log row per (user_id, habit_id, for_date), required by the
+-- ON CONFLICT upsert in DBClient.add_checkins.
+
+BEGIN;
+
+-- Collapse existing duplicates: keep a manual row over an auto one, then the earliest
+DELETE FROM core_habit_log
+WHERE core_log_id IN (
+    SELECT core_log_id FROM (
+        SELECT core_log_id,
+               row_number() OVER (
+                   PARTITION BY user_id, habit_id, for_date
+                   ORDER BY (marked_by = 'manual') DESC, core_log_id
+               ) AS rn
+        FROM core_habit_log
+    ) ranked
+    WHERE rn > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS core_habit_log_user_habit_date_key
+    ON core_habit_log (user_id, habit_id, for_date);
+
+COMMIT;
+
+-- NOTE: a manual check-in replacing an auto-marked row is an UPDATE, so the
+-- trigger that derives daily_score_log must fire AFTER INSERT OR UPDATE.
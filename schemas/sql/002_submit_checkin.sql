@@ -0,0 +1,68 @@
+-- submit_checkin(): record one user's check-in for a day and return both the
+-- core_habit_log rows now stored for it and the daily_score_log rows the
+-- triggers derived from it, in a single call.
+-- Used by DBClient.submit_checkin; same precedence as DBClient.add_checkins
+-- (a manual check-in replaces an auto-marked row, any other conflict keeps
+-- the stored row). Requires 001_core_habit_log_unique.sql.
+--
+-- Every result row carries exactly one of:
+--   checkin_row/written  a stored core_habit_log row; written is false where
+--                        the row already stored won (like add_checkins)
+--   score_row            a core or streak row for p_for_date or a later day
+--                        of the user, since a late check-in changes the
+--                        streak of the days after it
+--
+-- The first version returned only the score rows; its return type differs,
+-- so it is dropped first.
+
+BEGIN;
+
+DROP FUNCTION IF EXISTS submit_checkin(int8, text, date, int8[], text[], text[], text, int8[]);
+
+CREATE FUNCTION submit_checkin(
+    p_user_id int8,
+    p_username text,
+    p_for_date date,
+    p_habit_ids int8[],
+    p_habit_texts text[],
+    p_statuses text[],
+    p_marked_by text DEFAULT 'manual',
+    p_core_log_ids int8[] DEFAULT NULL
+) RETURNS TABLE (checkin_row core_habit_log, written boolean, score_row daily_score_log)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+BEGIN
+    RETURN QUERY
+    WITH input AS (
+        SELECT t.habit_id, t.habit_text, t.habit_status, t.core_log_id
+        FROM unnest(p_habit_ids, p_habit_texts, p_statuses,
+                    COALESCE(p_core_log_ids, array_fill(NULL::int8, ARRAY[cardinality(p_habit_ids)])))
+            AS t(habit_id, habit_text, habit_status, core_log_id)
+    ), upserted AS (
+        INSERT INTO core_habit_log AS c (core_log_id, for_date, year_month, user_id, username, habit_id, habit_text, habit_status, marked_by)
+        SELECT COALESCE(i.core_log_id, nextval(pg_get_serial_sequence('core_habit_log', 'core_log_id'))),
+               p_for_date, to_char(p_for_date, 'YYYYMM'), p_user_id, p_username,
+               i.habit_id, i.habit_text, i.habit_status, p_marked_by
+        FROM input i
+        ON CONFLICT (user_id, habit_id, for_date) DO UPDATE
+        SET habit_text=EXCLUDED.habit_text, habit_status=EXCLUDED.habit_status, marked_by=EXCLUDED.marked_by
+        WHERE c.marked_by <> 'manual' AND EXCLUDED.marked_by = 'manual'
+        RETURNING c.*
+    )
+    SELECT ROW(u.*)::core_habit_log, TRUE, NULL::daily_score_log FROM upserted u
+    UNION ALL
+    SELECT c, FALSE, NULL::daily_score_log
+    FROM core_habit_log c
+    JOIN input i ON c.user_id = p_user_id AND c.habit_id = i.habit_id AND c.for_date = p_for_date
+    WHERE NOT EXISTS (SELECT 1 FROM upserted u WHERE u.core_log_id = c.core_log_id);
+
+    -- The AFTER triggers have run by now, so their rows are visible here
+    RETURN QUERY
+    SELECT NULL::core_habit_log, NULL::boolean, d
+    FROM daily_score_log d
+    WHERE d.user_id = p_user_id AND d.for_date >= p_for_date AND d.score_type IN ('core', 'streak')
+    ORDER BY d.for_date, d.score_type;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,117 @@
+-- Monthly range partitioning of core_habit_log and daily_score_log on for_date,
+-- plus the monthly_score_summary rollup table used by bot/utils/log_maintenance.py.
+-- Requires 001_core_habit_log_unique.sql (and 002_submit_checkin.sql, which
+-- keeps working unchanged against the partitioned tables).
+--
+-- Partitions are named <table>_yYYYYmMM. Queries that filter on for_date
+-- (every per-day lookup in DBClient) only touch the matching partitions.
+-- Rows for a month without a partition land in <table>_default; keep
+-- partitions created ahead (ensure_log_partitions, run by the maintenance job)
+-- because a month can't get its own partition while the default holds rows for it.
+--
+-- The old tables are kept as <table>_unpartitioned for verification; drop them
+-- once the copy has been checked. Their serial sequences are moved to the new
+-- tables first, so dropping them is safe.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION ensure_log_partitions(p_from date, p_months int)
+RETURNS SETOF text
+LANGUAGE plpgsql AS $$
+DECLARE
+    t text;
+    m date;
+    part text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['core_habit_log', 'daily_score_log'] LOOP
+        FOR i IN 0 .. p_months - 1 LOOP
+            m := (date_trunc('month', p_from) + make_interval(months => i))::date;
+            part := format('%s_y%sm%s', t, to_char(m, 'YYYY'), to_char(m, 'MM'));
+            IF to_regclass(part) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               part, t, m, (m + interval '1 month')::date);
+                RETURN NEXT part;
+            END IF;
+        END LOOP;
+    END LOOP;
+END;
+$$;
+
+-- core_habit_log
+ALTER TABLE core_habit_log RENAME TO core_habit_log_unpartitioned;
+ALTER INDEX core_habit_log_user_habit_date_key RENAME TO core_habit_log_unpartitioned_user_habit_date_key;
+CREATE TABLE core_habit_log (LIKE core_habit_log_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (for_date);
+-- Unique keys on a partitioned table must contain the partition key
+ALTER TABLE core_habit_log ADD PRIMARY KEY (core_log_id, for_date);
+CREATE UNIQUE INDEX core_habit_log_user_habit_date_key ON core_habit_log (user_id, habit_id, for_date);
+CREATE TABLE core_habit_log_default PARTITION OF core_habit_log DEFAULT;
+
+-- daily_score_log
+ALTER TABLE daily_score_log RENAME TO daily_score_log_unpartitioned;
+CREATE TABLE daily_score_log (LIKE daily_score_log_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (for_date);
+ALTER TABLE daily_score_log ADD PRIMARY KEY (score_log_id, for_date);
+CREATE INDEX daily_score_log_user_date ON daily_score_log (user_id, for_date);
+CREATE INDEX daily_score_log_date_type ON daily_score_log (for_date, score_type);
+CREATE TABLE daily_score_log_default PARTITION OF daily_score_log DEFAULT;
+
+-- One partition per month from the oldest row up to two months ahead
+DO $$
+DECLARE
+    oldest date := least((SELECT min(for_date) FROM core_habit_log_unpartitioned),
+                         (SELECT min(for_date) FROM daily_score_log_unpartitioned),
+                         current_date);
+BEGIN
+    PERFORM ensure_log_partitions(oldest,
+        ((extract(year FROM current_date) - extract(year FROM oldest)) * 12
+         + extract(month FROM current_date) - extract(month FROM oldest))::int + 3);
+END $$;
+
+INSERT INTO core_habit_log SELECT * FROM core_habit_log_unpartitioned;
+INSERT INTO daily_score_log SELECT * FROM daily_score_log_unpartitioned;
+
+-- Keep the id sequences (DBClient.reserve_ids uses pg_get_serial_sequence)
+DO $$
+BEGIN
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY core_habit_log.core_log_id',
+                   pg_get_serial_sequence('core_habit_log_unpartitioned', 'core_log_id'));
+    EXECUTE format('ALTER SEQUENCE %s OWNED BY daily_score_log.score_log_id',
+                   pg_get_serial_sequence('daily_score_log_unpartitioned', 'score_log_id'));
+END $$;
+
+-- Recreate the score-deriving triggers on the new parents; row triggers on a
+-- partitioned table fire for every partition. Created after the copy so the
+-- copied rows don't re-derive daily_score_log.
+DO $$
+DECLARE
+    r record;
+BEGIN
+    FOR r IN
+        SELECT pg_get_triggerdef(oid) AS def FROM pg_trigger
+        WHERE tgrelid IN ('core_habit_log_unpartitioned'::regclass, 'daily_score_log_unpartitioned'::regclass)
+          AND NOT tgisinternal
+    LOOP
+        EXECUTE replace(r.def, '_unpartitioned ', ' ');
+    END LOOP;
+END $$;
+
+-- Compact per-user monthly rollup of closed months (see DBClient.rollup_month)
+CREATE TABLE IF NOT EXISTS monthly_score_summary (
+    user_id int8 NOT NULL,
+    year_month text NOT NULL,
+    username text,
+    days_checked_in int NOT NULL DEFAULT 0,
+    clean_days int NOT NULL DEFAULT 0,
+    done_count int NOT NULL DEFAULT 0,
+    missed_count int NOT NULL DEFAULT 0,
+    rest_count int NOT NULL DEFAULT 0,
+    dnd_count int NOT NULL DEFAULT 0,
+    core_total int NOT NULL DEFAULT 0,
+    streak_end int,
+    streak_max int,
+    rolled_up_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, year_month)
+);
+
+COMMIT;
@@ -0,0 +1,28 @@
+-- Scheduler bookkeeping that has to survive restarts and deploys
+-- (see bot/utils/scheduler_state.py): how many reminders each user got for
+-- the current day, when the last one went out, when they were last
+-- auto-marked, plus a few global flags such as the day the channel summary
+-- was last posted.
+--
+-- Rows are upserted in one batch per scheduler tick. At startup only rows
+-- touched in the last day and a half are read (scheduler_user_state_updated),
+-- and rows older than two days are pruned at each day change.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS scheduler_user_state (
+    user_id int8 PRIMARY KEY,
+    reminder_count int NOT NULL DEFAULT 0,
+    last_reminder_at timestamptz,
+    last_auto_at timestamptz,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS scheduler_user_state_updated ON scheduler_user_state (updated_at);
+
+CREATE TABLE IF NOT EXISTS scheduler_flags (
+    name text PRIMARY KEY,
+    value text,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+COMMIT;
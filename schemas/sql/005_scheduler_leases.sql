@@ -0,0 +1,25 @@
+-- Leases that let several processes run the scheduler without doubling any
+-- reminder (see bot/utils/scheduler_leases.py). Users are split into
+-- SCHEDULER_SHARDS shards by user_id % SCHEDULER_SHARDS; each shard is owned by
+-- at most one worker at a time, and shard -1 is the leader lease that runs the
+-- daily channel summary and the maintenance jobs.
+--
+-- Workers heartbeat into scheduler_workers and renew their leases every third
+-- of the lease time. A lease that isn't renewed expires and is claimed by
+-- another worker; every worker aims for its fair share
+-- ceil(shards / live workers), releasing extras when a new worker joins.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS scheduler_workers (
+    worker_id text PRIMARY KEY,
+    heartbeat_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+    shard int PRIMARY KEY,
+    owner text NOT NULL,
+    expires_at timestamptz NOT NULL
+);
+
+COMMIT;
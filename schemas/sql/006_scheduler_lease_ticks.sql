@@ -0,0 +1,10 @@
+-- Last scheduler pass per shard (see bot/utils/scheduler_leases.py). Every
+-- heartbeat stamps the owner's last tick on the leases it renews. A worker that
+-- claims a dead worker's shard gets that worker's last tick back with the lease,
+-- so the auto-marks the dead worker slept through are caught up.
+
+BEGIN;
+
+ALTER TABLE scheduler_leases ADD COLUMN IF NOT EXISTS last_tick_at timestamptz;
+
+COMMIT;
@@ -0,0 +1,173 @@
+import asyncio
+import inspect
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from bot.utils import db_stats, scoring
+from bot.utils.db import DBClient
+from bot.utils.local_db import LocalDBClient
+
+FAILURES = []
+
+def report(name, ok):
+    print("PASS" if ok else "FAIL")
+    if not ok:
+        FAILURES.append(name)
+
+async def local_client():
+    # A file per test, so tests don't see each other's rows (':memory:' is shared per process)
+    db = LocalDBClient(os.path.join(tempfile.mkdtemp(), "test.db"))
+    await db.connect()
+    return db
+
+async def add_test_user(db, habits=3, year_month="202507"):
+    await db.add_user(9999999999, "TestUser", "TestNick", "🐍", date(2000, 1, 1), "UTC", "test@example.com")
+    for h in range(habits):
+        await db.add_habit(9999999999, "TestUser", year_month, f"Habit {h + 1}", "core")
+    return 9999999999, await db.get_user_habits_for_month(9999999999, year_month)
+
+def checkin(user_id, habit, for_date, status, marked_by):
+    return {'for_date': for_date, 'year_month': for_date.strftime('%Y%m'), 'user_id': user_id, 'username': "TestUser",
+            'habit_id': habit['habit_id'], 'habit_text': habit['habit_text'], 'habit_status': status, 'marked_by': marked_by}
+
+# --- LocalDBClient as a DBClient stand-in ---
+async def test_interface_matches_dbclient():
+    start = time.perf_counter()
+    print("\n[Test] LocalDBClient has every DBClient coroutine with the same parameters")
+    def public(cls):
+        return {name: method for name, method in vars(cls).items()
+                if not name.startswith('_') and (inspect.iscoroutinefunction(method) or inspect.isasyncgenfunction(method))}
+    db_methods, local_methods = public(DBClient), public(LocalDBClient)
+    missing = sorted(set(db_methods) - set(local_methods))
+    differ = sorted(name for name in set(db_methods) & set(local_methods)
+                    if list(inspect.signature(db_methods[name]).parameters) != list(inspect.signature(local_methods[name]).parameters))
+    print("Expected: missing=[], differ=[]")
+    print(f"Actual: missing={missing}, differ={differ}")
+    report("interface_matches_dbclient", not missing and not differ)
+    end = time.perf_counter()
+    print(f"Time taken: {((end-start)*1000):.2f} ms")
+
+async def test_daily_scores_derived_on_write():
+    start = time.perf_counter()
+    print("\n[Test] daily_score_log rows derived like the production triggers")
+    db = await local_client()
+    user_id, habits = await add_test_user(db)
+    first = date(2025, 7, 1)
+    days = [
+        [scoring.DONE, scoring.DONE, scoring.REST],      # clean day: +1
+        [scoring.MISSED, scoring.MISSED, scoring.DONE],  # -2, snake dies
+        [scoring.DONE, scoring.DONE, scoring.DONE],      # restarts from 0
+        None,                                            # no check-in
+        [scoring.DND, scoring.DND, scoring.DND],         # all DND: 0, fresh start
+    ]
+    expected, prev = {}, None
+    for d, statuses in enumerate(days):
+        for_date = first + timedelta(days=d)
+        if statuses is None:
+            prev = None
+            continue
+        await db.add_checkins([checkin(user_id, h, for_date, s, 'manual') for h, s in zip(habits, statuses)])
+        core = scoring.core_score(statuses)
+        prev = scoring.streak_score(prev, core)
+        expected[(str(for_date), 'core')] = core
+        expected[(str(for_date), 'streak')] = prev
+    actual = {(str(r['for_date']), r['score_type']): r['score'] for r in await db.get_daily_scores_since(user_id, first)}
+    print(f"Expected: {expected}")
+    print(f"Actual: {actual}")
+    report("daily_scores_derived_on_write", actual == expected)
+    end = time.perf_counter()
+    print(f"Time taken: {((end-start)*1000):.2f} ms")
+
+# --- Upsert precedence (manual over auto) ---
+async def test_manual_over_auto_precedence():
+    start = time.perf_counter()
+    print("\n[Test] add_checkins upsert: manual beats auto, nothing else overwrites, replays are no-ops")
+    db = await local_client()
+    user_id, habits = await add_test_user(db, habits=2)
+    for_date = date(2025, 7, 10)
+    steps = [
+        ("auto on empty", [checkin(user_id, habits[0], for_date, scoring.MISSED, 'auto')]),
+        ("manual over auto", [checkin(user_id, habits[0], for_date, scoring.DONE, 'manual')]),
+        ("auto over manual", [checkin(user_id, habits[0], for_date, scoring.MISSED, 'auto')]),
+        ("manual over manual", [checkin(user_id, habits[0], for_date, scoring.MISSED, 'manual')]),
+        ("mixed batch", [checkin(user_id, habits[0], for_date, scoring.MISSED, 'auto'),
+                         checkin(user_id, habits[1], for_date, scoring.DND, 'auto')]),
+        ("replayed batch", [checkin(user_id, habits[0], for_date, scoring.MISSED, 'auto'),
+                            checkin(user_id, habits[1], for_date, scoring.DND, 'auto')]),
+    ]
+    actual = {}
+    for name, batch in steps:
+        landed = await db.add_checkins(batch)
+        actual[name] = [(r['habit_status'], r['marked_by'], r['written']) for r in landed]
+    stored = [r async for r in db.iter_query('SELECT * FROM core_habit_log WHERE user_id=$1', user_id, table='core_habit_log')]
+    expected = {
+        "auto on empty": [(scoring.MISSED, 'auto', True)],
+        "manual over auto": [(scoring.DONE, 'manual', True)],
+        "auto over manual": [(scoring.DONE, 'manual', False)],
+        "manual over manual": [(scoring.DONE, 'manual', False)],
+        "mixed batch": [(scoring.DONE, 'manual', False), (scoring.DND, 'auto', True)],
+        "replayed batch": [(scoring.DONE, 'manual', False), (scoring.DND, 'auto', False)],
+    }
+    print(f"Expected: {expected}, 2 stored rows")
+    print(f"Actual: {actual}, {len(stored)} stored rows")
+    report("manual_over_auto_precedence", actual == expected and len(stored) == 2)
+    end = time.perf_counter()
+    print(f"Time taken: {((end-start)*1000):.2f} ms")
+
+# --- Query stats (db_stats) ---
+class FakeConnection:
+    """Records the statements it is given; EXPLAIN returns a one-line plan."""
+    def __init__(self):
+        self.statements = []
+
+    async def fetch(self, query, *args):
+        self.statements.append(query)
+        return [("Seq Scan on users",)] if query.startswith("EXPLAIN") else [{'user_id': 1}, {'user_id': 2}]
+
+    async def execute(self, query, *args):
+        self.statements.append(query)
+        return "UPDATE 3"
+
+async def test_query_stats_explain_only_readonly():
+    start = time.perf_counter()
+    print("\n[Test] TimedConnection records calls/rows and EXPLAINs slow statements only on read-only connections")
+    stats = db_stats.QueryStats(slow_ms=0)  # every statement counts as slow
+    explain, db_stats.DB_EXPLAIN_SLOW = db_stats.DB_EXPLAIN_SLOW, True
+    try:
+        write_conn, read_conn = FakeConnection(), FakeConnection()
+        await db_stats.TimedConnection(write_conn, 'submit', stats).execute("SELECT submit_checkin($1)", 1)
+        await db_stats.TimedConnection(read_conn, 'get_users', stats, readonly=True).fetch("SELECT * FROM users")
+    finally:
+        db_stats.DB_EXPLAIN_SLOW = explain
+    snapshot = stats.snapshot()
+    actual = {
+        'calls': {name: (q['calls'], q['rows']) for name, q in snapshot['queries'].items()},
+        'plans': {e['name']: e.get('plan') for e in snapshot['slow_queries']},
+        'write_statements': len(write_conn.statements),
+        'read_statements': len(read_conn.statements),
+    }
+    expected = {
+        'calls': {'submit': (1, 3), 'get_users': (1, 2)},
+        'plans': {'submit': None, 'get_users': "Seq Scan on users"},
+        'write_statements': 1,
+        'read_statements': 2,
+    }
+    print(f"Expected: {expected}")
+    print(f"Actual: {actual}")
+    report("query_stats_explain_only_readonly", actual == expected)
+    end = time.perf_counter()
+    print(f"Time taken: {((end-start)*1000):.2f} ms")
+
+async def main():
+    await test_interface_matches_dbclient()
+    await test_daily_scores_derived_on_write()
+    await test_manual_over_auto_precedence()
+    await test_query_stats_explain_only_readonly()
+    print(f"\n{len(FAILURES)} failed: {', '.join(FAILURES)}" if FAILURES else "\nAll passed")
+    sys.exit(1 if FAILURES else 0)
+
+if __name__ == "__main__":
+    asyncio.run(main())
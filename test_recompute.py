@@ -0,0 +1,117 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from bot.utils import scoring
+from bot.utils.local_db import LocalDBClient, seed_synthetic_data
+from bot.utils.recompute import _NO_ROW, compute_scores, correct_checkin, recompute_scores
+
+FAILURES = []
+
+def report(name, ok):
+    print("PASS" if ok else "FAIL")
+    if not ok:
+        FAILURES.append(name)
+
+async def local_client():
+    # A file per test, so tests don't see each other's rows (':memory:' is shared per process)
+    db = LocalDBClient(os.path.join(tempfile.mkdtemp(), "test.db"))
+    await db.connect()
+    return db
+
+def reference_scores(total, missed, dnd, seed):
+    """Day-by-day scores with scoring.core_score/streak_score, as the production triggers derive them."""
+    users, days = total.shape
+    core = np.zeros((users, days), dtype=np.int64)
+    streak = np.zeros((users, days), dtype=np.int64)
+    for u in range(users):
+        prev = None if seed[u] == _NO_ROW else int(seed[u])
+        for d in range(1, days):
+            if total[u, d] == 0:
+                prev = None
+                continue
+            done = total[u, d] - missed[u, d] - dnd[u, d]
+            statuses = [scoring.MISSED] * missed[u, d] + [scoring.DND] * dnd[u, d] + [scoring.DONE] * done
+            core[u, d] = scoring.core_score(statuses)
+            streak[u, d] = scoring.streak_score(prev, int(core[u, d]))
+            prev = int(streak[u, d])
+    return core, streak
+
+# --- compute_scores (vectorized engine) ---
+async def test_compute_scores_random():
+    start = time.perf_counter()
+    print("\n[Test] compute_scores vs scoring.streak_score on random data")
+    rng = np.random.default_rng(0)
+    users, days = 200, 120
+    total = rng.integers(0, 5, size=(users, days))
+    # Some users skip whole weeks, so streaks restart mid-range
+    total[rng.random((users, days)) < 0.1] = 0
+    missed = rng.integers(0, total + 1)
+    dnd = rng.integers(0, total - missed + 1)
+    seed = np.where(rng.random(users) < 0.5, rng.integers(-3, 30, size=users), _NO_ROW)
+    has, core, streak = compute_scores(total, missed, dnd, seed)
+    ref_core, ref_streak = reference_scores(total, missed, dnd, seed)
+    cells = has[:, 1:]
+    core_diff = int((core[:, 1:] != ref_core[:, 1:])[cells].sum())
+    streak_diff = int((streak[:, 1:] != ref_streak[:, 1:])[cells].sum())
+    print(f"Expected: 0 mismatching core/streak cells out of {int(cells.sum())}")
+    print(f"Actual: {core_diff} core, {streak_diff} streak")
+    report("compute_scores_random", core_diff == 0 and streak_diff == 0 and (has[:, 1:] == (total[:, 1:] > 0)).all())
+    end = time.perf_counter()
+    print(f"Time taken: {((end-start)*1000):.2f} ms")
+
+async def test_recompute_scores_matches_local_triggers():
+    start = time.perf_counter()
+    print("\n[Test] recompute_scores finds nothing to change in trigger-derived rows")
+    db = await local_client()
+    first = date(2025, 5, 1)
+    await seed_synthetic_data(db, 20, 45, start=first, seed=1)
+    result = await recompute_scores(first, first + timedelta(days=44), db_client=db)
+    print("Expected: update=0, insert=0")
+    print(f"Actual: update={result['update']}, insert={result['insert']} ({result['checkins']} check-ins)")
+    report("recompute_scores_matches_local_triggers", result['update'] == 0 and result['insert'] == 0 and result['checkins'] > 0)
+    end = time.perf_counter()
+    print(f"Time taken: {((end-start)*1000):.2f} ms")
+
+# --- correct_checkin (incremental forward recompute) ---
+async def test_correct_checkin_matches_full_recompute():
+    start = time.perf_counter()
+    print("\n[Test] correct_checkin leaves the same scores as a full recompute")
+    db = await local_client()
+    first, days = date(2025, 5, 1), 75
+    user_ids = await seed_synthetic_data(db, 5, days, start=first, seed=2)
+    user_id, for_date = user_ids[0], date(2025, 6, 10)
+    habits = await db.get_user_habits_for_month(user_id, for_date.strftime('%Y%m'))
+    before = {r['for_date']: r['score'] for r in await db.get_daily_scores_since(user_id, first) if r['score_type'] == 'streak'}
+    result = await correct_checkin(user_id, "user0", for_date,
+                                   [(h['habit_id'], h['habit_text'], scoring.MISSED) for h in habits], db_client=db)
+    stored = [r async for r in db.iter_query('SELECT * FROM core_habit_log WHERE user_id=$1 AND for_date=$2',
+                                             user_id, for_date, table='core_habit_log')]
+    after = {r['for_date']: r['score'] for r in await db.get_daily_scores_since(user_id, first) if r['score_type'] == 'streak'}
+    full = await recompute_scores(first, first + timedelta(days=days - 1), db_client=db)
+    changed = sorted(d for d in after if after[d] != before.get(d))
+    print(f"Expected: all {len(habits)} habits ❌ (manual), streaks changed from {for_date} on, full recompute update=0 insert=0")
+    print(f"Actual: {[(r['habit_status'], r['marked_by']) for r in stored]}, changed {changed[:1]}..{changed[-1:]} "
+          f"({result}), full recompute update={full['update']} insert={full['insert']}")
+    report("correct_checkin_matches_full_recompute",
+           len(stored) == len(habits) and all(r['habit_status'] == scoring.MISSED and r['marked_by'] == 'manual' for r in stored)
+           and changed and str(changed[0]) == str(for_date) and full['update'] == 0 and full['insert'] == 0)
+    end = time.perf_counter()
+    print(f"Time taken: {((end-start)*1000):.2f} ms")
+
+async def main():
+    random.seed(0)
+    await test_compute_scores_random()
+    await test_recompute_scores_matches_local_triggers()
+    await test_correct_checkin_matches_full_recompute()
+    print(f"\n{len(FAILURES)} failed: {', '.join(FAILURES)}" if FAILURES else "\nAll passed")
+    sys.exit(1 if FAILURES else 0)
+
+if __name__ == "__main__":
+    asyncio.run(main())